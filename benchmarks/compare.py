@@ -0,0 +1,59 @@
+import argparse
+import json
+import sys
+
+# Compare two benchmark result files:
+#
+#   python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+#
+# Prints every metric of every case present in both runs with the new/old
+# ratio, and exits with status 1 if any got slower (or bigger) by more than
+# the threshold.
+
+def metrics(case):
+    """Flatten a result case into {metric: value}; lower is better for all of them"""
+    flat = {}
+    for key, value in case.items():
+        if isinstance(value, dict):
+            flat[f"{key}.median_ms"] = value["median_ms"]
+            flat[f"{key}.p95_ms"] = value["p95_ms"]
+        elif key.endswith("_s") or key.endswith("_mb"):
+            flat[key] = value
+    return flat
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    old_cases = {(c["backend"], c["population"]): c for c in old["results"]}
+
+    print(f"{old['commit']} -> {new['commit']}")
+    regressions = 0
+    for case in new["results"]:
+        key = (case["backend"], case["population"])
+        if key not in old_cases:
+            continue
+        print(f"\n{case['backend']} / {case['population']} users")
+        old_metrics = metrics(old_cases[key])
+        for name, value in metrics(case).items():
+            before = old_metrics.get(name)
+            if before is None:
+                continue
+            ratio = value / before if before else float("inf") if value else 1.0
+            flag = ""
+            if ratio > 1 + args.threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"  {name:<40} {before:>12} -> {value:>12}  x{ratio:.2f}{flag}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
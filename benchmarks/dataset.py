@@ -0,0 +1,50 @@
+import random
+
+from reminders import DAYS_ORDER
+
+# Synthetic lesson data shaped like lessons_data.json: real users mostly share a
+# seeded template schedule (about 15 lessons on weekday mornings and
+# afternoons, two thirds with a "15 min" reminder) and add a few lessons of
+# their own.
+
+SUBJECTS = [
+    "Calculus 2", "Physics 2", "Sociology", "Physical Training",
+    "Kyrgyz Language (Elementary Level)", "Geography of Kyrgyzstan", "Programming 2",
+    "Linear Algebra", "English", "History of Kyrgyzstan", "Philosophy", "Chemistry",
+    "Discrete Mathematics", "Databases", "Economics", "Statistics"
+]
+TIMES = ["08:00", "09:00", "09:30", "11:00", "12:00", "13:30", "15:00", "15:30", "17:00", "17:30", "18:00"]
+# Reminder mix of the real data, with the other offsets as occasional choices
+REMINDERS = ["15 min"] * 14 + ["No reminder"] * 6 + ["5 min", "30 min", "1 hour"]
+
+def make_lesson(rng, subject=None):
+    return {
+        "day": rng.choice(DAYS_ORDER[:6]),
+        "time": rng.choice(TIMES),
+        "subject": subject or rng.choice(SUBJECTS),
+        "notification_time": rng.choice(REMINDERS),
+        "last_notified": None
+    }
+
+def make_template(rng, size=15):
+    return [make_lesson(rng) for _ in range(size)]
+
+def make_population(users, seed=0, templates=20):
+    """{user_id: [lesson, ...]} for ``users`` users.
+
+    Most users copy one of a few templates (as if seeded from a group
+    schedule) and add 0-4 lessons of their own; a fifth build their schedule
+    from scratch.
+    """
+    rng = random.Random(seed)
+    shared = [make_template(rng) for _ in range(templates)]
+    data = {}
+    for i in range(users):
+        user_id = str(100000000 + i)
+        if rng.random() < 0.8:
+            lessons = [dict(lesson) for lesson in rng.choice(shared)]
+            lessons += [make_lesson(rng) for _ in range(rng.randint(0, 4))]
+        else:
+            lessons = [make_lesson(rng) for _ in range(rng.randint(3, 20))]
+        data[user_id] = lessons
+    return data
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Benchmarks for the storage and reminder hot paths on synthetic populations.
+#
+#   python -m benchmarks.run                     # 1k, 10k and 100k users, all backends
+#   python -m benchmarks.run --users 1000 --backends json sqlite
+#
+# Every (backend, population) case runs in its own process so peak RSS and
+# load times aren't skewed by earlier cases. Results are written as JSON to
+# benchmarks/results/<commit>.json; compare two runs with benchmarks.compare.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BISHKEK_TZ = ZoneInfo("Asia/Bishkek")
+
+BACKENDS = ["json", "journal", "sharded", "sqlite"]
+DEFAULT_USERS = [1000, 10000, 100000]
+
+def open_store(backend, workdir):
+    """Open the given backend's store on the files in ``workdir``"""
+    if backend == "json":
+        from json_store import JsonLessonStore
+        return JsonLessonStore(os.path.join(workdir, "lessons_data.json"))
+    if backend == "journal":
+        from journal_store import JournalLessonStore
+        return JournalLessonStore(os.path.join(workdir, "lessons_data.json"))
+    if backend == "sharded":
+        from sharded_store import ShardedLessonStore
+        return ShardedLessonStore(os.path.join(workdir, "lessons_data"))
+    if backend == "sqlite":
+        from sqlite_store import SqliteLessonStore
+        return SqliteLessonStore(os.path.join(workdir, "lessons.db"))
+    raise ValueError(f"Unknown backend: {backend}")
+
+def timings(samples):
+    """Summary of a list of durations in seconds, in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+def repeat(func, max_runs, budget):
+    """Time ``func()`` up to ``max_runs`` times or until ``budget`` seconds are spent"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (not samples or time.perf_counter() - started < budget):
+        t = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t)
+    return timings(samples)
+
+def prepare_case(backend, workdir, population_file):
+    """Write a population into a fresh store of the given backend"""
+    with open(population_file, 'r') as f:
+        data = json.load(f)
+    store = open_store(backend, workdir)
+    store.replace_all(data)
+
+def measure_case(backend, workdir, budget):
+    """Measure one prepared store; returns a dict of results"""
+    # database.py creates its own store on first use; run it on the prepared one instead
+    import database
+    from lesson_table import LessonTable
+    from render_cache import RenderCache
+    from views import build_schedule_text
+
+    result = {}
+    t = time.perf_counter()
+    store = open_store(backend, workdir)
+    store.user_lessons("0")
+    result["load_s"] = round(time.perf_counter() - t, 3)
+    database._store = store
+
+    # Startup: every reminder lesson into the columnar table and all fire times
+    t = time.perf_counter()
+    table = LessonTable.from_lessons(database.get_reminder_lessons(), database.get_user_timezones())
+    table.next_fire_epochs(int(time.time()))
+    result["reminder_rebuild_s"] = round(time.perf_counter() - t, 3)
+    result["reminder_lessons"] = len(table)
+
+    all_lessons = store.all_lessons()
+    user_ids = list(all_lessons)
+    result["users"] = len(user_ids)
+    result["lessons"] = sum(len(lessons) for lessons in all_lessons.values())
+    del all_lessons
+    rng = random.Random(1)
+
+    # Tick: the reminders firing in one minute, from storage and from the table
+    busy_minutes = sorted(set(int(m) for m in table.fire_minutes))
+    monday = int(datetime(2026, 1, 5, tzinfo=BISHKEK_TZ).timestamp())
+    result["tick_storage"] = repeat(
+        lambda: database.get_lessons_firing_between(*_minute_range(rng.choice(busy_minutes))), 50, budget
+    )
+    def table_tick():
+        start = monday + rng.choice(busy_minutes) * 60
+        table.due_between(start, start + 60)
+    result["tick_table"] = repeat(table_tick, 200, budget)
+
+    # Mutations, through database.py as the bot calls them
+    added = []
+    def add():
+        user_id = rng.choice(user_ids)
+        added.append((user_id, database.add_lesson(user_id, "saturday", "10:00", "Benchmark", "15 min")["id"]))
+    result["add_lesson"] = repeat(add, 50, budget)
+    result["update_lesson_reminder"] = repeat(
+        lambda: database.update_lesson_reminder(*rng.choice(added), rng.choice(["5 min", "1 hour"])), 50, budget
+    )
+    def flush_last_notified():
+        stamp = datetime.now(BISHKEK_TZ).isoformat()
+        database.update_lessons_last_notified([(u, l, stamp) for u, l in rng.sample(added, min(20, len(added)))])
+    result["update_lessons_last_notified"] = repeat(flush_last_notified, 50, budget)
+    result["remove_lesson"] = repeat(lambda: database.remove_lesson(*added.pop()), len(added), budget)
+
+    # Rendering /schedule: storage read + sort + formatting, and a cache hit
+    result["render_schedule"] = repeat(
+        lambda: build_schedule_text(database.get_week_schedule(rng.choice(user_ids))), 200, budget
+    )
+    cache = RenderCache()
+    cached_user = user_ids[0]
+    cache.put((cached_user, "schedule"), database.schedule_version(cached_user), "text")
+    result["render_schedule_cached"] = repeat(
+        lambda: cache.get((cached_user, "schedule"), database.schedule_version(cached_user)), 1000, budget
+    )
+
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+def _minute_range(minute):
+    return minute, (minute + 1) % (7 * 24 * 60)
+
+def run_child(args):
+    cmd = [sys.executable, "-m", "benchmarks.run"] + args
+    env = dict(os.environ, PYTHONPATH=ROOT, STORAGE_BACKEND="json")
+    output = subprocess.run(cmd, cwd=args[args.index("--workdir") + 1], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1]) if output.strip() else None
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lesson storage and reminder hot paths")
+    parser.add_argument("--users", type=int, nargs="+", default=DEFAULT_USERS)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--budget", type=float, default=5.0,
+                        help="seconds to spend on each timed operation at most")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--prepare", nargs=2, metavar=("BACKEND", "POPULATION"), help=argparse.SUPPRESS)
+    parser.add_argument("--measure", metavar="BACKEND", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        prepare_case(args.prepare[0], args.workdir, args.prepare[1])
+        return
+    if args.measure:
+        print(json.dumps(measure_case(args.measure, args.workdir, args.budget)))
+        return
+
+    from benchmarks.dataset import make_population
+
+    commit = git_commit()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="remindelion-bench-") as tmp:
+        for users in args.users:
+            population_file = os.path.join(tmp, f"population-{users}.json")
+            with open(population_file, 'w') as f:
+                json.dump(make_population(users), f)
+            for backend in args.backends:
+                workdir = os.path.join(tmp, f"{backend}-{users}")
+                os.makedirs(workdir)
+                print(f"{backend} / {users} users ...", file=sys.stderr, flush=True)
+                t = time.perf_counter()
+                run_child(["--workdir", workdir, "--prepare", backend, population_file])
+                prepare_s = round(time.perf_counter() - t, 3)
+                case = run_child(["--workdir", workdir, "--measure", backend, "--budget", str(args.budget)])
+                results.append(dict(backend=backend, population=users, prepare_s=prepare_s, **case))
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            "commit": commit,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results
+        }, f, indent=4)
+    print(out)
+
+if __name__ == "__main__":
+    main()
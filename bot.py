@@ -1,13 +1,7 @@
-from datetime import datetime
-from zoneinfo import ZoneInfo
-
-# Timezone for Bishkek (UTC+6)
-BISHKEK_TZ = ZoneInfo("Asia/Bishkek")
-
-print("Server time (UTC):", datetime.now())
-print("Bishkek time:", datetime.now(BISHKEK_TZ))
-
+import time
 
+# Start of the startup profile (STARTUP_PROFILE=1), taken before the heavy imports
+STARTED = time.perf_counter()
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
@@ -17,22 +11,151 @@ from telegram.ext import (
     ConversationHandler,
     ContextTypes,
     filters,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler
 )
+from telegram.error import BadRequest, NetworkError, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
 import logging
 from config import BOT_TOKEN
-from database import (
+from storage import (
     add_lesson,
     remove_lesson,
     get_user_lessons,
+    get_own_lessons,
     get_week_schedule,
     update_lesson_reminder,
     seed_user_lessons_from_existing,
-    get_all_lessons,
-    update_lesson_last_notified
+    get_reminder_lessons,
+    get_lesson,
+    get_day_lessons,
+    update_lessons_last_notified,
+    get_lessons_firing_between,
+    get_followed_template,
+    get_template_followers,
+    get_template_reminder_lessons,
+    get_template_lessons_firing_between,
+    update_template_notified,
+    get_user_timezone,
+    get_user_timezones,
+    set_user_timezone,
+    get_zone_reminder_lessons,
+    get_broadcast,
+    save_broadcast,
+    get_digest_time,
+    set_digest_time,
+    get_digest_subscribers,
+    get_day_lessons_of_users,
+    data_stamp,
+    schedule_version,
+    user_schedule_version,
+    version_mark
+)
+import storage
+import metrics
+from database import STORAGE_BACKEND
+import profiling
+from dispatch import MessageDispatcher, TokenBucket
+from broadcast import Broadcast, new_broadcast, progress_text
+from persistence import StorePersistence
+from render_cache import RenderCache
+from views import build_schedule_text, build_day_lessons_text
+from leases import LeaseManager, shard_of
+from timezones import DEFAULT_TIMEZONE, get_zone, is_valid_timezone, offset_valid_until, utc_offset
+from reminders import (
+    DAYS_ORDER,
+    MINUTES_PER_WEEK,
+    MONDAY_EPOCH,
+    TEMPLATE_REMINDER,
+    WINDOW_SECONDS,
+    parse_notification_minutes,
+    stamp_epoch,
+    schedule_lesson_reminder,
+    cancel_lesson_reminder,
+    forget_reminder_job,
+    schedule_all_reminders,
+    find_missed_reminders
 )
+import asyncio
+import hashlib
+import io
+import os
 import re
-from datetime import datetime, timedelta
+import signal
+import socket
+from datetime import datetime, timedelta, timezone
+
+# Webhook mode is used when WEBHOOK_URL is set (e.g. on Fly.io); otherwise the bot polls
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+PORT = int(os.environ.get("PORT", "8080"))
+
+# Rendered /schedule, /lessons_today and /lessons_tomorrow messages, per user and schedule version
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "1024"))
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+# On startup, reminders that fell due this long ago while the bot was down are
+# still sent if their lesson hasn't started yet (0 turns the catch-up off), at
+# most CATCHUP_MAX_REMINDERS messages in all, user and template lessons alike
+CATCHUP_LOOKBACK = timedelta(minutes=int(os.environ.get("CATCHUP_LOOKBACK_MINUTES", "60")))
+CATCHUP_MAX_REMINDERS = int(os.environ.get("CATCHUP_MAX_REMINDERS", "500"))
+
+# With REMINDER_SHARDS set, users are split into that many shards by user ID
+# hash and every bot process sending reminders holds leases on some of them
+# in the LEASE_DB SQLite file, so several processes share the reminder load
+# without sending anything twice. BOT_ROLE=reminders runs a process that only
+# sends reminders, BOT_ROLE=updates one that only answers updates.
+# LEASE_DB has no default: every worker must open the same file, so it has to
+# be a path on storage they all see (Fly machines don't share volumes; each
+# would lease every shard and send every reminder).
+REMINDER_SHARDS = int(os.environ.get("REMINDER_SHARDS", "0"))
+LEASE_DB = os.environ.get("LEASE_DB")
+LEASE_TTL = float(os.environ.get("LEASE_TTL_SECONDS", "30"))
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+BOT_ROLE = os.environ.get("BOT_ROLE", "all")
+
+# The reminder index (LessonTable) is saved here on shutdown and loaded on the
+# next start if the lessons haven't changed since, instead of being rebuilt
+REMINDER_INDEX_FILE = os.environ.get("REMINDER_INDEX_FILE", "reminder_index.marshal")
+
+def lesson_table_class():
+    """The LessonTable class, imported on first use so NumPy doesn't slow down startup"""
+    from lesson_table import LessonTable
+    return LessonTable
+
+# Conversation states and user_data of unfinished flows are written to the
+# lesson store this often (and on shutdown), so a restart doesn't drop users
+# out of them
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL_SECONDS", "60"))
+
+# STARTUP_PROFILE=1 logs how long each startup phase took, up to the first update
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE") == "1"
+# Handler group of the startup profile's first-update probe, ahead of all others
+STARTUP_PROFILE_GROUP = -100
+
+# Prometheus metrics are served on this local port; 0 turns the endpoint off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9090"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# Handler calls taking this long are logged with their storage and Telegram time
+SLOW_HANDLER_SECONDS = float(os.environ.get("SLOW_HANDLER_SECONDS", "1"))
+
+# /profile captures run for PROFILE_SECONDS unless given, at most PROFILE_MAX_SECONDS
+PROFILE_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+# Telegram user IDs allowed to use /broadcast, comma-separated
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+}
+# Broadcasts share the Telegram rate limit with reminders; fewer senders
+# than the reminder dispatcher leave most of it to reminders
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "4"))
+BROADCAST_REPORT_INTERVAL = float(os.environ.get("BROADCAST_REPORT_INTERVAL_SECONDS", "10"))
+
+# Morning digests also get their own senders on the shared rate limit, so a
+# burst of digests at a popular time doesn't hold up reminders
+DIGEST_WORKERS = int(os.environ.get("DIGEST_WORKERS", "4"))
 
 # Conversation states
 CHOOSING_ACTION, WAITING_LESSON_INPUT, ASKING_REMINDER, WAITING_NOTIFICATION, WAITING_REMOVE_INPUT, WAITING_REMINDER_LESSON_INPUT, WAITING_REMINDER_CHOICE, WAITING_COURSE_NAME, WAITING_DAY_SELECTION, WAITING_TIME_INPUT, WAITING_REMOVE_DAY_SELECTION, WAITING_REMOVE_LESSON_SELECTION, WAITING_TOGGLE_DAY_SELECTION, WAITING_TOGGLE_LESSON_SELECTION = range(14)
@@ -47,6 +170,8 @@ HELP_TEXT = """<b>📚 Available Commands:</b>
 /add_lesson - Add a new lesson to your schedule
 /remove_lesson - Remove a lesson from your schedule
 /turn_on_off - Turn on/off reminder for a specific lesson
+/timezone - Show or change your timezone
+/digest - Get today's lessons every morning
 /help - Show this help message
 
 <i>Note: Telegram commands can't contain spaces.</i>"""
@@ -63,6 +188,18 @@ I'm here to help you manage and remember your lessons! 📖
 
 Use /help to see all available commands, or try /add_lesson to get started!"""
 
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that records the duration of every Bot API request"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.TELEGRAM_API_SECONDS.labels(url.rsplit("/", 1)[-1]).observe(elapsed)
+            metrics.add_call_time("telegram", elapsed)
+
 def validate_time_format(time_str):
     """Validate time format (HH:MM in 24-hour format)"""
     pattern = r'^([0-1][0-9]|2[0-3]):[0-5][0-9]$'
@@ -76,7 +213,7 @@ def validate_day(day):
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user_id = update.effective_user.id
-    lessons = ensure_user_schedule(user_id)
+    lessons = await ensure_user_schedule(user_id, context.job_queue)
     if lessons:
         await update.message.reply_text(
             START_TEXT
@@ -100,136 +237,358 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     await update.message.reply_text(HELP_TEXT, parse_mode="HTML")
 
-def build_schedule_text(lessons):
-    """Return formatted schedule text grouped by day"""
-    from collections import defaultdict
-    lessons_by_day = defaultdict(list)
-    for lesson in lessons:
-        lessons_by_day[lesson['day'].lower()].append(lesson)
-
-    schedule_text = "📅 <b>Your Weekly Schedule:</b>\n\n"
-    days_order = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-    for day in days_order:
-        if day in lessons_by_day:
-            schedule_text += f"<b>📌 {day.capitalize()}:</b>\n"
-            for lesson in lessons_by_day[day]:
-                schedule_text += f"   • {lesson['time']} - {lesson['subject']} <i>(⏰ {lesson['notification_time']})</i>\n"
-            schedule_text += "\n"
-    return schedule_text
-
-def ensure_user_schedule(user_id):
+async def render_schedule_view(user_id, job_queue, key, build):
+    """Return a rendered schedule view, from the cache when the schedule hasn't changed.
+
+    ``build(lessons)`` renders the view from the user's sorted schedule.
+    Returns None if the user has no lessons.
+    """
+    # Read the version before the lessons, so a concurrent change can only make the entry stale
+    version = await schedule_version(user_id)
+    text = render_cache.get(key, version)
+    if text is None:
+        lessons = await ensure_user_schedule(user_id, job_queue)
+        if not lessons:
+            return None
+        text = build(lessons)
+        render_cache.put(key, version, text)
+    return text
+
+async def ensure_user_schedule(user_id, job_queue):
     """Ensure user has a schedule; seed from existing users if empty."""
-    lessons = get_week_schedule(user_id)
+    lessons = await get_week_schedule(user_id)
     if lessons:
         return lessons
     # Try to seed from another user
-    seeded = seed_user_lessons_from_existing(user_id)
+    seeded = await seed_user_lessons_from_existing(user_id)
     if seeded:
-        return get_week_schedule(user_id)
+        lessons = await get_week_schedule(user_id)
+        await arm_template_reminders(job_queue, await get_followed_template(user_id))
     return lessons
 
-def parse_notification_minutes(notification_time):
-    """Convert notification time string to minutes"""
-    mapping = {
-        "5 min": 5,
-        "15 min": 15,
-        "30 min": 30,
-        "1 hour": 60
-    }
-    return mapping.get(notification_time)
-
-def get_next_lesson_datetime(day, time_str, now):
-    """Get the next occurrence datetime for a lesson day/time"""
-    days_map = {
-        "monday": 0,
-        "tuesday": 1,
-        "wednesday": 2,
-        "thursday": 3,
-        "friday": 4,
-        "saturday": 5,
-        "sunday": 6
-    }
-    target_weekday = days_map.get(day.lower())
-    if target_weekday is None:
-        return None
-
-    hour, minute = map(int, time_str.split(':'))
-    lesson_time_today = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-    days_ahead = (target_weekday - now.weekday()) % 7
-    if days_ahead == 0 and lesson_time_today < now:
-        days_ahead = 7
-
-    lesson_date = (now + timedelta(days=days_ahead)).date()
-    # Return timezone-aware datetime
-    naive_dt = datetime.combine(lesson_date, lesson_time_today.time())
-    return naive_dt.replace(tzinfo=now.tzinfo) if now.tzinfo else naive_dt
-
-async def check_and_send_reminders(context: ContextTypes.DEFAULT_TYPE):
-    """Check upcoming lessons and send reminders"""
-    now = datetime.now(BISHKEK_TZ)  # Use Bishkek timezone
-    all_lessons = get_all_lessons()
-    if not all_lessons:
+def arm_reminder(job_queue, user_id, lesson, zone, now_epoch=None):
+    """Schedule the reminder job of a single lesson of a user in timezone ``zone``"""
+    if REMINDER_SHARDS or BOT_ROLE != "all":
+        # Sharded reminders are found by the minute tick instead
         return
+    if now_epoch is None:
+        now_epoch = int(time.time())
+    schedule_lesson_reminder(job_queue, send_lesson_reminder, user_id, lesson, now_epoch, zone)
 
-    for user_id_str, lessons in all_lessons.items():
-        try:
-            user_id = int(user_id_str)
-        except ValueError:
+async def arm_user_reminders(job_queue, user_id, zone, now_epoch=None):
+    """Arm the reminder jobs of a user's own lessons in timezone ``zone``.
+
+    Template lessons the user follows are sent by the template's job, so
+    arming them here would send them twice.
+    """
+    for lesson in await get_own_lessons(user_id):
+        arm_reminder(job_queue, user_id, lesson, zone, now_epoch)
+
+# Sends reminders concurrently within Telegram's rate limits (started in post_init)
+reminder_dispatcher = None
+
+# last_notified stamps of sent reminders, written in one batch per fire time
+pending_last_notified = []
+FLUSH_LAST_NOTIFIED_JOB = "flush_last_notified"
+
+async def flush_last_notified(context: ContextTypes.DEFAULT_TYPE):
+    """Write all buffered last_notified stamps with a single storage write"""
+    stamps = pending_last_notified[:]
+    pending_last_notified.clear()
+    if stamps:
+        await update_lessons_last_notified(stamps)
+
+def record_last_notified(job_queue, user_id, lesson, reminder_dt_iso):
+    """Buffer a last_notified stamp for the next batched write"""
+    if not pending_last_notified:
+        # Every reminder sent within one window lands in this one flush
+        job_queue.run_once(flush_last_notified, when=WINDOW_SECONDS, name=FLUSH_LAST_NOTIFIED_JOB)
+    pending_last_notified.append(
+        (user_id, lesson["id"], reminder_dt_iso)
+    )
+
+def reminder_sent(job_queue, user_id, lesson, reminder_dt_iso, record=True):
+    """Bookkeeping once a reminder was delivered"""
+    metrics.REMINDERS_SENT.inc()
+    lateness = time.time() - stamp_epoch(reminder_dt_iso)
+    metrics.REMINDER_LATENESS_SECONDS.observe(max(lateness, 0))
+    if record:
+        record_last_notified(job_queue, user_id, lesson, reminder_dt_iso)
+
+def submit_reminder(job_queue, chat_id, user_id, lesson, reminder_dt_iso, starts_in, record=True):
+    """Queue a lesson's reminder for sending; ``starts_in`` is the lead time shown, e.g. 15 min.
+
+    ``record`` stamps the user's lesson once sent; template lessons are
+    stamped per template instead.
+    """
+    message = (
+        f"⏰ Reminder: {lesson['subject']}\n"
+        f"📅 {lesson['day'].capitalize()} at {lesson['time']}\n"
+        f"(in {starts_in})"
+    )
+    reminder_dispatcher.submit(
+        chat_id,
+        message,
+        on_sent=lambda: reminder_sent(job_queue, user_id, lesson, reminder_dt_iso, record),
+        on_failed=metrics.REMINDERS_FAILED.inc
+    )
+
+def minutes_left(reminder_dt, minutes_before, now_epoch):
+    """Lead time shown in a late reminder: whole minutes until the lesson starts, at least 1"""
+    lesson_start = reminder_dt.timestamp() + minutes_before * 60
+    return f"{max(1, int((lesson_start - now_epoch) // 60))} min"
+
+async def catch_up_missed_reminders(job_queue, table, now_epoch, budget):
+    """Send the reminders missed while the bot was down whose lesson is still ahead.
+
+    ``table`` is the reminder LessonTable. Queues at most ``budget`` reminders
+    and returns the number queued.
+    """
+    if CATCHUP_LOOKBACK <= timedelta(0) or budget <= 0:
+        return 0
+    missed = find_missed_reminders(table, now_epoch, CATCHUP_LOOKBACK, budget)
+    queued = 0
+    for user_id, lesson_id, reminder_dt in missed:
+        lesson = await get_lesson(user_id, lesson_id)
+        minutes_before = parse_notification_minutes(lesson["notification_time"]) if lesson else None
+        if minutes_before is None:
             continue
+        submit_reminder(
+            job_queue, user_id, user_id, lesson, reminder_dt.isoformat(),
+            minutes_left(reminder_dt, minutes_before, now_epoch)
+        )
+        queued += 1
+    metrics.REMINDERS_CAUGHT_UP.inc(queued)
+    return queued
 
-        for lesson in lessons:
-            notification_time = lesson.get("notification_time")
-            if not notification_time or notification_time == "No reminder":
-                continue
+# Template lessons have one reminder job per template, which sends the
+# reminder to every follower at once
+armed_templates = set()
 
-            minutes_before = parse_notification_minutes(notification_time)
-            if minutes_before is None:
-                continue
+async def arm_template_reminders(job_queue, number, now_epoch=None):
+    """Arm the reminder jobs of a template's lessons, unless they already are"""
+    if number is None or number in armed_templates or REMINDER_SHARDS or BOT_ROLE != "all":
+        return 0
+    armed_templates.add(number)
+    if now_epoch is None:
+        now_epoch = int(time.time())
+    # Template lessons are in the default timezone
+    table = lesson_table_class().from_lessons(await get_template_reminder_lessons(number), now_epoch=now_epoch)
+    return await schedule_all_reminders(
+        job_queue, send_template_reminder, table, now_epoch, kind=TEMPLATE_REMINDER
+    )
 
-            lesson_dt = get_next_lesson_datetime(lesson.get("day", ""), lesson.get("time", ""), now)
-            if lesson_dt is None:
-                continue
+async def deliver_template_reminder(job_queue, number, lesson, reminder_dt_iso, starts_in, owns=None, limit=None):
+    """Queue a template lesson's reminder for each of its followers.
 
-            reminder_dt = lesson_dt - timedelta(minutes=minutes_before)
-            window_end = reminder_dt + timedelta(seconds=60)
+    ``owns(user_id)`` limits the followers (in sharded mode), ``limit`` the
+    number of reminders queued. Returns the number of reminders queued.
+    """
+    followers = await get_template_followers(number, lesson["id"])
+    queued = 0
+    for user_id_str in followers:
+        if limit is not None and queued >= limit:
+            break
+        if owns is not None and not owns(user_id_str):
+            continue
+        user_id = int(user_id_str)
+        submit_reminder(job_queue, user_id, user_id, lesson, reminder_dt_iso, starts_in, record=False)
+        queued += 1
+    return queued
 
-            last_notified = lesson.get("last_notified")
-            if last_notified:
-                try:
-                    last_notified_dt = datetime.fromisoformat(last_notified)
-                    # Make timezone-aware if naive
-                    if last_notified_dt.tzinfo is None:
-                        last_notified_dt = last_notified_dt.replace(tzinfo=BISHKEK_TZ)
-                    if last_notified_dt == reminder_dt:
-                        continue
-                except ValueError:
-                    pass
-
-            if reminder_dt <= now < window_end:
-                message = (
-                    f"⏰ Reminder: {lesson['subject']}\n"
-                    f"📅 {lesson['day'].capitalize()} at {lesson['time']}\n"
-                    f"(in {notification_time})"
-                )
-                await context.bot.send_message(chat_id=user_id, text=message)
-                update_lesson_last_notified(
-                    user_id,
-                    lesson["day"],
-                    lesson["time"],
-                    lesson["subject"],
-                    reminder_dt.isoformat()
-                )
+@metrics.timed(metrics.REMINDER_JOB_SECONDS)
+async def send_template_reminder(context: ContextTypes.DEFAULT_TYPE):
+    """Send a template lesson's reminder to its followers and arm it again for next week"""
+    job = context.job
+    forget_reminder_job(job)
+    number = job.user_id
+    lessons = (await get_template_reminder_lessons(number)).get(str(number), [])
+    lesson = next((l for l in lessons if l["id"] == job.data["lesson_id"]), None)
+    if lesson is None:
+        return
+
+    reminder_dt_iso = job.data["reminder_dt"]
+    job_queue = context.job_queue
+    await deliver_template_reminder(job_queue, number, lesson, reminder_dt_iso, lesson["notification_time"])
+    # Stamped once for all followers, when their reminders are queued
+    await update_template_notified(number, lesson["id"], reminder_dt_iso)
+
+    window_end = int(stamp_epoch(reminder_dt_iso)) + WINDOW_SECONDS
+    schedule_lesson_reminder(
+        job_queue, send_template_reminder, number, lesson, window_end, kind=TEMPLATE_REMINDER
+    )
+
+async def catch_up_missed_template_reminders(job_queue, table, template_lessons, now_epoch, budget):
+    """Send the template reminders missed while the bot was down to the followers.
+
+    ``table`` is the LessonTable built from ``template_lessons``. Queues at
+    most ``budget`` reminders, counting one per follower, and returns the
+    number queued.
+    """
+    if CATCHUP_LOOKBACK <= timedelta(0) or budget <= 0:
+        return 0
+    queued = 0
+    # A lesson queues at least one message unless every follower removed it
+    for number, lesson_id, reminder_dt in find_missed_reminders(table, now_epoch, CATCHUP_LOOKBACK, budget):
+        if queued >= budget:
+            break
+        lesson = next(l for l in template_lessons[str(number)] if l["id"] == lesson_id)
+        starts_in = minutes_left(reminder_dt, parse_notification_minutes(lesson["notification_time"]), now_epoch)
+        reminder_dt_iso = reminder_dt.isoformat()
+        queued += await deliver_template_reminder(
+            job_queue, number, lesson, reminder_dt_iso, starts_in, limit=budget - queued
+        )
+        await update_template_notified(number, lesson_id, reminder_dt_iso)
+    metrics.REMINDERS_CAUGHT_UP.inc(queued)
+    return queued
+
+# Sharded reminders: leases on this process's shards and the end of the time
+# range the minute tick has covered so far (set up in post_init)
+lease_manager = None
+reminder_tick_from = None
+# Held by ticks and heartbeats, so a shard changing hands lands between two ticks
+shard_lock = asyncio.Lock()
+
+def minute_of_week(epoch, offset):
+    """Minute of the week (Monday 00:00 = 0) of a Unix time, at UTC offset ``offset`` in seconds"""
+    return (epoch + offset - MONDAY_EPOCH) // 60 % MINUTES_PER_WEEK
+
+def due_reminders(lessons, start, end, now_epoch, timezones=None):
+    """Reminders of a {key: [lesson, ...]} dict firing in [start, end) whose lesson is still ahead.
+
+    ``start`` and ``end`` are Unix times; ``timezones`` maps keys to their
+    timezone (the default one if missing). Yields ``(key, lesson,
+    reminder_dt, starts_in)``; reminders sent late show the minutes left
+    instead of the usual lead time.
+    """
+    table = lesson_table_class().from_lessons(lessons, timezones, start)
+    indices, fire_epochs = table.due_between(start, end)
+    for index, fire_epoch in zip(indices.tolist(), fire_epochs.tolist()):
+        key, lesson_id = table.lesson_at(index)
+        lesson = next(l for l in lessons[str(key)] if l["id"] == lesson_id)
+        minutes_before = int(table.offsets[index])
+        if fire_epoch + minutes_before * 60 <= now_epoch:
+            continue
+        reminder_dt = datetime.fromtimestamp(fire_epoch, timezone.utc)
+        if now_epoch - fire_epoch < WINDOW_SECONDS:
+            starts_in = lesson["notification_time"]
+        else:
+            starts_in = minutes_left(reminder_dt, minutes_before, now_epoch)
+        yield key, lesson, reminder_dt, starts_in
+
+async def send_due_reminders(job_queue, start, end, shards=None):
+    """Send the reminders firing in [start, end) (Unix times) for users whose shard this process holds.
+
+    Lessons come from storage's fire-time index, so lessons changed by other
+    processes are seen. Reminders of lessons that have already started are
+    skipped; ``shards`` restricts the users further. Returns the number queued.
+    """
+    def owns(user_id_str):
+        return lease_manager.owns(user_id_str) and (
+            shards is None or shard_of(user_id_str, REMINDER_SHARDS) in shards
+        )
+
+    timezones = await get_user_timezones()
+    # The index holds local fire minutes, so it is queried once per UTC offset in use
+    zones_by_offset = {}
+    for zone in {DEFAULT_TIMEZONE, *timezones.values()}:
+        zones_by_offset.setdefault(utc_offset(zone, start), set()).add(zone)
+    now_epoch = int(time.time())
+    queued = 0
+    for offset, zones in zones_by_offset.items():
+        minutes = (minute_of_week(start, offset), (minute_of_week(end, offset) + 1) % MINUTES_PER_WEEK)
+        lessons = await get_lessons_firing_between(*minutes)
+        metrics.REMINDER_TICK_LESSONS.inc(sum(len(user_lessons) for user_lessons in lessons.values()))
+        lessons = {
+            user_id_str: user_lessons for user_id_str, user_lessons in lessons.items()
+            if timezones.get(user_id_str, DEFAULT_TIMEZONE) in zones and owns(user_id_str)
+        }
+        for user_id, lesson, reminder_dt, starts_in in due_reminders(lessons, start, end, now_epoch, timezones):
+            submit_reminder(job_queue, user_id, user_id, lesson, reminder_dt.isoformat(), starts_in)
+            queued += 1
+        if DEFAULT_TIMEZONE not in zones:
+            continue
+        # Template lessons (in the default timezone) are due for every follower at once
+        templates = await get_template_lessons_firing_between(*minutes)
+        metrics.REMINDER_TICK_LESSONS.inc(sum(len(template_lessons) for template_lessons in templates.values()))
+        for number, lesson, reminder_dt, starts_in in due_reminders(templates, start, end, now_epoch):
+            queued += await deliver_template_reminder(
+                job_queue, number, lesson, reminder_dt.isoformat(), starts_in, owns
+            )
+    return queued
+
+@metrics.timed(metrics.REMINDER_JOB_SECONDS)
+async def reminder_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Send the reminders that fell due since the last tick"""
+    global reminder_tick_from
+    async with shard_lock:
+        start, end = reminder_tick_from, int(time.time())
+        reminder_tick_from = end
+        await send_due_reminders(context.job_queue, start, end)
+
+async def lease_heartbeat(context: ContextTypes.DEFAULT_TYPE):
+    """Renew this process's shard leases and pick up shards from dead or departed workers"""
+    async with shard_lock:
+        try:
+            acquired, lost = await asyncio.get_running_loop().run_in_executor(None, lease_manager.heartbeat)
+        except Exception:
+            logging.exception("Renewing reminder shard leases failed")
+            return
+        await catch_up_acquired_shards(context.job_queue, acquired, lost)
+
+async def catch_up_acquired_shards(job_queue, acquired, lost):
+    """Log shard changes and send the missed reminders of newly acquired shards"""
+    if lost:
+        logging.info("Handed over reminder shards %s", sorted(lost))
+    if not acquired:
+        return
+    logging.info("Took over reminder shards %s", sorted(acquired))
+    # Reminders of a new shard are ours from when its previous owner stopped;
+    # those that fell due before the tick position are caught up here
+    earliest = reminder_tick_from - int(CATCHUP_LOOKBACK.total_seconds())
+    by_start = {}
+    for shard, previous_end in acquired.items():
+        start = earliest
+        if previous_end is not None:
+            start = max(start, int(previous_end))
+        by_start.setdefault(start, set()).add(shard)
+    caught_up = 0
+    for start, shards in by_start.items():
+        if start < reminder_tick_from:
+            caught_up += await send_due_reminders(job_queue, start, reminder_tick_from, shards)
+    if caught_up:
+        metrics.REMINDERS_CAUGHT_UP.inc(caught_up)
+        logging.info("Sending %d reminders missed by the previous owners", caught_up)
+
+@metrics.timed(metrics.REMINDER_JOB_SECONDS)
+async def send_lesson_reminder(context: ContextTypes.DEFAULT_TYPE):
+    """Send one lesson's reminder and arm it again for next week"""
+    job = context.job
+    forget_reminder_job(job)
+    user_id = job.user_id
+    lesson = await get_lesson(user_id, job.data["lesson_id"])
+    if lesson is None or parse_notification_minutes(lesson.get("notification_time")) is None:
+        return
+
+    reminder_dt_iso = job.data["reminder_dt"]
+    job_queue = context.job_queue
+    submit_reminder(job_queue, job.chat_id, user_id, lesson, reminder_dt_iso, lesson["notification_time"])
+
+    # Arm the next occurrence, counting from the end of this one's window
+    window_end = int(stamp_epoch(reminder_dt_iso)) + WINDOW_SECONDS
+    arm_reminder(job_queue, user_id, lesson, job.data["timezone"], now_epoch=window_end)
 
 async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /schedule command"""
     user_id = update.effective_user.id
-    lessons = ensure_user_schedule(user_id)
+    schedule_text = await render_schedule_view(
+        user_id, context.job_queue, (user_id, "schedule"), build_schedule_text
+    )
     
-    if not lessons:
+    if schedule_text is None:
         await update.message.reply_text("📭 You don't have any lessons scheduled yet!\n\nUse /add_lesson to add your first lesson.")
         return
 
-    schedule_text = build_schedule_text(lessons)
     await update.message.reply_text(schedule_text, parse_mode="HTML")
 
 async def add_lesson_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -378,7 +737,7 @@ async def reminder_choice_callback(update: Update, context: ContextTypes.DEFAULT
         
         # Add all lessons without notification time
         for lesson in lessons_data:
-            add_lesson(
+            await add_lesson(
                 user_id,
                 lesson['day'],
                 lesson['time'],
@@ -434,14 +793,16 @@ async def notification_callback(update: Update, context: ContextTypes.DEFAULT_TY
         return ConversationHandler.END
     
     # Add all lessons with the same notification time
+    zone = await get_user_timezone(user_id)
     for lesson in lessons_data:
-        add_lesson(
+        added = await add_lesson(
             user_id,
             lesson['day'],
             lesson['time'],
             lesson['subject'],
             notification_time
         )
+        arm_reminder(context.job_queue, user_id, added, zone)
     
     # Create success message
     if len(lessons_data) == 1:
@@ -470,15 +831,12 @@ async def notification_callback(update: Update, context: ContextTypes.DEFAULT_TY
 async def remove_lesson_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the remove lesson conversation"""
     user_id = update.effective_user.id
-    lessons = get_user_lessons(user_id)
+    lessons = await get_user_lessons(user_id)
     
     if not lessons:
         await update.message.reply_text("📭 You don't have any lessons to remove!")
         return ConversationHandler.END
     
-    # Store lessons in context for later reference
-    context.user_data['remove_lessons'] = lessons
-    
     # Show day selection buttons
     keyboard = [
         [InlineKeyboardButton("Monday", callback_data="rmday_monday"),
@@ -512,11 +870,9 @@ async def remove_day_selection_callback(update: Update, context: ContextTypes.DE
     
     # Extract day from callback data
     day = query.data.replace("rmday_", "").capitalize()
-    context.user_data['remove_day'] = day
     
     # Get lessons for this day
-    lessons = context.user_data.get('remove_lessons', [])
-    day_lessons = [l for l in lessons if l['day'].lower() == day.lower()]
+    day_lessons = await get_day_lessons(update.effective_user.id, day)
     
     if not day_lessons:
         # No lessons on this day - show message and let user pick another day
@@ -540,15 +896,11 @@ async def remove_day_selection_callback(update: Update, context: ContextTypes.DE
         )
         return WAITING_REMOVE_DAY_SELECTION
     
-    # Sort lessons by time
-    day_lessons_sorted = sorted(day_lessons, key=lambda x: x['time'])
-    context.user_data['remove_day_lessons'] = day_lessons_sorted
-    
     # Create buttons for each lesson on this day
     keyboard = []
-    for i, lesson in enumerate(day_lessons_sorted):
+    for lesson in day_lessons:
         button_text = f"{lesson['time']} - {lesson['subject']}"
-        callback_data = f"rmlesson_{i}"
+        callback_data = f"rmlesson_{lesson['id']}"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
     
     # Add back and cancel buttons
@@ -598,28 +950,21 @@ async def remove_lesson_selection_callback(update: Update, context: ContextTypes
         )
         return WAITING_REMOVE_DAY_SELECTION
     
-    # Extract lesson index from callback data
-    try:
-        lesson_index = int(query.data.replace("rmlesson_", ""))
-    except ValueError:
-        await query.edit_message_text("❌ Error: Invalid selection.")
-        context.user_data.clear()
-        return ConversationHandler.END
-    
-    day_lessons = context.user_data.get('remove_day_lessons', [])
+    # Extract lesson ID from callback data
+    lesson_id = query.data.replace("rmlesson_", "")
+    user_id = update.effective_user.id
+    lesson = await get_lesson(user_id, lesson_id)
     
-    if lesson_index < 0 or lesson_index >= len(day_lessons):
+    if lesson is None:
         await query.edit_message_text("❌ Error: Lesson not found.")
         context.user_data.clear()
         return ConversationHandler.END
     
-    lesson = day_lessons[lesson_index]
-    user_id = update.effective_user.id
-    
     # Remove the lesson
-    success = remove_lesson(user_id, lesson['day'], lesson['time'], lesson['subject'])
+    success = await remove_lesson(user_id, lesson_id)
     
     if success:
+        cancel_lesson_reminder(user_id, lesson_id)
         await query.edit_message_text(
             f"✅ <b>Lesson Removed Successfully!</b>\n\n"
             f"🗑️ Removed: <b>{lesson['subject']}</b>\n"
@@ -642,15 +987,12 @@ async def remove_lesson_selection_callback(update: Update, context: ContextTypes
 async def turn_on_off_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the turn on/off reminder conversation"""
     user_id = update.effective_user.id
-    lessons = get_user_lessons(user_id)
+    lessons = await get_user_lessons(user_id)
     
     if not lessons:
         await update.message.reply_text("📭 You don't have any lessons to modify!")
         return ConversationHandler.END
     
-    # Store lessons in context for later reference
-    context.user_data['toggle_lessons'] = lessons
-    
     # Show day selection buttons
     keyboard = [
         [InlineKeyboardButton("Monday", callback_data="toggleday_monday"),
@@ -684,11 +1026,9 @@ async def toggle_day_selection_callback(update: Update, context: ContextTypes.DE
     
     # Extract day from callback data
     day = query.data.replace("toggleday_", "").capitalize()
-    context.user_data['toggle_day'] = day
     
     # Get lessons for this day
-    lessons = context.user_data.get('toggle_lessons', [])
-    day_lessons = [l for l in lessons if l['day'].lower() == day.lower()]
+    day_lessons = await get_day_lessons(update.effective_user.id, day)
     
     if not day_lessons:
         # No lessons on this day - show message and let user pick another day
@@ -712,20 +1052,16 @@ async def toggle_day_selection_callback(update: Update, context: ContextTypes.DE
         )
         return WAITING_TOGGLE_DAY_SELECTION
     
-    # Sort lessons by time
-    day_lessons_sorted = sorted(day_lessons, key=lambda x: x['time'])
-    context.user_data['toggle_day_lessons'] = day_lessons_sorted
-    
     # Create buttons for each lesson on this day
     keyboard = []
-    for i, lesson in enumerate(day_lessons_sorted):
+    for lesson in day_lessons:
         reminder_status = lesson.get('notification_time', 'No reminder')
         if reminder_status == "No reminder":
             status_icon = "🔕"
         else:
             status_icon = "🔔"
         button_text = f"{status_icon} {lesson['time']} - {lesson['subject']}"
-        callback_data = f"togglelesson_{i}"
+        callback_data = f"togglelesson_{lesson['id']}"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
     
     # Add back and cancel buttons
@@ -776,29 +1112,17 @@ async def toggle_lesson_selection_callback(update: Update, context: ContextTypes
         )
         return WAITING_TOGGLE_DAY_SELECTION
     
-    # Extract lesson index from callback data
-    try:
-        lesson_index = int(query.data.replace("togglelesson_", ""))
-    except ValueError:
-        await query.edit_message_text("❌ Error: Invalid selection.")
-        context.user_data.clear()
-        return ConversationHandler.END
-    
-    day_lessons = context.user_data.get('toggle_day_lessons', [])
+    # Extract lesson ID from callback data
+    lesson_id = query.data.replace("togglelesson_", "")
+    lesson = await get_lesson(update.effective_user.id, lesson_id)
     
-    if lesson_index < 0 or lesson_index >= len(day_lessons):
+    if lesson is None:
         await query.edit_message_text("❌ Error: Lesson not found.")
         context.user_data.clear()
         return ConversationHandler.END
     
-    lesson = day_lessons[lesson_index]
-    
-    # Store lesson info in context
-    context.user_data['reminder_lesson'] = {
-        'day': lesson['day'],
-        'time': lesson['time'],
-        'subject': lesson['subject']
-    }
+    # Store lesson ID in context
+    context.user_data['reminder_lesson_id'] = lesson_id
     
     current_reminder = lesson.get('notification_time', 'No reminder')
     
@@ -863,14 +1187,14 @@ async def reminder_lesson_input_handler(update: Update, context: ContextTypes.DE
     
     # Check if lesson exists
     user_id = update.effective_user.id
-    lessons = get_user_lessons(user_id)
-    lesson_found = False
+    lessons = await get_user_lessons(user_id)
+    lesson_found = None
     
     for lesson in lessons:
         if (lesson["day"].lower() == day.lower() and 
             lesson["time"] == time_str and 
             lesson["subject"].lower() == subject.lower()):
-            lesson_found = True
+            lesson_found = lesson
             break
     
     if not lesson_found:
@@ -882,12 +1206,8 @@ async def reminder_lesson_input_handler(update: Update, context: ContextTypes.DE
         )
         return WAITING_REMINDER_LESSON_INPUT
     
-    # Store lesson info in context
-    context.user_data['reminder_lesson'] = {
-        'day': day,
-        'time': time_str,
-        'subject': subject
-    }
+    # Store lesson ID in context
+    context.user_data['reminder_lesson_id'] = lesson_found['id']
     
     # Show reminder options
     keyboard = [
@@ -923,25 +1243,22 @@ async def reminder_update_callback(update: Update, context: ContextTypes.DEFAULT
     
     notification_time = notif_mapping.get(query.data, "No reminder")
     
-    # Get lesson info from context
-    lesson_info = context.user_data.get('reminder_lesson', {})
+    # Get lesson ID from context
+    lesson_id = context.user_data.get('reminder_lesson_id')
     
-    if not lesson_info:
+    if not lesson_id:
         await query.edit_message_text("❌ Error: No lesson data found!")
         context.user_data.clear()
         return ConversationHandler.END
     
     # Update the lesson reminder
     user_id = update.effective_user.id
-    success = update_lesson_reminder(
-        user_id,
-        lesson_info['day'],
-        lesson_info['time'],
-        lesson_info['subject'],
-        notification_time
-    )
+    success = await update_lesson_reminder(user_id, lesson_id, notification_time)
+    lesson_info = await get_lesson(user_id, lesson_id) if success else None
     
-    if success:
+    if lesson_info:
+        # Re-arming replaces the pending job (or just drops it for "No reminder")
+        arm_reminder(context.job_queue, user_id, lesson_info, await get_user_timezone(user_id))
         await query.edit_message_text(
             f"✅ <b>Reminder Updated Successfully!</b>\n\n"
             f"📚 Subject: {lesson_info['subject']}\n"
@@ -963,102 +1280,267 @@ async def reminder_update_callback(update: Update, context: ContextTypes.DEFAULT
 
 async def lessons_today_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /lessons_today command - show today's lessons"""
+    zone = get_zone(await get_user_timezone(update.effective_user.id))
+    await send_day_lessons(update, context, datetime.now(zone), "today")
+
+async def lessons_tomorrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /lessons_tomorrow command - show tomorrow's lessons"""
+    zone = get_zone(await get_user_timezone(update.effective_user.id))
+    await send_day_lessons(update, context, datetime.now(zone) + timedelta(days=1), "tomorrow")
+
+async def send_day_lessons(update: Update, context: ContextTypes.DEFAULT_TYPE, date, when):
+    """Reply with the user's lessons on ``date`` (in their timezone)"""
     user_id = update.effective_user.id
-    lessons = ensure_user_schedule(user_id)
+    day = date.strftime("%A").lower()
+    date_display = date.strftime("%A, %B %d, %Y")
+    response = await render_schedule_view(
+        user_id, context.job_queue, (user_id, when, date_display),
+        lambda lessons: build_day_lessons_text(lessons, day, date_display, when)
+    )
     
-    if not lessons:
+    if response is None:
         await update.message.reply_text("📭 You don't have any lessons scheduled yet!\n\nUse /add_lesson to add your first lesson.")
         return
     
-    # Get today's day name using Bishkek timezone
-    now = datetime.now(BISHKEK_TZ)
-    today = now.strftime("%A").lower()
-    today_display = now.strftime("%A, %B %d, %Y")
-    
-    # Filter lessons for today
-    today_lessons = [l for l in lessons if l['day'].lower() == today]
-    
-    if not today_lessons:
+    await update.message.reply_text(response, parse_mode="HTML")
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /timezone command - show or change the user's timezone"""
+    user_id = update.effective_user.id
+    if not context.args:
+        zone = await get_user_timezone(user_id)
         await update.message.reply_text(
-            f"📅 <b>{today_display}</b>\n\n"
-            "😴 No lessons scheduled for today!\n\n"
-            "Use /schedule to view your full weekly schedule.",
+            f"🕐 Your timezone is <b>{zone}</b>.\n\n"
+            "To change it, send /timezone with a timezone name, e.g. <code>/timezone Asia/Almaty</code>.",
             parse_mode="HTML"
         )
         return
-    
-    # Sort by time
-    today_lessons.sort(key=lambda x: x['time'])
-    
-    # Build response
-    response = f"📅 <b>Today's Lessons ({today_display})</b>\n\n"
-    
-    for i, lesson in enumerate(today_lessons, 1):
-        reminder_info = lesson.get('notification_time', 'No reminder')
-        if reminder_info == "No reminder":
-            reminder_text = "🔕 No reminder"
-        else:
-            reminder_text = f"🔔 Reminder: {reminder_info} before"
-        
-        response += (
-            f"<b>{i}. {lesson['subject']}</b>\n"
-            f"   🕐 Time: {lesson['time']}\n"
-            f"   {reminder_text}\n\n"
+
+    zone = context.args[0]
+    if not is_valid_timezone(zone):
+        await update.message.reply_text(
+            "❌ Unknown timezone!\n\n"
+            "Please use a name from the tz database, e.g. <code>Asia/Bishkek</code> or <code>Europe/Berlin</code>.",
+            parse_mode="HTML"
         )
-    
-    response += f"📚 Total: {len(today_lessons)} lesson(s) today"
-    
-    await update.message.reply_text(response, parse_mode="HTML")
+        return
 
-async def lessons_tomorrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /lessons_tomorrow command - show tomorrow's lessons"""
+    await set_user_timezone(user_id, zone)
+    # Every lesson now fires at another time
+    now_epoch = int(time.time())
+    await arm_user_reminders(context.job_queue, user_id, zone, now_epoch)
+    if not REMINDER_SHARDS and BOT_ROLE == "all":
+        watch_zone_offset(context.job_queue, zone, now_epoch)
+    await update.message.reply_text(
+        f"✅ Timezone set to <b>{zone}</b>.\n\nYour lesson times and reminders now follow this timezone.",
+        parse_mode="HTML"
+    )
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /digest command - subscribe to or unsubscribe from the morning digest"""
     user_id = update.effective_user.id
-    lessons = ensure_user_schedule(user_id)
-    
-    if not lessons:
-        await update.message.reply_text("📭 You don't have any lessons scheduled yet!\n\nUse /add_lesson to add your first lesson.")
+    usage = (
+        "Send /digest with a time, e.g. <code>/digest 07:00</code>, to get your day's lessons "
+        "every morning at that time, or <code>/digest off</code> to stop."
+    )
+    if not context.args:
+        local_time = await get_digest_time(user_id)
+        if local_time is None:
+            status = "☀️ You don't get a morning digest."
+        else:
+            zone = await get_user_timezone(user_id)
+            status = f"☀️ Your morning digest comes at <b>{local_time}</b> ({zone})."
+        await update.message.reply_text(f"{status}\n\n{usage}", parse_mode="HTML")
         return
-    
-    # Get tomorrow's day name using Bishkek timezone
-    now = datetime.now(BISHKEK_TZ)
-    tomorrow = now + timedelta(days=1)
-    tomorrow_day = tomorrow.strftime("%A").lower()
-    tomorrow_display = tomorrow.strftime("%A, %B %d, %Y")
-    
-    # Filter lessons for tomorrow
-    tomorrow_lessons = [l for l in lessons if l['day'].lower() == tomorrow_day]
-    
-    if not tomorrow_lessons:
+
+    argument = context.args[0].lower()
+    if argument == "off":
+        await set_digest_time(user_id, None)
+        await update.message.reply_text("🔕 Morning digest turned off.")
+        return
+
+    if not validate_time_format(argument):
+        await update.message.reply_text(f"❌ Invalid time format!\n\n{usage}", parse_mode="HTML")
+        return
+
+    await set_digest_time(user_id, argument)
+    zone = await get_user_timezone(user_id)
+    await update.message.reply_text(
+        f"✅ You'll get your lessons every morning at <b>{argument}</b> ({zone}), "
+        "on days you have lessons.",
+        parse_mode="HTML"
+    )
+
+# Sends morning digests (started in post_init)
+digest_dispatcher = None
+# Start of the last minute whose digests were sent
+digest_minute = None
+DIGEST_MAX_MINUTES = 5
+
+async def send_digests(minute_epoch, owns=None):
+    """Queue the digests due in the minute starting at ``minute_epoch``; returns the number queued.
+
+    Subscribers are looked up by local time, once per local time the zones
+    in use have in that minute, and their lessons come from one read of that
+    weekday's lessons. ``owns(user_id)`` restricts the users (sharded mode).
+    """
+    timezones = await get_user_timezones()
+    # Zones by the local date and time they have in that minute
+    local_zones = {}
+    for zone in {DEFAULT_TIMEZONE, *timezones.values()}:
+        local = datetime.fromtimestamp(minute_epoch + utc_offset(zone, minute_epoch), timezone.utc)
+        local_zones.setdefault((local.strftime("%H:%M"), local.date()), set()).add(zone)
+
+    queued = 0
+    for (local_time, date), zones in local_zones.items():
+        user_ids = [
+            user_id_str for user_id_str in await get_digest_subscribers(local_time)
+            if timezones.get(user_id_str, DEFAULT_TIMEZONE) in zones
+            and (owns is None or owns(user_id_str))
+        ]
+        if not user_ids:
+            continue
+        day = DAYS_ORDER[date.weekday()]
+        date_display = date.strftime("%A, %B %d, %Y")
+        lessons = await get_day_lessons_of_users(day, user_ids)
+        for user_id_str, day_lessons in lessons.items():
+            digest_dispatcher.submit(
+                int(user_id_str),
+                build_day_lessons_text(day_lessons, day, date_display, "today"),
+                on_sent=metrics.DIGEST_MESSAGES.labels("sent").inc,
+                on_failed=metrics.DIGEST_MESSAGES.labels("failed").inc,
+                parse_mode="HTML"
+            )
+            queued += 1
+    return queued
+
+async def digest_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Send the digests of every minute that started since the last tick"""
+    global digest_minute
+    now = int(time.time())
+    current = now - now % 60
+    if digest_minute is None:
+        digest_minute = current - 60
+    # After a stall only the last few minutes are sent
+    start = max(digest_minute + 60, current - (DIGEST_MAX_MINUTES - 1) * 60)
+    digest_minute = current
+    owns = lease_manager.owns if REMINDER_SHARDS else None
+    for minute_epoch in range(start, current + 1, 60):
+        queued = await send_digests(minute_epoch, owns)
+        if queued:
+            logging.info("Queued %d morning digests", queued)
+
+def start_digests(job_queue):
+    """Check for due digests just after each minute starts"""
+    now = time.time()
+    job_queue.run_repeating(digest_tick, interval=60, first=60 - now % 60 + 1, name="digest_tick")
+
+# Sends broadcast messages (started in post_init), and the broadcast running
+broadcast_dispatcher = None
+current_broadcast = None
+
+async def report_broadcast(bot, state):
+    """Show a broadcast's progress in its report message in the admin's chat"""
+    try:
+        await bot.edit_message_text(
+            progress_text(state), chat_id=state["admin"], message_id=state["report_message_id"]
+        )
+    except TelegramError as exc:
+        logging.warning("Updating the broadcast report failed: %s", exc)
+
+def start_broadcast(application, state):
+    """Send a new or resumed broadcast in the background"""
+    global current_broadcast
+    current_broadcast = Broadcast(
+        state,
+        broadcast_dispatcher,
+        report=lambda state: report_broadcast(application.bot, state),
+        report_interval=BROADCAST_REPORT_INTERVAL
+    )
+    current_broadcast.start()
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast command - send a message to every user (admins only)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await unknown_command(update, context)
+        return
+    # The HTML version keeps the admin's formatting
+    parts = update.message.text_html.split(None, 1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    running = current_broadcast is not None and current_broadcast.running()
+
+    if not text:
+        state = current_broadcast.state if current_broadcast is not None else await get_broadcast()
+        status = progress_text(state) + "\n\n" if state else ""
         await update.message.reply_text(
-            f"📅 <b>{tomorrow_display}</b>\n\n"
-            "😴 No lessons scheduled for tomorrow!\n\n"
-            "Use /schedule to view your full weekly schedule.",
-            parse_mode="HTML"
+            f"{status}Send /broadcast followed by a message to send it to every user, "
+            "or /broadcast cancel to stop the running broadcast."
         )
         return
-    
-    # Sort by time
-    tomorrow_lessons.sort(key=lambda x: x['time'])
-    
-    # Build response
-    response = f"📅 <b>Tomorrow's Lessons ({tomorrow_display})</b>\n\n"
-    
-    for i, lesson in enumerate(tomorrow_lessons, 1):
-        reminder_info = lesson.get('notification_time', 'No reminder')
-        if reminder_info == "No reminder":
-            reminder_text = "🔕 No reminder"
+
+    if text == "cancel":
+        if running:
+            current_broadcast.cancel()
+            await update.message.reply_text("🛑 The broadcast stops after the messages already queued.")
         else:
-            reminder_text = f"🔔 Reminder: {reminder_info} before"
-        
-        response += (
-            f"<b>{i}. {lesson['subject']}</b>\n"
-            f"   🕐 Time: {lesson['time']}\n"
-            f"   {reminder_text}\n\n"
+            await update.message.reply_text("No broadcast is running.")
+        return
+
+    if running:
+        await update.message.reply_text(
+            "❌ A broadcast is already running. Wait for it to finish or stop it with /broadcast cancel."
         )
-    
-    response += f"📚 Total: {len(tomorrow_lessons)} lesson(s) tomorrow"
-    
-    await update.message.reply_text(response, parse_mode="HTML")
+        return
+
+    state = new_broadcast(text, update.effective_chat.id)
+    report = await update.message.reply_text(progress_text(state))
+    state["report_message_id"] = report.message_id
+    await save_broadcast(state)
+    start_broadcast(context.application, state)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /profile command - profile the bot for a while and send the report (admins only)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await unknown_command(update, context)
+        return
+    mode = context.args[0].lower() if context.args else "cpu"
+    try:
+        seconds = int(context.args[1]) if len(context.args) > 1 else PROFILE_SECONDS
+    except ValueError:
+        seconds = 0
+    if mode not in ("cpu", "memory") or not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"Send /profile cpu or /profile memory, optionally with a duration of up to "
+            f"{PROFILE_MAX_SECONDS} seconds, e.g. <code>/profile cpu 60</code>.",
+            parse_mode="HTML"
+        )
+        return
+
+    capture = profiling.capture_cpu if mode == "cpu" else profiling.capture_memory
+
+    async def run():
+        try:
+            report = await capture(seconds)
+        except RuntimeError as exc:
+            await update.message.reply_text(f"❌ {exc}.")
+            return
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        await update.message.reply_document(
+            document=io.BytesIO(report.encode()),
+            filename=f"profile-{mode}-{stamp}.txt",
+            caption=f"📈 {mode.upper()} profile over {seconds}s"
+        )
+
+    # Run in the background, so updates (the load being profiled) are handled meanwhile
+    context.application.create_task(run(), update=update)
+    await update.message.reply_text(f"⏱ Profiling ({mode}) for {seconds} seconds...")
+
+async def resume_broadcast(application):
+    """Continue a broadcast that was running when the bot stopped"""
+    state = await get_broadcast()
+    if state is not None and state["status"] == "running":
+        logging.info("Resuming the broadcast after %d messages", state["sent"] + state["failed"])
+        start_broadcast(application, state)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel conversation"""
@@ -1099,15 +1581,50 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
-def main():
-    """Start the bot"""
-    # Setup logging
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
-    # Create application
-    async def post_init(application: Application):
+def get_webhook_secret():
+    """Secret Telegram must send with every webhook update.
+
+    Falls back to a value derived from the bot token so that restarts keep
+    accepting updates for the already registered webhook.
+    """
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+
+# Startup phases are timed from the end of the previous one
+startup_mark = STARTED
+
+def startup_phase(name, since=None):
+    """End a startup phase, logging its duration with STARTUP_PROFILE=1.
+
+    Phases running alongside the main startup pass their own start time as ``since``.
+    """
+    global startup_mark
+    now = time.perf_counter()
+    if STARTUP_PROFILE:
+        started = startup_mark if since is None else since
+        logging.info(
+            "Startup profile: %-16s %8.1f ms (%.1f ms since start)",
+            name, (now - started) * 1000, (now - STARTED) * 1000
+        )
+    if since is None:
+        startup_mark = now
+
+first_update_seen = False
+# finish_startup() running in the background
+startup_task = None
+
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Log the time to the first update (only registered with STARTUP_PROFILE=1)"""
+    global first_update_seen
+    if not first_update_seen:
+        first_update_seen = True
+        startup_phase("first update")
+
+async def finish_startup(application):
+    """Register the command list and set up reminders once updates are being handled"""
+    started = time.perf_counter()
+    try:
         await application.bot.set_my_commands([
             BotCommand("start", "Show bot information"),
             BotCommand("help", "Show help message"),
@@ -1116,10 +1633,255 @@ def main():
             BotCommand("lessons_tomorrow", "View tomorrow's lessons"),
             BotCommand("add_lesson", "Add a new lesson"),
             BotCommand("remove_lesson", "Remove a lesson"),
-            BotCommand("turn_on_off", "Turn on/off a reminder")
+            BotCommand("turn_on_off", "Turn on/off a reminder"),
+            BotCommand("timezone", "Show or change your timezone"),
+            BotCommand("digest", "Get today's lessons every morning")
         ])
+    except Exception:
+        logging.exception("Setting the bot commands failed")
+    startup_phase("set commands", since=started)
+    if BOT_ROLE != "reminders":
+        try:
+            await resume_broadcast(application)
+        except Exception:
+            logging.exception("Resuming the broadcast failed")
+    if BOT_ROLE == "updates":
+        return
+    start_digests(application.job_queue)
+    started = time.perf_counter()
+    try:
+        if REMINDER_SHARDS:
+            start_sharded_reminders(application.job_queue)
+        else:
+            await rebuild_reminders(application.job_queue)
+    except Exception:
+        logging.exception("Setting up reminders failed")
+        return
+    startup_phase("reminders", since=started)
 
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+# Set once every lesson's reminder job is armed
+reminders_ready = False
+
+async def rebuild_reminders(job_queue):
+    """Arm a one-shot job for every lesson reminder and send the ones missed while down"""
+    global reminders_ready
+    started = time.perf_counter()
+    now_epoch = int(time.time())
+    # Lessons changed from here on arm their own jobs, which the rebuild mustn't undo
+    mark = version_mark()
+    stamp = await data_stamp()
+    timezones = await get_user_timezones()
+    loop = asyncio.get_running_loop()
+    table = await loop.run_in_executor(None, lesson_table_class().load, REMINDER_INDEX_FILE, stamp, now_epoch)
+    if table is None:
+        lessons = await get_reminder_lessons()
+        table = await loop.run_in_executor(None, lesson_table_class().from_lessons, lessons, timezones, now_epoch)
+        source = "lessons"
+    else:
+        source = REMINDER_INDEX_FILE
+    count = await schedule_all_reminders(
+        job_queue, send_lesson_reminder, table, now_epoch,
+        skip_user=lambda user_id: user_schedule_version(user_id) > mark
+    )
+    template_lessons = await get_template_reminder_lessons()
+    template_table = lesson_table_class().from_lessons(template_lessons, now_epoch=now_epoch)
+    armed_templates.update(int(number) for number in template_lessons)
+    count += await schedule_all_reminders(
+        job_queue, send_template_reminder, template_table, now_epoch, kind=TEMPLATE_REMINDER
+    )
+    for zone in {DEFAULT_TIMEZONE, *timezones.values()}:
+        watch_zone_offset(job_queue, zone, now_epoch)
+    reminders_ready = True
+    metrics.REMINDER_REBUILD_SECONDS.set(time.perf_counter() - started)
+    metrics.REMINDER_REBUILD_LESSONS.set(len(table) + len(template_table))
+    metrics.REMINDER_JOBS_SCHEDULED.set(count)
+    logging.info("Scheduled %d lesson reminders from %s", count, source)
+    caught_up = await catch_up_missed_reminders(job_queue, table, now_epoch, CATCHUP_MAX_REMINDERS)
+    caught_up += await catch_up_missed_template_reminders(
+        job_queue, template_table, template_lessons, now_epoch, CATCHUP_MAX_REMINDERS - caught_up
+    )
+    if caught_up:
+        logging.info("Sending %d reminders missed while the bot was down", caught_up)
+
+# Reminder jobs hold Unix times computed from each timezone's UTC offset at
+# the time, so when a zone in use changes its offset (DST) the jobs of its
+# users are armed again. One job runs at the earliest upcoming change.
+ZONE_OFFSETS_JOB = "zone_offsets"
+# zone -> UTC offset the armed jobs were computed with
+armed_zone_offsets = {}
+zone_offsets_job = None
+
+def watch_zone_offset(job_queue, zone, now_epoch):
+    """Make sure the offset check runs when ``zone`` next changes its UTC offset"""
+    global zone_offsets_job
+    armed_zone_offsets.setdefault(zone, utc_offset(zone, now_epoch))
+    # Just after the change, so the new offset is in effect
+    check_at = offset_valid_until(zone, now_epoch) + 1
+    if zone_offsets_job is not None and not zone_offsets_job.removed:
+        if zone_offsets_job.next_t is not None and zone_offsets_job.next_t.timestamp() <= check_at:
+            return
+        zone_offsets_job.schedule_removal()
+    zone_offsets_job = job_queue.run_once(
+        check_zone_offsets, when=datetime.fromtimestamp(check_at, timezone.utc), name=ZONE_OFFSETS_JOB
+    )
+
+async def check_zone_offsets(context: ContextTypes.DEFAULT_TYPE):
+    """Arm the reminders of users in timezones whose UTC offset changed again"""
+    global zone_offsets_job
+    zone_offsets_job = None
+    job_queue = context.job_queue
+    now_epoch = int(time.time())
+    changed = [zone for zone, offset in armed_zone_offsets.items() if utc_offset(zone, now_epoch) != offset]
+    if changed:
+        lessons = await get_zone_reminder_lessons(changed)
+        table = lesson_table_class().from_lessons(lessons, await get_user_timezones(), now_epoch)
+        count = await schedule_all_reminders(job_queue, send_lesson_reminder, table, now_epoch)
+        if DEFAULT_TIMEZONE in changed:
+            template_table = lesson_table_class().from_lessons(await get_template_reminder_lessons(), now_epoch=now_epoch)
+            count += await schedule_all_reminders(
+                job_queue, send_template_reminder, template_table, now_epoch, kind=TEMPLATE_REMINDER
+            )
+        logging.info("UTC offset of %s changed, re-armed %d reminders", ", ".join(sorted(changed)), count)
+    for zone in list(armed_zone_offsets):
+        armed_zone_offsets[zone] = utc_offset(zone, now_epoch)
+        watch_zone_offset(job_queue, zone, now_epoch)
+
+async def save_reminder_index():
+    """Save the reminder index for the next start, tagged with the current storage stamp"""
+    stamp = await data_stamp()
+    if stamp is None:
+        return
+    table = lesson_table_class().from_lessons(await get_reminder_lessons(), await get_user_timezones())
+    await asyncio.get_running_loop().run_in_executor(None, table.save, REMINDER_INDEX_FILE, stamp)
+
+def start_sharded_reminders(job_queue):
+    """Take reminder shard leases and send their reminders from a minute tick"""
+    global lease_manager, reminder_tick_from
+    lease_manager = LeaseManager(LEASE_DB, WORKER_ID, REMINDER_SHARDS, LEASE_TTL)
+    now = time.time()
+    reminder_tick_from = int(now)
+    job_queue.run_repeating(lease_heartbeat, interval=LEASE_TTL / 3, first=0, name="lease_heartbeat")
+    # Just after each minute starts, when that minute's reminders fall due
+    job_queue.run_repeating(reminder_tick, interval=60, first=60 - now % 60 + 1, name="reminder_tick")
+    logging.info("Sending reminders for %d shards as worker %s", REMINDER_SHARDS, WORKER_ID)
+
+async def run_reminder_worker(application):
+    """Run the job queue and reminder sending without receiving updates, until SIGTERM/SIGINT"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    print("✅ Reminder worker is running...")
+    try:
+        await stop.wait()
+    finally:
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+def main():
+    """Start the bot"""
+    if BOT_ROLE not in ("all", "updates", "reminders"):
+        raise ValueError(f"Unknown BOT_ROLE: {BOT_ROLE}")
+    if BOT_ROLE != "all" and not REMINDER_SHARDS:
+        raise ValueError("BOT_ROLE=updates/reminders needs REMINDER_SHARDS")
+    if REMINDER_SHARDS and not LEASE_DB:
+        raise ValueError("REMINDER_SHARDS needs LEASE_DB set to a lease file that every worker shares")
+    if REMINDER_SHARDS and STORAGE_BACKEND != "sqlite":
+        # The file backends keep a copy per process that doesn't see the others' changes
+        raise ValueError("REMINDER_SHARDS needs STORAGE_BACKEND=sqlite")
+    # Setup logging
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    logging.info(
+        "Server time (UTC): %s, %s time: %s",
+        datetime.now(timezone.utc), DEFAULT_TIMEZONE, datetime.now(get_zone(DEFAULT_TIMEZONE))
+    )
+    startup_phase("imports")
+    # Create application
+    async def post_init(application: Application):
+        global reminder_dispatcher, broadcast_dispatcher, digest_dispatcher, startup_task
+
+        def sender(name):
+            """The send function of one dispatcher, reporting that dispatcher's queue"""
+            queue_gauge = metrics.DISPATCH_QUEUE.labels(name)
+
+            async def send(chat_id, text, **kwargs):
+                queue_gauge.set(dispatchers[name].pending())
+                try:
+                    with metrics.TELEGRAM_SEND_SECONDS.time():
+                        await application.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                except Exception as exc:
+                    metrics.TELEGRAM_SENDS.labels(type(exc).__name__).inc()
+                    raise
+                metrics.TELEGRAM_SENDS.labels("ok").inc()
+            return send
+
+        # Telegram's limit of about 30 messages per second applies to the whole bot
+        bucket = TokenBucket(30, 30)
+        # Of the network errors, a BadRequest won't go away by retrying and
+        # a message that TimedOut may have been delivered anyway
+        errors = {"transient_errors": (NetworkError,), "final_errors": (BadRequest, TimedOut)}
+        dispatchers = {
+            "reminders": MessageDispatcher(sender("reminders"), bucket=bucket, **errors),
+            "broadcast": MessageDispatcher(
+                sender("broadcast"), workers=BROADCAST_WORKERS, bucket=bucket, **errors
+            ),
+            "digest": MessageDispatcher(
+                sender("digest"), workers=DIGEST_WORKERS, bucket=bucket, **errors
+            )
+        }
+        for dispatcher in dispatchers.values():
+            dispatcher.start()
+        reminder_dispatcher = dispatchers["reminders"]
+        broadcast_dispatcher = dispatchers["broadcast"]
+        digest_dispatcher = dispatchers["digest"]
+        startup_phase("initialize")
+        # Not needed to answer updates, so done while the first ones are handled
+        startup_task = asyncio.create_task(finish_startup(application))
+
+    async def post_shutdown(application: Application):
+        if startup_task is not None and not startup_task.done():
+            startup_task.cancel()
+        if lease_manager is not None:
+            lease_manager.release_all()
+        if current_broadcast is not None and current_broadcast.running():
+            # Resumed from the last stored page on the next start
+            current_broadcast.task.cancel()
+        if reminder_dispatcher is not None:
+            await reminder_dispatcher.stop()
+        if broadcast_dispatcher is not None:
+            await broadcast_dispatcher.stop()
+        if digest_dispatcher is not None:
+            await digest_dispatcher.stop()
+        # Don't lose stamps of reminders sent just before stopping
+        if pending_last_notified:
+            await update_lessons_last_notified(pending_last_notified[:])
+            pending_last_notified.clear()
+        if reminders_ready and not REMINDER_SHARDS:
+            try:
+                await save_reminder_index()
+            except Exception:
+                logging.exception("Saving the reminder index to %s failed", REMINDER_INDEX_FILE)
+        storage.shutdown()
+
+    # A reminder worker handles no updates, so it has no conversations to keep
+    persistent = BOT_ROLE != "reminders"
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(TimedRequest(connection_pool_size=256))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if persistent:
+        builder.persistence(StorePersistence(PERSISTENCE_INTERVAL))
+    application = builder.build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -1127,9 +1889,15 @@ def main():
     application.add_handler(CommandHandler("schedule", schedule_command))
     application.add_handler(CommandHandler("lessons_today", lessons_today_command))
     application.add_handler(CommandHandler("lessons_tomorrow", lessons_tomorrow_command))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Add conversation handler for adding lessons
     add_lesson_conv = ConversationHandler(
+        name="add_lesson",
+        persistent=persistent,
         entry_points=[CommandHandler("add_lesson", add_lesson_command)],
         states={
             WAITING_COURSE_NAME: [
@@ -1161,6 +1929,8 @@ def main():
     
     # Add conversation handler for removing lessons
     remove_lesson_conv = ConversationHandler(
+        name="remove_lesson",
+        persistent=persistent,
         entry_points=[CommandHandler("remove_lesson", remove_lesson_command)],
         states={
             WAITING_REMOVE_DAY_SELECTION: [
@@ -1181,6 +1951,8 @@ def main():
     
     # Add conversation handler for turning on/off reminder
     reminder_conv = ConversationHandler(
+        name="turn_on_off",
+        persistent=persistent,
         entry_points=[
             CommandHandler("turn_on_off", turn_on_off_reminder_command)
         ],
@@ -1213,12 +1985,30 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_text))
     application.add_error_handler(error_handler)
 
-    # Schedule reminder checks (every 60 seconds)
-    application.job_queue.run_repeating(check_and_send_reminders, interval=60, first=10)
-    
+    if STARTUP_PROFILE:
+        application.add_handler(TypeHandler(Update, record_first_update), group=STARTUP_PROFILE_GROUP)
+
+    metrics.instrument_handlers(application, SLOW_HANDLER_SECONDS)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+    startup_phase("build")
+
     # Start the bot
-    print("✅ Bot is running...")
-    application.run_polling()
+    if BOT_ROLE == "reminders":
+        asyncio.run(run_reminder_worker(application))
+    elif WEBHOOK_URL:
+        print(f"✅ Bot is running (webhook on port {PORT})...")
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=get_webhook_secret(),
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        print("✅ Bot is running...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
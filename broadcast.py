@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Recipients are read from storage and sent this many at a time; progress is
+# stored after each page
+PAGE_SIZE = 100
+
+STATUS_LABELS = {
+    "running": "in progress",
+    "done": "finished",
+    "cancelled": "cancelled"
+}
+
+def new_broadcast(text, admin_chat_id, report_message_id=None):
+    """State of a broadcast that hasn't sent anything yet.
+
+    ``text`` is sent as HTML. ``report_message_id`` is the message in the
+    admin's chat that shows the progress.
+    """
+    return {
+        "text": text,
+        "admin": admin_chat_id,
+        "report_message_id": report_message_id,
+        "status": "running",
+        "started": time.time(),
+        # Last user ID of the last page sent
+        "cursor": "",
+        "sent": 0,
+        "failed": 0,
+        # Seconds spent sending, across restarts
+        "elapsed": 0.0
+    }
+
+def progress_text(state):
+    """Progress report of a broadcast"""
+    rate = (state["sent"] + state["failed"]) / state["elapsed"] if state["elapsed"] else 0
+    return (
+        f"📣 Broadcast {STATUS_LABELS.get(state['status'], state['status'])}\n\n"
+        f"✅ Sent: {state['sent']}\n"
+        f"❌ Failed: {state['failed']}\n"
+        f"⚡ {rate:.1f} messages/s"
+    )
+
+class Broadcast:
+    """Sends one message to every user, resuming from the stored progress.
+
+    Recipients are read from storage in user ID order, ``page_size`` at a
+    time, and queued on ``dispatcher``, which must not be used for anything
+    else. Once a page was delivered or dropped, the last user ID of the page
+    and the counts are stored, so after a restart the broadcast continues with
+    the next page; only a page cut short by the restart is sent twice.
+
+    ``report(state)`` is awaited with the progress at most every
+    ``report_interval`` seconds, and once more when the broadcast ends.
+    """
+
+    def __init__(self, state, dispatcher, report=None, report_interval=10, page_size=PAGE_SIZE):
+        self.state = state
+        self.dispatcher = dispatcher
+        self.report = report
+        self.report_interval = report_interval
+        self.page_size = page_size
+        self.task = None
+        self._cancelled = False
+
+    def start(self):
+        """Run the broadcast in a background task"""
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def cancel(self):
+        """Stop once the page being sent is done"""
+        self._cancelled = True
+
+    async def run(self):
+        state = self.state
+        reported = time.monotonic()
+        try:
+            while state["status"] == "running":
+                if self._cancelled:
+                    state["status"] = "cancelled"
+                    break
+                user_ids = await storage.get_user_ids_after(state["cursor"], self.page_size)
+                if not user_ids:
+                    state["status"] = "done"
+                    break
+                await self._send_page(user_ids)
+                if time.monotonic() - reported >= self.report_interval:
+                    reported = time.monotonic()
+                    await self._report()
+            await storage.save_broadcast(state)
+        except Exception:
+            # The stored state still says running, so the next start resumes it
+            logger.exception("Broadcast stopped after %d messages", state["sent"] + state["failed"])
+            return
+        logger.info(
+            "Broadcast %s: %d sent, %d failed in %.1fs",
+            state["status"], state["sent"], state["failed"], state["elapsed"]
+        )
+        await self._report()
+
+    async def _send_page(self, user_ids):
+        state = self.state
+        started = time.monotonic()
+        counts = {"sent": 0, "failed": 0}
+
+        def count(result):
+            counts[result] += 1
+            metrics.BROADCAST_MESSAGES.labels(result).inc()
+
+        for user_id_str in user_ids:
+            try:
+                chat_id = int(user_id_str)
+            except ValueError:
+                continue
+            self.dispatcher.submit(
+                chat_id,
+                state["text"],
+                on_sent=lambda: count("sent"),
+                on_failed=lambda: count("failed"),
+                parse_mode="HTML"
+            )
+        await self.dispatcher.join()
+        state["cursor"] = user_ids[-1]
+        state["sent"] += counts["sent"]
+        state["failed"] += counts["failed"]
+        state["elapsed"] += time.monotonic() - started
+        await storage.save_broadcast(state)
+
+    async def _report(self):
+        if self.report is None:
+            return
+        try:
+            await self.report(self.state)
+        except Exception:
+            logger.exception("Reporting broadcast progress failed")
@@ -1,34 +1,116 @@
-import json
+import itertools
 import os
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from json_store import JsonLessonStore, minute_in_range
+from lessons import new_lesson_id
+from reminders import DAYS_ORDER, MINUTES_PER_WEEK, get_reminder_minute_of_week
+from timezones import DEFAULT_TIMEZONE
+
 # Path to store user lessons data
 DATA_FILE = "lessons_data.json"
 
+# Storage backend: "json" (single lessons file), "journal" (lessons file plus
+# an append-only journal), "sharded" (file per user) or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+# SQLite database file, used when STORAGE_BACKEND is "sqlite"
+DB_FILE = os.environ.get("LESSONS_DB", "lessons.db")
+# Data directory, used when STORAGE_BACKEND is "sharded"
+DATA_DIR = os.environ.get("LESSONS_DIR", "lessons_data")
+# Journal size that triggers a new snapshot, used when STORAGE_BACKEND is "journal"
+JOURNAL_MAX_BYTES = int(os.environ.get("JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Position of each day in the week, for sorting
+DAY_RANK = {day: i for i, day in enumerate(DAYS_ORDER)}
+
+def _create_store():
+    """Create the lesson store for the configured backend"""
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_store import SqliteLessonStore
+        # Existing JSON data is imported the first time the database is opened
+        return SqliteLessonStore(DB_FILE, json_path=DATA_FILE)
+    if STORAGE_BACKEND == "journal":
+        from journal_store import JournalLessonStore
+        # The existing lessons file serves as the first snapshot
+        return JournalLessonStore(DATA_FILE, max_journal_bytes=JOURNAL_MAX_BYTES)
+    if STORAGE_BACKEND == "sharded":
+        from sharded_store import ShardedLessonStore
+        # An existing lessons file is split into per-user files on first start
+        return ShardedLessonStore(DATA_DIR, json_path=DATA_FILE)
+    if STORAGE_BACKEND == "json":
+        return JsonLessonStore(DATA_FILE)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+# Created on first use, so importing this module doesn't open any files
+_store = None
+_store_lock = threading.Lock()
+
+def _get_store():
+    """The lesson store, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = _create_store()
+                _index_followers(store)
+                _store = store
+    return _store
+
+# Schedule versions: every mutation that changes what a user's schedule looks
+# like gives that user a new version, so rendered schedules can be cached per
+# version. Versions come from one global counter and are never reused.
+_version_counter = itertools.count(1)
+_data_version = 0
+_user_versions = {}
+
+_seen_reloads = 0
+
+def schedule_version(user_id):
+    """Current version of a user's schedule; changes whenever the schedule does"""
+    global _seen_reloads
+    reloads = _get_store().reload_count()
+    if reloads != _seen_reloads:
+        # The lessons file was edited behind our back, so any schedule may have changed
+        _seen_reloads = reloads
+        _bump_schedule_version()
+    return (_data_version, _user_versions.get(str(user_id), 0))
+
+def user_schedule_version(user_id):
+    """The part of a user's schedule version set by changes to that user only; never reads the store"""
+    return _user_versions.get(str(user_id), 0)
+
+def _bump_schedule_version(user_id=None):
+    """Give one user (or, with no user, everyone) a new schedule version.
+
+    Called after the store write, so a version is never paired with older data.
+    """
+    global _data_version
+    if user_id is None:
+        _data_version = next(_version_counter)
+    else:
+        _user_versions[str(user_id)] = next(_version_counter)
+
+def version_mark():
+    """A number below every schedule version given out from now on"""
+    return next(_version_counter)
+
+def data_stamp():
+    """A value that changes whenever the stored lessons do, or None if the backend can't tell"""
+    return _get_store().data_stamp()
+
 def load_lessons():
-    """Load lessons from JSON file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    """Load all lessons as a {user_id: [lesson, ...]} dict"""
+    return _get_store().all_lessons()
 
 def save_lessons(data):
-    """Save lessons to JSON file"""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    """Replace all stored lessons with ``data``"""
+    _get_store().replace_all(data)
+    _bump_schedule_version()
 
 def add_lesson(user_id, day, time, subject, notification_time):
-    """Add a lesson for a user"""
-    lessons = load_lessons()
-    user_id_str = str(user_id)
-    
-    if user_id_str not in lessons:
-        lessons[user_id_str] = []
-    
+    """Add a lesson for a user; returns the stored lesson including its ID"""
     lesson = {
         "day": day.lower(),
         "time": time,
@@ -36,89 +118,112 @@ def add_lesson(user_id, day, time, subject, notification_time):
         "notification_time": notification_time,
         "last_notified": None
     }
-    
-    lessons[user_id_str].append(lesson)
-    save_lessons(lessons)
-    return lesson
+    stored = _get_store().add_lesson(str(user_id), lesson)
+    _bump_schedule_version(user_id)
+    return stored
 
-def remove_lesson(user_id, day, time, subject):
+def remove_lesson(user_id, lesson_id):
     """Remove a lesson for a user"""
-    lessons = load_lessons()
     user_id_str = str(user_id)
-    
-    if user_id_str not in lessons:
-        return None
-    
-    initial_count = len(lessons[user_id_str])
-    
-    lessons[user_id_str] = [
-        l for l in lessons[user_id_str] 
-        if not (l["day"].lower() == day.lower() and l["time"] == time and l["subject"].lower() == subject.lower())
-    ]
-    
-    save_lessons(lessons)
-    
-    if len(lessons[user_id_str]) < initial_count:
-        return True
-    return False
+    removed = _get_store().remove_lesson(user_id_str, lesson_id)
+    follow, lesson = _followed_template_lesson(user_id_str, lesson_id)
+    if lesson is not None:
+        _drop_template_lesson(user_id_str, follow, lesson_id)
+        removed = True
+    _bump_schedule_version(user_id)
+    return removed
 
-def update_lesson_reminder(user_id, day, time, subject, new_notification_time):
+def update_lesson_reminder(user_id, lesson_id, new_notification_time):
     """Update the reminder time for a specific lesson"""
-    lessons = load_lessons()
     user_id_str = str(user_id)
-    
-    if user_id_str not in lessons:
-        return False
-    
-    # Find and update the lesson
-    for lesson in lessons[user_id_str]:
-        if (lesson["day"].lower() == day.lower() and 
-            lesson["time"] == time and 
-            lesson["subject"].lower() == subject.lower()):
+    updated = _get_store().update_lessons([
+        (user_id_str, lesson_id, {"notification_time": new_notification_time})
+    ]) == 1
+    if not updated:
+        follow, lesson = _followed_template_lesson(user_id_str, lesson_id)
+        if lesson is not None:
+            # First change to a template lesson: the user gets a private copy
+            # with the same ID, which hides the template's
             lesson["notification_time"] = new_notification_time
-            save_lessons(lessons)
-            return True
-    
-    return False
+            _get_store().set_user_lessons(user_id_str, _get_store().user_lessons(user_id_str) + [lesson])
+            _drop_template_lesson(user_id_str, follow, lesson_id)
+            updated = True
+    _bump_schedule_version(user_id)
+    return updated
 
 def get_user_lessons(user_id):
-    """Get all lessons for a user"""
-    lessons = load_lessons()
+    """Get all lessons for a user, including those taken from their template"""
     user_id_str = str(user_id)
-    return lessons.get(user_id_str, [])
+    lessons = _get_store().user_lessons(user_id_str)
+    follow = _get_store().get_meta(_follow_key(user_id_str))
+    if follow is None:
+        return lessons
+    hidden = set(follow["removed"])
+    hidden.update(lesson["id"] for lesson in lessons)
+    return [
+        dict(lesson, last_notified=None) for lesson in _get_template(follow["template"])
+        if lesson["id"] not in hidden
+    ] + lessons
+
+def get_own_lessons(user_id):
+    """Get a user's own lessons, without those taken from their template"""
+    return _get_store().user_lessons(str(user_id))
+
+def get_lesson(user_id, lesson_id):
+    """Get a single lesson of a user, or None if it doesn't exist"""
+    user_id_str = str(user_id)
+    lesson = _get_store().get_lesson(user_id_str, lesson_id)
+    if lesson is None:
+        lesson = _followed_template_lesson(user_id_str, lesson_id)[1]
+    return lesson
+
+def get_day_lessons(user_id, day):
+    """Get a user's lessons on one day, sorted by time"""
+    return sorted(
+        (lesson for lesson in get_user_lessons(user_id) if lesson["day"].lower() == day.lower()),
+        key=lambda x: x["time"]
+    )
 
 def get_all_lessons():
     """Get all lessons for all users"""
-    return load_lessons()
+    return _get_store().all_lessons()
+
+def get_lessons_firing_between(start_minute, end_minute):
+    """Get lessons whose reminder fires in [start_minute, end_minute) of the week.
+
+    Minutes count from Monday 00:00; a range with start > end wraps around
+    the end of the week.
+    """
+    return _get_store().lessons_firing_between(start_minute, end_minute)
 
-def update_lesson_last_notified(user_id, day, time, subject, last_notified_iso):
+def get_reminder_lessons():
+    """Get all lessons that have a reminder set"""
+    return _get_store().lessons_firing_between(0, MINUTES_PER_WEEK)
+
+def update_lesson_last_notified(user_id, lesson_id, last_notified_iso):
     """Update the last notified timestamp for a specific lesson"""
-    lessons = load_lessons()
-    user_id_str = str(user_id)
-    if user_id_str not in lessons:
-        return False
+    return update_lessons_last_notified([(user_id, lesson_id, last_notified_iso)]) == 1
 
-    for lesson in lessons[user_id_str]:
-        if (lesson["day"].lower() == day.lower() and
-            lesson["time"] == time and
-            lesson["subject"].lower() == subject.lower()):
-            lesson["last_notified"] = last_notified_iso
-            save_lessons(lessons)
-            return True
+def update_lessons_last_notified(stamps):
+    """Record several last notified timestamps with a single write.
 
-    return False
+    ``stamps`` is a list of ``(user_id, lesson_id, last_notified_iso)`` tuples.
+    Returns the number of lessons updated. last_notified isn't shown in any
+    schedule view, so this doesn't change schedule versions.
+    """
+    return _get_store().update_lessons([
+        (str(user_id), lesson_id, {"last_notified": last_notified_iso})
+        for user_id, lesson_id, last_notified_iso in stamps
+    ])
 
 def get_week_schedule(user_id):
     """Get lessons for the current week"""
     lessons = get_user_lessons(user_id)
     
-    # Days of week
-    days_order = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-    
     # Sort lessons by day of week, then by time
     sorted_lessons = sorted(
         lessons,
-        key=lambda x: (days_order.index(x["day"].lower()), x["time"])
+        key=lambda x: (DAY_RANK[x["day"].lower()], x["time"])
     )
     
     return sorted_lessons
@@ -126,20 +231,389 @@ def get_week_schedule(user_id):
 # Template user ID - new users will get this user's schedule
 TEMPLATE_USER_ID = "1658352530"
 
+# Template schedules. Instead of a copy of every lesson, a new user gets a
+# reference to a template: a frozen copy of the template user's schedule,
+# stored once as metadata ("template:<n>") and shared by all its followers.
+# A new template is only made when the template user's schedule changed since
+# the last one. A follower's record ("follow:<user_id>") lists the template
+# lessons they removed or changed; a changed lesson becomes a private copy
+# with the same ID. "followers:<n>:<user_id>" holds the same removed list by
+# template, so a template's followers are one prefix lookup. Template
+# reminders are stamped per template lesson ("template_notified:<n>"), since
+# they are sent to all followers at once.
+
+# Templates never change once written, so they are cached for good
+_templates = {}
+
+def _template_key(number):
+    return f"template:{number}"
+
+def _follow_key(user_id_str):
+    return f"follow:{user_id_str}"
+
+def _followers_prefix(number):
+    return f"followers:{number}:"
+
+# Set once the follower index covers every follow record
+FOLLOWERS_INDEXED_KEY = "followers_indexed"
+
+def _follow_changes(user_id_str, follow, old_follow=None):
+    """Metadata changes that replace a user's follow record ``old_follow`` with ``follow`` (None for none)"""
+    changes = {}
+    if old_follow is not None:
+        changes[_followers_prefix(old_follow["template"]) + user_id_str] = None
+    if follow is not None:
+        changes[_followers_prefix(follow["template"]) + user_id_str] = follow["removed"]
+    changes[_follow_key(user_id_str)] = follow
+    return changes
+
+def _index_followers(store):
+    """Build the follower index of data written before it existed"""
+    if store.get_meta(FOLLOWERS_INDEXED_KEY):
+        return
+    changes = {FOLLOWERS_INDEXED_KEY: 1}
+    for key, follow in store.meta_items("follow:").items():
+        changes[_followers_prefix(follow["template"]) + key.split(":", 1)[1]] = follow["removed"]
+    store.update_meta(changes)
+
+def _template_numbers():
+    """Numbers of all templates, in order"""
+    return sorted(int(key.split(":", 1)[1]) for key in _get_store().meta_items("template:"))
+
+def _template_fields(lesson):
+    return {key: lesson.get(key) for key in ("id", "day", "time", "subject", "notification_time")}
+
+def _get_template(number):
+    """Lessons of a template"""
+    lessons = _templates.get(number)
+    if lessons is None:
+        lessons = _templates[number] = _get_store().get_meta(_template_key(number))["lessons"]
+    return lessons
+
+def _followed_template_lesson(user_id_str, lesson_id):
+    """``(follow record, lesson)`` for a template lesson a user still has, else ``(follow, None)``"""
+    follow = _get_store().get_meta(_follow_key(user_id_str))
+    if follow is None or lesson_id in follow["removed"]:
+        return follow, None
+    for lesson in _get_template(follow["template"]):
+        if lesson["id"] == lesson_id:
+            return follow, dict(lesson, last_notified=None)
+    return follow, None
+
+def _drop_template_lesson(user_id_str, follow, lesson_id):
+    follow["removed"].append(lesson_id)
+    _get_store().update_meta(_follow_changes(user_id_str, follow))
+
+def _current_template():
+    """Number of the template matching the template user's schedule, making one if needed"""
+    lessons = [_template_fields(lesson) for lesson in _get_store().user_lessons(TEMPLATE_USER_ID)]
+    if not lessons:
+        return None
+    latest = max(_template_numbers(), default=0)
+    if latest and _get_template(latest) == lessons:
+        return latest
+    _get_store().update_meta({_template_key(latest + 1): {"owner": TEMPLATE_USER_ID, "lessons": lessons}})
+    return latest + 1
+
 def seed_user_lessons_from_existing(user_id):
-    """If user has no lessons, copy from the template user."""
-    lessons = load_lessons()
+    """If user has no lessons, make them follow the template user's schedule."""
     user_id_str = str(user_id)
     # If user already has lessons, do nothing
-    if user_id_str in lessons and lessons[user_id_str]:
-        return False
-    # No data to seed from
-    if not lessons:
+    if get_user_lessons(user_id_str):
         return False
-    # Use template user's schedule
-    if TEMPLATE_USER_ID not in lessons or not lessons[TEMPLATE_USER_ID]:
+    number = _current_template()
+    if number is None:
         return False
-    # Copy lessons from template user
-    lessons[user_id_str] = [lesson.copy() for lesson in lessons[TEMPLATE_USER_ID]]
-    save_lessons(lessons)
+    old_follow = _get_store().get_meta(_follow_key(user_id_str))
+    if get_user_timezone(user_id_str) != DEFAULT_TIMEZONE:
+        # Templates are in the default timezone, so other users get their own copy
+        _get_store().set_user_lessons(user_id_str, [dict(lesson) for lesson in _get_template(number)])
+        _get_store().update_meta(_follow_changes(user_id_str, None, old_follow))
+    else:
+        # Replaces the record of a follower who removed every lesson
+        _get_store().update_meta(
+            _follow_changes(user_id_str, {"template": number, "removed": []}, old_follow)
+        )
+    _bump_schedule_version(user_id_str)
     return True
+
+def get_followed_template(user_id):
+    """Number of the template a user follows, or None"""
+    follow = _get_store().get_meta(_follow_key(str(user_id)))
+    return follow["template"] if follow else None
+
+def get_template_followers(number, lesson_id):
+    """IDs of the users who get a template lesson"""
+    prefix = _followers_prefix(number)
+    return [
+        key[len(prefix):]
+        for key, removed in _get_store().meta_items(prefix).items()
+        if lesson_id not in removed
+    ]
+
+def get_template_reminder_lessons(number=None):
+    """Lessons with a reminder of every template that has followers, as {number: [lesson, ...]}.
+
+    With ``number``, of that template only. Each lesson's ``last_notified``
+    is the template's last reminder for it.
+    """
+    if number is None:
+        numbers = [
+            number for number in _template_numbers()
+            if _get_store().meta_keys_after(_followers_prefix(number), "", 1)
+        ]
+    else:
+        numbers = [number]
+    result = {}
+    for number in numbers:
+        notified = _get_store().get_meta(f"template_notified:{number}") or {}
+        lessons = [
+            dict(lesson, last_notified=notified.get(lesson["id"]))
+            for lesson in _get_template(number)
+            if get_reminder_minute_of_week(lesson) is not None
+        ]
+        if lessons:
+            result[str(number)] = lessons
+    return result
+
+def get_template_lessons_firing_between(start_minute, end_minute):
+    """Template lessons whose reminder fires in [start_minute, end_minute), as {number: [lesson, ...]}"""
+    result = {}
+    for number, lessons in get_template_reminder_lessons().items():
+        firing = [
+            dict(lesson, last_notified=None) for lesson in lessons
+            if minute_in_range(get_reminder_minute_of_week(lesson), start_minute, end_minute)
+        ]
+        if firing:
+            result[number] = firing
+    return result
+
+def update_template_notified(number, lesson_id, last_notified_iso):
+    """Record that a template lesson's reminder went out to its followers"""
+    key = f"template_notified:{number}"
+    notified = _get_store().get_meta(key) or {}
+    notified[lesson_id] = last_notified_iso
+    _get_store().update_meta({key: notified})
+
+def _copy_fields(lesson):
+    """What identifies a copy of a template lesson, whatever its ID"""
+    return (lesson["day"].lower(), lesson["time"], lesson["subject"], lesson.get("notification_time"))
+
+def share_template_copies():
+    """Turn users holding copies of template lessons into template followers.
+
+    Seeding used to copy the template user's lessons under new IDs, so a
+    lesson counts as a copy when its day, time, subject and reminder match a
+    template lesson. Copies are dropped from the user's own lessons; the
+    rest stay as private lessons. Returns the number of users converted.
+    """
+    number = _current_template()
+    if number is None:
+        return 0
+    template = _get_template(number)
+    converted = 0
+    for user_id_str, lessons in _get_store().all_lessons().items():
+        if user_id_str == TEMPLATE_USER_ID or _get_store().get_meta(_follow_key(user_id_str)):
+            continue
+        # Template lesson ID for each of the user's copies, each template lesson matched once
+        unmatched = {}
+        for lesson in template:
+            unmatched.setdefault(_copy_fields(lesson), []).append(lesson["id"])
+        shared_ids = {}
+        for lesson in lessons:
+            ids = unmatched.get(_copy_fields(lesson))
+            if ids:
+                shared_ids[lesson["id"]] = ids.pop(0)
+        if not shared_ids:
+            continue
+        template_ids = {lesson["id"] for lesson in template}
+        taken = template_ids | {lesson["id"] for lesson in lessons}
+        copies, private = [], []
+        for lesson in lessons:
+            if lesson["id"] in shared_ids:
+                copies.append(dict(lesson, id=shared_ids[lesson["id"]]))
+                continue
+            if lesson["id"] in template_ids:
+                # Would hide the template lesson with the same ID
+                lesson = dict(lesson, id=new_lesson_id(taken))
+                taken.add(lesson["id"])
+            private.append(lesson)
+        matched = set(shared_ids.values())
+        removed = [lesson["id"] for lesson in template if lesson["id"] not in matched]
+        # The copies first take the template's IDs, so they hide its lessons
+        # once the follow record is written and can then be dropped: the
+        # schedule looks the same at every step
+        _get_store().set_user_lessons(user_id_str, copies + private)
+        _get_store().update_meta(_follow_changes(user_id_str, {"template": number, "removed": removed}))
+        _get_store().set_user_lessons(user_id_str, private)
+        _bump_schedule_version(user_id_str)
+        converted += 1
+    return converted
+
+# User timezones. A user's lessons are in their timezone, stored as
+# "timezone:<user_id>"; users without one are in DEFAULT_TIMEZONE, as are
+# template schedules, so a follower who changes timezone gets their own copy
+# of the template lessons.
+
+def _timezone_key(user_id_str):
+    return f"timezone:{user_id_str}"
+
+def get_user_timezone(user_id):
+    """A user's timezone name"""
+    return _get_store().get_meta(_timezone_key(str(user_id))) or DEFAULT_TIMEZONE
+
+def get_user_timezones():
+    """Timezones of the users who chose one other than the default, as {user_id: name}"""
+    return {key.split(":", 1)[1]: name for key, name in _get_store().meta_items("timezone:").items()}
+
+def set_user_timezone(user_id, name):
+    """Set a user's timezone (an IANA name checked by the caller)"""
+    user_id_str = str(user_id)
+    follow = _get_store().get_meta(_follow_key(user_id_str))
+    changes = {_timezone_key(user_id_str): None if name == DEFAULT_TIMEZONE else name}
+    if follow is not None and name != DEFAULT_TIMEZONE:
+        # The template lessons the user still has become their own; written
+        # before the follow record goes, so the schedule looks the same throughout
+        _get_store().set_user_lessons(user_id_str, get_user_lessons(user_id_str))
+        changes.update(_follow_changes(user_id_str, None, follow))
+    _get_store().update_meta(changes)
+    _bump_schedule_version(user_id_str)
+
+def get_zone_reminder_lessons(zones):
+    """Lessons with a reminder of the users in any of the given timezones, as {user_id: [lesson, ...]}"""
+    timezones = get_user_timezones()
+    if DEFAULT_TIMEZONE in zones:
+        return {
+            user_id_str: lessons for user_id_str, lessons in get_reminder_lessons().items()
+            if timezones.get(user_id_str, DEFAULT_TIMEZONE) in zones
+        }
+    result = {}
+    for user_id_str, name in timezones.items():
+        if name in zones:
+            lessons = [
+                lesson for lesson in _get_store().user_lessons(user_id_str)
+                if get_reminder_minute_of_week(lesson) is not None
+            ]
+            if lessons:
+                result[user_id_str] = lessons
+    return result
+
+# Bot persistence: conversation states and user_data of unfinished flows,
+# stored as metadata. A user's data is one "user_data:<user_id>" key and each
+# open conversation one "conversation:<name>:<chat_id>:<user_id>" key; both
+# are deleted once empty or ended, so only flows in progress take up space.
+
+def _user_data_key(user_id):
+    return f"user_data:{user_id}"
+
+def _conversation_prefix(name):
+    return f"conversation:{name}:"
+
+def get_user_data(user_id):
+    """A user's stored user_data, or None"""
+    return _get_store().get_meta(_user_data_key(user_id))
+
+def get_conversations(name):
+    """Open conversations of a ConversationHandler as {(chat_id, user_id): state}"""
+    prefix = _conversation_prefix(name)
+    return {
+        tuple(int(part) for part in key[len(prefix):].split(":")): state
+        for key, state in _get_store().meta_items(prefix).items()
+    }
+
+def save_bot_state(user_data, conversations):
+    """Store changed user_data ({user_id: data}) and conversation states ({(name, key): state}) at once.
+
+    Empty user_data and a state of None delete the stored entry.
+    """
+    changes = {_user_data_key(user_id): data or None for user_id, data in user_data.items()}
+    for (name, key), state in conversations.items():
+        changes[_conversation_prefix(name) + ":".join(str(part) for part in key)] = state
+    if changes:
+        _get_store().update_meta(changes)
+
+# Broadcasts. The one running (or the last one) is stored as the "broadcast"
+# key: its text, who started it, how far it got and its counts, so a restart
+# resumes it. Recipients are every user with lessons or a template.
+
+BROADCAST_KEY = "broadcast"
+
+def get_user_ids_after(after, limit):
+    """Up to ``limit`` user IDs greater than ``after`` (in string order), for paging through all users"""
+    own = _get_store().user_ids_after(after, limit)
+    followers = [
+        key.split(":", 1)[1]
+        for key in _get_store().meta_keys_after("follow:", _follow_key(after), limit)
+    ]
+    return sorted(set(own).union(followers))[:limit]
+
+def get_broadcast():
+    """The stored broadcast state, or None"""
+    return _get_store().get_meta(BROADCAST_KEY)
+
+def save_broadcast(state):
+    """Store a broadcast's state"""
+    _get_store().update_meta({BROADCAST_KEY: state})
+
+# Morning digests. A subscribed user gets the day's lessons at a local time of
+# their choice, stored as "digest:<user_id>" = "HH:MM"; "digest_at:<HH:MM>:<user_id>"
+# lists the same subscriptions by time, so the users due at a time are one
+# prefix lookup.
+
+def _digest_key(user_id_str):
+    return f"digest:{user_id_str}"
+
+def _digest_at_prefix(local_time):
+    return f"digest_at:{local_time}:"
+
+def get_digest_time(user_id):
+    """Local time ("HH:MM") of a user's digest, or None if they aren't subscribed"""
+    return _get_store().get_meta(_digest_key(str(user_id)))
+
+def set_digest_time(user_id, local_time):
+    """Subscribe a user to the digest at ``local_time`` ("HH:MM"), or unsubscribe them with None"""
+    user_id_str = str(user_id)
+    changes = {_digest_key(user_id_str): local_time}
+    old_time = _get_store().get_meta(_digest_key(user_id_str))
+    if old_time is not None:
+        changes[_digest_at_prefix(old_time) + user_id_str] = None
+    if local_time is not None:
+        changes[_digest_at_prefix(local_time) + user_id_str] = 1
+    _get_store().update_meta(changes)
+
+def get_digest_subscribers(local_time):
+    """IDs of the users whose digest is due at ``local_time`` ("HH:MM")"""
+    prefix = _digest_at_prefix(local_time)
+    return [key[len(prefix):] for key in _get_store().meta_items(prefix)]
+
+def get_day_lessons_of_users(day, user_ids):
+    """Lessons on one weekday of several users, as {user_id: [lesson, ...]} sorted by time.
+
+    Users without lessons that day are left out. Only the given users' own
+    lessons and follower index entries are read, and each template's lessons
+    of that day are picked out once for all its followers among them.
+    """
+    user_ids = {str(user_id) for user_id in user_ids}
+    if not user_ids:
+        return {}
+    result = _get_store().lessons_on_day(day, user_ids)
+    for number in _template_numbers():
+        prefix = _followers_prefix(number)
+        followers = _get_store().get_meta_many([prefix + user_id_str for user_id_str in user_ids])
+        if not followers:
+            continue
+        template_lessons = [lesson for lesson in _get_template(number) if lesson["day"].lower() == day]
+        for key, removed in followers.items():
+            user_id_str = key[len(prefix):]
+            own = result.get(user_id_str, [])
+            hidden = set(removed)
+            hidden.update(lesson["id"] for lesson in own)
+            lessons = [
+                dict(lesson, last_notified=None) for lesson in template_lessons
+                if lesson["id"] not in hidden
+            ] + own
+            if lessons:
+                result[user_id_str] = lessons
+    for lessons in result.values():
+        lessons.sort(key=lambda x: x["time"])
+    return result
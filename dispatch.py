@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket rate limiter: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def is_full(self):
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def try_acquire(self):
+        """Take a token; return 0 on success or the seconds to wait for the next one"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class MessageDispatcher:
+    """Sends queued messages concurrently under global and per-chat rate limits.
+
+    ``send`` is a coroutine function ``send(chat_id, text)``. A fixed pool of
+    worker tasks drains the queue; a failing message is logged and dropped
+    without affecting the others. Errors carrying a ``retry_after`` (Telegram
+    flood control) or listed in ``transient_errors`` are retried, except those
+    in ``final_errors`` (e.g. a timeout, after which the message may have
+    arrived anyway, so sending it again could deliver it twice).
+
+    Dispatchers sending for the same bot can share one global ``bucket``, so
+    together they stay within its rate.
+    """
+
+    def __init__(self, send, workers=16, rate=30, per_chat_rate=1, per_chat_burst=3,
+                 max_retries=3, transient_errors=(), final_errors=(), bucket=None):
+        self.send = send
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.transient_errors = transient_errors
+        self.final_errors = final_errors
+        self._global_bucket = bucket or TokenBucket(rate, rate)
+        self._chat_buckets = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the worker tasks (must be called from the running event loop)"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; messages still queued are dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def pending(self):
+        return self._queue.qsize()
+
+    async def join(self):
+        """Wait until every queued message was delivered or dropped"""
+        await self._queue.join()
+
+    def submit(self, chat_id, text, on_sent=None, on_failed=None, **kwargs):
+        """Queue a message; ``on_sent()`` is called once it was delivered, ``on_failed()`` if it was dropped"""
+        self._queue.put_nowait((chat_id, text, kwargs, on_sent, on_failed))
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Full buckets carry no state, so they can be dropped
+                self._chat_buckets = {
+                    cid: b for cid, b in self._chat_buckets.items() if not b.is_full()
+                }
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, on_sent, on_failed = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text, kwargs, on_sent)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to deliver message to chat %s", chat_id)
+                if on_failed is not None:
+                    on_failed()
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text, kwargs, on_sent):
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            try:
+                await self.send(chat_id, text, **kwargs)
+                break
+            except Exception as exc:
+                if isinstance(exc, self.final_errors):
+                    raise
+                retry_after = getattr(exc, "retry_after", None)
+                if attempt >= self.max_retries or (
+                        retry_after is None and not isinstance(exc, self.transient_errors)):
+                    raise
+                attempt += 1
+                if retry_after is None:
+                    delay = 2 ** attempt
+                elif hasattr(retry_after, "total_seconds"):
+                    delay = retry_after.total_seconds()
+                else:
+                    delay = retry_after
+                logger.warning("Retrying message to chat %s in %ss: %s", chat_id, delay, exc)
+                await asyncio.sleep(delay)
+        self.sent += 1
+        if on_sent is not None:
+            on_sent()
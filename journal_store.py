@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import zlib
+
+from json_store import JsonLessonStore, file_stamp
+from sharded_store import atomic_write, fsync_directory
+
+logger = logging.getLogger(__name__)
+
+class JournalLessonStore(JsonLessonStore):
+    """Lessons file plus an append-only journal of changes since it was written.
+
+    The lessons file (same format as for JsonLessonStore) is a snapshot. Every
+    mutation appends one record per user it touched to ``<path>.journal``::
+
+        <crc32 of the JSON, 8 hex digits> {"user": "<user_id>", "lessons": [...]}
+
+    A record holds the user's whole lesson list, so replaying it is idempotent.
+    Metadata changes are journaled the same way, as ``{"meta": {key: value}}``
+    records (a null value deletes the key), on top of the metadata file.
+    On startup the snapshot is loaded and the journal replayed on top of it;
+    replay stops at the first record that is truncated or fails its checksum
+    (a write torn by a crash), and the journal is cut back to that point.
+
+    Records are appended while the change is made, under the same hold of
+    the store lock, so they land in mutation order. The fsync happens after
+    the lock is released, and one fsync covers every record appended so far
+    (group commit): readers never wait for the disk, and a mutation only
+    returns once its record is synced.
+
+    Once the journal grows past ``max_journal_bytes`` a background thread
+    compacts it: the journal is renamed to ``<path>.journal.1`` and a fresh
+    one started, a new snapshot is written, and the old journal removed. A
+    crash at any point leaves files that replay to the same data.
+
+    A corrupt snapshot raises instead of being read as empty.
+    """
+
+    def __init__(self, path, max_journal_bytes=4 * 1024 * 1024):
+        super().__init__(path)
+        self.journal_path = f"{path}.journal"
+        self.old_journal_path = f"{path}.journal.1"
+        self.max_journal_bytes = max_journal_bytes
+        self._journal = None
+        self._journal_size = 0
+        # Records appended to the journal and synced so far
+        self._appended = 0
+        self._synced = 0
+        # Held while syncing or closing the journal
+        self._sync_lock = threading.Lock()
+        self._compacting = False
+        # Held for a whole compaction, so an older snapshot can't overwrite a newer one
+        self._compaction_lock = threading.Lock()
+
+    def data(self):
+        """Return the live {user_id: {lesson_id: lesson}} index, loading it on first use.
+
+        Callers must hold the store lock while using the result.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return self._data
+
+    def reload_count(self):
+        # Changes made by other processes aren't picked up
+        return 0
+
+    def data_stamp(self):
+        return (
+            self._file_stamp(), file_stamp(self.meta_path),
+            file_stamp(self.journal_path), file_stamp(self.old_journal_path)
+        )
+
+    def meta(self):
+        """Return the live metadata dict, loading the store on first use.
+
+        Callers must hold the store lock while using the result.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return self._meta
+
+    def _load(self):
+        raw = self._read_file()
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+        had_old_journal = os.path.exists(self.old_journal_path)
+        if had_old_journal:
+            self._replay(self.old_journal_path, raw, meta)
+        replayed = self._replay(self.journal_path, raw, meta)
+        self._data, assigned = self._index_lessons(raw)
+        self._meta = meta
+        self._loaded = True
+        self._journal = self._open_journal()
+        self._journal_size = self._journal.tell()
+        if replayed:
+            logger.info("Replayed %d journal records from %s", replayed, self.journal_path)
+        if had_old_journal or assigned:
+            # Finish an interrupted compaction / persist newly assigned IDs
+            self._compact()
+
+    def _open_journal(self):
+        journal = open(self.journal_path, 'ab')
+        # The journal may have just been created
+        fsync_directory(os.path.dirname(self.journal_path))
+        return journal
+
+    def replace_all(self, data):
+        # Load first, so metadata journaled since the last snapshot is kept
+        self.data()
+        super().replace_all(data)
+
+    def _replay(self, journal_path, raw, meta):
+        """Apply a journal's records to ``raw`` and ``meta``; returns the number applied"""
+        if not os.path.exists(journal_path):
+            return 0
+        applied = 0
+        offset = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                record = _decode_record(line)
+                if record is None:
+                    logger.warning(
+                        "Journal %s is damaged at byte %d, ignoring the rest", journal_path, offset
+                    )
+                    break
+                if "meta" in record:
+                    for key, value in record["meta"].items():
+                        if value is None:
+                            meta.pop(key, None)
+                        else:
+                            meta[key] = value
+                else:
+                    raw[record["user"]] = record["lessons"]
+                applied += 1
+                offset += len(line)
+        if offset < os.path.getsize(journal_path):
+            os.truncate(journal_path, offset)
+        return applied
+
+    def _snapshot(self, user_ids=None):
+        """Append records of the changed users (call with the lock held).
+
+        Returns the number of the append for _write, or None to rewrite the
+        snapshot instead.
+        """
+        if user_ids is None:
+            return None
+        return self._append("".join(
+            _encode_record(user_id_str, [lesson.to_dict() for lesson in self._data[user_id_str].values()])
+            for user_id_str in user_ids
+            if user_id_str in self._data
+        ))
+
+    def _meta_snapshot(self, keys):
+        """Append a record of the changed metadata keys (call with the lock held)"""
+        return self._append(_encode_meta_record({key: self._meta.get(key) for key in keys}))
+
+    def _append(self, records):
+        payload = records.encode()
+        # Into the file's buffer only; _write flushes and syncs it
+        self._journal.write(payload)
+        self._journal_size += len(payload)
+        self._appended += 1
+        return self._appended
+
+    def _write_meta(self, appended):
+        self._write(appended)
+
+    def _write(self, appended):
+        """Wait until append number ``appended`` is on disk, then compact if the journal got too big"""
+        if appended is None:
+            self._compact()
+            return
+        self._sync(appended)
+        with self._lock:
+            if self._journal_size < self.max_journal_bytes or self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, name="journal-compaction", daemon=True).start()
+
+    def _sync(self, appended):
+        with self._sync_lock:
+            if self._synced >= appended:
+                # Another mutation's fsync already covered it
+                return
+            # Appends made from here on wait for the next fsync
+            target = self._appended
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._synced = target
+
+    def _compact(self):
+        """Write a new snapshot of the current data and drop the journal it covers"""
+        with self._compaction_lock:
+            try:
+                self._rotate_and_snapshot()
+            except Exception:
+                logger.exception("Journal compaction of %s failed", self.path)
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+    def _rotate_and_snapshot(self):
+        with self._lock:
+            self._compacting = True
+            data = {
+                user_id_str: [lesson.to_dict() for lesson in lessons.values()]
+                for user_id_str, lessons in self._data.items()
+            }
+            meta = json.dumps(self._meta, indent=4)
+            # Later mutations go to a fresh journal; records appended so far
+            # must be on disk before their journal is renamed
+            if self._journal is not None:
+                with self._sync_lock:
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                    self._journal.close()
+                    self._synced = self._appended
+            if os.path.exists(self.journal_path):
+                if not os.path.exists(self.old_journal_path):
+                    os.replace(self.journal_path, self.old_journal_path)
+                else:
+                    # The old journal of an unfinished compaction is still
+                    # needed until the snapshot is written, so add to it
+                    with open(self.journal_path, 'rb') as src, open(self.old_journal_path, 'ab') as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_path)
+            self._journal = self._open_journal()
+            self._journal_size = 0
+        # The snapshot must be on disk before the journal it replaces goes
+        atomic_write(self.meta_path, meta, sync=True)
+        atomic_write(self.path, json.dumps(data, indent=4), sync=True)
+        if os.path.exists(self.old_journal_path):
+            os.remove(self.old_journal_path)
+
+def _encode_record(user_id_str, lessons):
+    return _frame({"user": user_id_str, "lessons": lessons})
+
+def _encode_meta_record(changes):
+    return _frame({"meta": changes})
+
+def _frame(record):
+    body = json.dumps(record, separators=(",", ":"))
+    return f"{zlib.crc32(body.encode()):08x} {body}\n"
+
+def _decode_record(line):
+    """Parse a journal line, or return None if it is torn or corrupt"""
+    if not line.endswith(b"\n"):
+        return None
+    checksum, _, body = line.rstrip(b"\n").partition(b" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(body):
+            return None
+        return json.loads(body)
+    except ValueError:
+        return None
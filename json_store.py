@@ -0,0 +1,368 @@
+import bisect
+import contextlib
+import copy
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+
+from lessons import DAY_INDEX, Lesson, new_lesson_id
+
+logger = logging.getLogger(__name__)
+
+def minute_in_range(minute, start_minute, end_minute):
+    """Check ``start <= minute < end`` on the weekly clock.
+
+    A range with ``start > end`` wraps around the end of the week.
+    """
+    if start_minute <= end_minute:
+        return start_minute <= minute < end_minute
+    return minute >= start_minute or minute < end_minute
+
+def file_stamp(path):
+    """(mtime, size) of a file, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class JsonLessonStore:
+    """In-memory copy of the lessons file with write-through persistence.
+
+    The file is parsed once and then served from memory. Every read checks the
+    file's mtime and size, so edits made behind our back (by hand or by another
+    process) are picked up on the next call instead of being overwritten.
+
+    Lessons are indexed by user and lesson ID, so lookups and mutations of a
+    single lesson are dict operations. They are held as compact Lesson records
+    and converted to and from dicts at the store boundary.
+
+    The store is thread-safe. The in-memory dict is guarded by a lock that is
+    only held while it is read, changed or serialized; the file itself is
+    written outside that lock, so reads don't wait for the disk.
+
+    Metadata (template references, user settings, ...) is a {key: JSON value}
+    dict kept in a second file next to the lessons file, ``<name>.meta.json``,
+    handled the same way. A sorted list of its keys makes prefix lookups a
+    binary search instead of a scan of every key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = f"{os.path.splitext(path)[0]}.meta.json"
+        self._data = {}
+        self._stamp = None
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._version = 0
+        self._written_version = 0
+        self._meta = None
+        self._meta_stamp = None
+        # Times the files were reloaded after being changed behind our back
+        self._reloads = 0
+        self._meta_version = 0
+        self._meta_written_version = 0
+        # Snapshot with lesson IDs assigned by a reload, written by _locked()
+        self._ids_snapshot = None
+        # Sorted keys of the metadata dict they were built from
+        self._meta_keys = []
+        self._meta_keys_of = None
+
+    def _file_stamp(self):
+        return file_stamp(self.path)
+
+    def data_stamp(self):
+        """Changes whenever the stored lessons or metadata do; None if there's no cheap way to tell"""
+        return (self._file_stamp(), file_stamp(self.meta_path))
+
+    def reload_count(self):
+        """How often the files were reloaded after a change made elsewhere, checking for one now"""
+        # Stat without the lock; it is only taken when a file looks changed
+        if self._file_stamp() != self._stamp or file_stamp(self.meta_path) != self._meta_stamp:
+            with self._locked():
+                self.data()
+                self.meta()
+        return self._reloads
+
+    def _read_file(self):
+        """Parse the lessons file; raises ValueError if it is corrupt"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def _index_lessons(self, raw):
+        """Turn {user_id: [lesson dict, ...]} into {user_id: {lesson_id: Lesson}}.
+
+        Returns the index and whether any lesson had to be given a new ID.
+        """
+        index = {}
+        assigned = False
+        for user_id_str, lessons in raw.items():
+            user_index = index[user_id_str] = {}
+            for lesson in lessons:
+                lesson = Lesson.from_dict(lesson)
+                if not lesson.id or lesson.id in user_index:
+                    lesson.id = new_lesson_id(user_index)
+                    assigned = True
+                user_index[lesson.id] = lesson
+        return index, assigned
+
+    def data(self):
+        """Return the live {user_id: {lesson_id: lesson}} index, reloading it if the file changed.
+
+        Callers must hold the store lock through _locked() while using the result.
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            if not self._loaded or stamp != self._stamp:
+                try:
+                    raw = self._read_file()
+                except ValueError:
+                    if not self._loaded:
+                        raise
+                    # Never replace good data with nothing: keep serving what we
+                    # have, and the next write puts a valid file back
+                    logger.exception("Lessons file %s is corrupt, keeping the data in memory", self.path)
+                    self._stamp = stamp
+                    return self._data
+                if self._loaded:
+                    self._reloads += 1
+                self._data, assigned = self._index_lessons(raw)
+                self._stamp = stamp
+                self._loaded = True
+                if assigned:
+                    # Persist new IDs right away so they stay stable, once
+                    # the lock is released
+                    self._ids_snapshot = self._snapshot()
+            return self._data
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the store lock, writing lesson IDs assigned meanwhile once it is released.
+
+        _write takes the write lock before the store lock, so it must never
+        be called with the store lock held.
+        """
+        with self._lock:
+            yield
+            snapshot, self._ids_snapshot = self._ids_snapshot, None
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def _snapshot(self, user_ids=None):
+        """Serialize the current data (call with the lock held).
+
+        ``user_ids`` are the users whose lessons changed, or None for all of
+        them; the single file is always written as a whole.
+        """
+        self._version += 1
+        payload = {
+            user_id_str: [lesson.to_dict() for lesson in lessons.values()]
+            for user_id_str, lessons in self._data.items()
+        }
+        return self._version, json.dumps(payload, indent=4)
+
+    def _write(self, snapshot):
+        """Atomically replace the file with a snapshot unless a newer one was written"""
+        version, payload = snapshot
+        with self._write_lock:
+            if version <= self._written_version:
+                return
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+            with self._lock:
+                os.replace(tmp_path, self.path)
+                self._stamp = self._file_stamp()
+                self._written_version = version
+
+    def all_lessons(self):
+        with self._locked():
+            return {
+                user_id_str: [lesson.to_dict() for lesson in lessons.values()]
+                for user_id_str, lessons in self.data().items()
+            }
+
+    def user_lessons(self, user_id_str):
+        with self._locked():
+            return [lesson.to_dict() for lesson in self.data().get(user_id_str, {}).values()]
+
+    def user_ids_after(self, after, limit):
+        """The first ``limit`` user IDs greater than ``after``, in string order"""
+        with self._locked():
+            return heapq.nsmallest(limit, (user_id_str for user_id_str in self.data() if user_id_str > after))
+
+    def get_lesson(self, user_id_str, lesson_id):
+        with self._locked():
+            lesson = self.data().get(user_id_str, {}).get(lesson_id)
+            return lesson.to_dict() if lesson else None
+
+    def add_lesson(self, user_id_str, lesson):
+        with self._locked():
+            user_index = self.data().setdefault(user_id_str, {})
+            lesson = Lesson.from_dict(dict(lesson, id=new_lesson_id(user_index)))
+            user_index[lesson.id] = lesson
+            snapshot = self._snapshot([user_id_str])
+        self._write(snapshot)
+        return lesson.to_dict()
+
+    def remove_lesson(self, user_id_str, lesson_id):
+        with self._locked():
+            if self.data().get(user_id_str, {}).pop(lesson_id, None) is None:
+                return False
+            snapshot = self._snapshot([user_id_str])
+        self._write(snapshot)
+        return True
+
+    def update_lessons(self, updates):
+        """Apply several ``(user_id, lesson_id, fields)`` updates and save the file once"""
+        with self._locked():
+            data = self.data()
+            updated = 0
+            changed = set()
+            for user_id_str, lesson_id, fields in updates:
+                lesson = data.get(user_id_str, {}).get(lesson_id)
+                if lesson is not None:
+                    lesson.update(fields)
+                    changed.add(user_id_str)
+                    updated += 1
+            if not changed:
+                return 0
+            snapshot = self._snapshot(changed)
+        self._write(snapshot)
+        return updated
+
+    def set_user_lessons(self, user_id_str, lessons):
+        with self._locked():
+            index, _ = self._index_lessons({user_id_str: lessons})
+            self.data()[user_id_str] = index[user_id_str]
+            snapshot = self._snapshot([user_id_str])
+        self._write(snapshot)
+
+    def replace_all(self, data):
+        with self._lock:
+            self._data, _ = self._index_lessons(data)
+            self._loaded = True
+            snapshot = self._snapshot()
+        self._write(snapshot)
+
+    def lessons_firing_between(self, start_minute, end_minute):
+        result = {}
+        with self._locked():
+            for user_id_str, lessons in self.data().items():
+                for lesson in lessons.values():
+                    minute = lesson.fire_minute
+                    if minute is not None and minute_in_range(minute, start_minute, end_minute):
+                        result.setdefault(user_id_str, []).append(lesson.to_dict())
+        return result
+
+    def lessons_on_day(self, day, user_ids):
+        """Lessons on ``day`` of the users in ``user_ids``, as {user_id: [lesson, ...]}"""
+        weekday = DAY_INDEX[day]
+        result = {}
+        with self._locked():
+            data = self.data()
+            for user_id_str in user_ids:
+                lessons = [
+                    lesson.to_dict() for lesson in data.get(user_id_str, {}).values()
+                    if lesson.weekday == weekday
+                ]
+                if lessons:
+                    result[user_id_str] = lessons
+        return result
+
+    def meta(self):
+        """Return the live metadata dict, reloading it if its file changed.
+
+        Callers must hold the store lock while using the result.
+        """
+        with self._lock:
+            stamp = file_stamp(self.meta_path)
+            if self._meta is None or stamp != self._meta_stamp:
+                if self._meta is not None:
+                    self._reloads += 1
+                if stamp is None:
+                    self._meta = {}
+                else:
+                    with open(self.meta_path, 'r') as f:
+                        self._meta = json.load(f)
+                self._meta_stamp = stamp
+            return self._meta
+
+    def _meta_snapshot(self, keys):
+        """Serialize the metadata after ``keys`` changed (call with the lock held)"""
+        self._meta_version += 1
+        return self._meta_version, json.dumps(self._meta, indent=4)
+
+    def _write_meta(self, snapshot):
+        """Atomically replace the metadata file unless a newer snapshot was written"""
+        version, payload = snapshot
+        with self._write_lock:
+            if version <= self._meta_written_version:
+                return
+            tmp_path = f"{self.meta_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+            with self._lock:
+                os.replace(tmp_path, self.meta_path)
+                self._meta_stamp = file_stamp(self.meta_path)
+                self._meta_written_version = version
+
+    def _sorted_meta_keys(self):
+        """All metadata keys in order (call with the lock held)"""
+        meta = self.meta()
+        # Rebuilt whenever the dict was replaced (reloaded, replayed, migrated)
+        if self._meta_keys_of is not meta:
+            self._meta_keys = sorted(meta)
+            self._meta_keys_of = meta
+        return self._meta_keys
+
+    def _prefixed_keys(self, prefix, after=""):
+        """Metadata keys starting with ``prefix`` and greater than ``after``, in order (call with the lock held)"""
+        keys = self._sorted_meta_keys()
+        index = bisect.bisect_left(keys, prefix)
+        if after >= prefix:
+            index = bisect.bisect_right(keys, after, index)
+        return itertools.takewhile(lambda key: key.startswith(prefix), itertools.islice(keys, index, None))
+
+    def get_meta(self, key):
+        with self._lock:
+            return copy.deepcopy(self.meta().get(key))
+
+    def get_meta_many(self, keys):
+        """Values of those of ``keys`` that are set, as {key: value}"""
+        with self._lock:
+            meta = self.meta()
+            return {key: copy.deepcopy(meta[key]) for key in keys if key in meta}
+
+    def meta_items(self, prefix):
+        with self._lock:
+            meta = self.meta()
+            return {key: copy.deepcopy(meta[key]) for key in self._prefixed_keys(prefix)}
+
+    def meta_keys_after(self, prefix, after, limit):
+        """The first ``limit`` metadata keys starting with ``prefix`` and greater than ``after``"""
+        with self._lock:
+            return list(itertools.islice(self._prefixed_keys(prefix, after), limit))
+
+    def update_meta(self, changes):
+        """Set several metadata keys at once; a value of None deletes the key"""
+        with self._lock:
+            meta = self.meta()
+            keys = self._sorted_meta_keys()
+            for key, value in changes.items():
+                if value is None:
+                    if key in meta:
+                        del meta[key]
+                        del keys[bisect.bisect_left(keys, key)]
+                else:
+                    if key not in meta:
+                        bisect.insort(keys, key)
+                    meta[key] = copy.deepcopy(value)
+            snapshot = self._meta_snapshot(list(changes))
+        self._write_meta(snapshot)
@@ -0,0 +1,142 @@
+import math
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT,
+    expires REAL NOT NULL
+);
+"""
+
+# A worker stops sending for a shard this long before its lease runs out, so
+# clock skew between workers can't make two of them send at the same time
+SAFETY_MARGIN = 2.0
+
+def shard_of(user_id, shards):
+    """The reminder shard a user belongs to"""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+class LeaseManager:
+    """Time-limited leases on reminder shards, shared by workers through an SQLite file.
+
+    Every worker calls ``heartbeat()`` periodically (well within ``ttl``). A
+    heartbeat marks the worker alive, renews its leases and balances the
+    shards: with ``n`` live workers each holds at most ``ceil(shards / n)``,
+    handing back extra shards when workers join and taking over shards whose
+    lease expired when a worker dies. All of it happens in one transaction,
+    so two workers never hold the same shard.
+
+    A worker only sends for a shard while ``owns()`` says so, which stops
+    ``SAFETY_MARGIN`` seconds before the lease expires. A shard's lease row
+    keeps its last expiry after the owner lets go (a handed back shard is
+    stored as expiring ``SAFETY_MARGIN`` after the moment it was released), so
+    the next owner knows from which time on the shard's reminders are its
+    responsibility.
+    """
+
+    def __init__(self, path, worker_id, shards, ttl=30.0):
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # shard -> lease expiry of the shards this worker holds
+        self.owned = {}
+
+    def owns(self, user_id):
+        """Whether this worker may send reminders for a user right now"""
+        expires = self.owned.get(shard_of(user_id, self.shards))
+        return expires is not None and time.time() < expires - SAFETY_MARGIN
+
+    def heartbeat(self):
+        """Renew, hand back and take over leases.
+
+        Returns ``(acquired, lost)``: a dict mapping each newly acquired shard
+        to the time its previous owner stopped being responsible for it (None
+        if it never had one), and the set of shards this worker no longer holds.
+        """
+        with self._lock:
+            previous = set(self.owned)
+            now = time.time()
+            expires = now + self.ttl
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO workers (worker_id, last_seen) VALUES (?, ?) "
+                    "ON CONFLICT(worker_id) DO UPDATE SET last_seen = excluded.last_seen",
+                    (self.worker_id, now)
+                )
+                conn.execute("DELETE FROM workers WHERE last_seen < ?", (now - 10 * self.ttl,))
+                live = conn.execute(
+                    "SELECT COUNT(*) FROM workers WHERE last_seen >= ?", (now - self.ttl,)
+                ).fetchone()[0]
+                target = math.ceil(self.shards / max(live, 1))
+
+                leases = {
+                    shard: (owner, lease_expires)
+                    for shard, owner, lease_expires in conn.execute("SELECT shard, owner, expires FROM leases")
+                }
+                mine = sorted(
+                    shard for shard, (owner, lease_expires) in leases.items()
+                    if owner == self.worker_id and lease_expires > now and shard < self.shards
+                )
+                keep, release = mine[:target], mine[target:]
+                if release:
+                    # Stop sending for them before recording when we stopped
+                    self.owned = {shard: e for shard, e in self.owned.items() if shard not in release}
+                    released = time.time() + SAFETY_MARGIN
+                for shard in keep:
+                    conn.execute(
+                        "UPDATE leases SET expires = ? WHERE shard = ? AND owner = ?",
+                        (expires, shard, self.worker_id)
+                    )
+                for shard in release:
+                    conn.execute(
+                        "UPDATE leases SET owner = NULL, expires = ? WHERE shard = ? AND owner = ?",
+                        (released, shard, self.worker_id)
+                    )
+
+                acquired = {}
+                for shard in range(self.shards):
+                    if len(keep) + len(acquired) >= target:
+                        break
+                    if shard in keep or shard in release:
+                        continue
+                    owner, lease_expires = leases.get(shard, (None, None))
+                    if owner is not None and lease_expires > now:
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO leases (shard, owner, expires) VALUES (?, ?, ?)",
+                        (shard, self.worker_id, expires)
+                    )
+                    acquired[shard] = None if lease_expires is None else lease_expires - SAFETY_MARGIN
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            self.owned = {shard: expires for shard in keep + list(acquired)}
+            return acquired, previous - set(self.owned)
+
+    def release_all(self):
+        """Hand back every shard and leave (call on shutdown)"""
+        with self._lock:
+            self.owned = {}
+            released = time.time() + SAFETY_MARGIN
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "UPDATE leases SET owner = NULL, expires = ? WHERE owner = ?", (released, self.worker_id)
+            )
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+            self._conn.execute("COMMIT")
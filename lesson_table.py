@@ -0,0 +1,190 @@
+import marshal
+import os
+import time
+
+import numpy as np
+
+from reminders import (
+    DAYS_ORDER,
+    MINUTES_PER_WEEK,
+    SECONDS_PER_WEEK,
+    WINDOW_SECONDS,
+    parse_notification_minutes,
+    stamp_epoch,
+    week_start_epoch
+)
+from timezones import DEFAULT_TIMEZONE, utc_offset
+
+# Bumped whenever the saved table layout changes
+SNAPSHOT_FORMAT = 2
+_SNAPSHOT_COLUMNS = ("user_ids", "weekdays", "lesson_minutes", "offsets", "last_notified", "zone_ids")
+
+class LessonTable:
+    """Columnar copy of every lesson that has a reminder.
+
+    Lessons are held as parallel NumPy arrays (user ID, weekday, minute of the
+    day, reminder offset, last notified time, timezone), so "which reminders
+    fire in this time range" is a handful of vectorized integer operations
+    over all lessons instead of per-lesson datetime arithmetic.
+
+    Fire times are kept as seconds into the UTC week, using each timezone's
+    UTC offset when the table is built; no timezone is looked at when reading
+    them. A table is only valid until one of its zones changes its offset
+    (DST); the bot then rebuilds the rows of that zone.
+    """
+
+    def __init__(self, user_ids, lesson_ids, weekdays, lesson_minutes, offsets, last_notified,
+                 zone_ids, zones, now_epoch=None):
+        self.user_ids = user_ids
+        self.lesson_ids = lesson_ids
+        self.weekdays = weekdays
+        self.lesson_minutes = lesson_minutes
+        self.offsets = offsets
+        self.last_notified = last_notified
+        self.zone_ids = zone_ids
+        self.zones = zones
+        # Minute of the (local) week at which each reminder fires
+        self.fire_minutes = (
+            weekdays.astype(np.int32) * 24 * 60 + lesson_minutes - offsets
+        ) % MINUTES_PER_WEEK
+        # UTC offset of each zone, and second of the UTC week at which each reminder fires
+        self.zone_offsets = np.zeros(len(zones), dtype=np.int32)
+        self.fire_seconds = self.fire_minutes * 60
+        self._set_offsets(int(time.time()) if now_epoch is None else now_epoch)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @classmethod
+    def from_lessons(cls, all_lessons, timezones=None, now_epoch=None):
+        """Build the table from a {user_id: [lesson, ...]} dict.
+
+        ``timezones`` maps user IDs to the timezone their lessons are in
+        (DEFAULT_TIMEZONE for users not in it).
+        """
+        timezones = timezones or {}
+        zone_index = {}
+        user_ids, lesson_ids, weekdays, lesson_minutes, offsets, last_notified, zone_ids = [], [], [], [], [], [], []
+        for user_id_str, lessons in all_lessons.items():
+            try:
+                user_id = int(user_id_str)
+            except ValueError:
+                continue
+            zone = timezones.get(user_id_str, DEFAULT_TIMEZONE)
+            zone_id = zone_index.setdefault(zone, len(zone_index))
+            for lesson in lessons:
+                offset = parse_notification_minutes(lesson.get("notification_time"))
+                day = lesson.get("day", "").lower()
+                if offset is None or day not in DAYS_ORDER:
+                    continue
+                try:
+                    hour, minute = map(int, lesson.get("time", "").split(':'))
+                except ValueError:
+                    continue
+                user_ids.append(user_id)
+                lesson_ids.append(lesson["id"])
+                weekdays.append(DAYS_ORDER.index(day))
+                lesson_minutes.append(hour * 60 + minute)
+                offsets.append(offset)
+                stamp = stamp_epoch(lesson.get("last_notified"))
+                last_notified.append(np.nan if stamp is None else stamp)
+                zone_ids.append(zone_id)
+        return cls(
+            np.array(user_ids, dtype=np.int64),
+            np.array(lesson_ids, dtype=object),
+            np.array(weekdays, dtype=np.int8),
+            np.array(lesson_minutes, dtype=np.int16),
+            np.array(offsets, dtype=np.int16),
+            np.array(last_notified, dtype=np.float64),
+            np.array(zone_ids, dtype=np.int16),
+            list(zone_index),
+            now_epoch
+        )
+
+    def _set_offsets(self, now_epoch):
+        """Compute the UTC fire times from each zone's offset at ``now_epoch``"""
+        for zone_id, zone in enumerate(self.zones):
+            offset = utc_offset(zone, now_epoch)
+            self.zone_offsets[zone_id] = offset
+            rows = self.zone_ids == zone_id
+            self.fire_seconds[rows] = (self.fire_minutes[rows] * 60 - offset) % SECONDS_PER_WEEK
+
+    def save(self, path, stamp):
+        """Write the table to a marshal file, tagged with the storage ``stamp`` it was built at"""
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "stamp": stamp,
+            "columns": {
+                name: (getattr(self, name).dtype.str, getattr(self, name).tobytes())
+                for name in _SNAPSHOT_COLUMNS
+            },
+            "lesson_ids": self.lesson_ids.tolist(),
+            "zones": self.zones
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, stamp, now_epoch=None):
+        """Read a table written by ``save``.
+
+        Returns None if the file is missing, unreadable or was saved at another
+        storage ``stamp``, i.e. the lessons changed since.
+        """
+        if stamp is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                snapshot = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+            return None
+        if snapshot.get("stamp") != stamp:
+            return None
+        columns = {
+            name: np.frombuffer(data, dtype=np.dtype(dtype))
+            for name, (dtype, data) in snapshot["columns"].items()
+        }
+        return cls(
+            lesson_ids=np.array(snapshot["lesson_ids"], dtype=object), zones=snapshot["zones"],
+            now_epoch=now_epoch, **columns
+        )
+
+    def next_fire_epochs(self, now_epoch):
+        """Unix time of each lesson's next reminder.
+
+        Same rules as ``reminders.next_reminder_epoch``: a reminder whose
+        window is still open counts as due now, and one already recorded in
+        ``last_notified`` moves to the following week.
+        """
+        into_week = now_epoch - week_start_epoch(now_epoch)
+        # Seconds from now until the fire time, in (-window, week - window]
+        delta = (self.fire_seconds - (into_week - WINDOW_SECONDS) - 1) % SECONDS_PER_WEEK - WINDOW_SECONDS + 1
+        fire = now_epoch + delta.astype(np.int64)
+        fire = np.where(self.last_notified == fire, fire + SECONDS_PER_WEEK, fire)
+        return fire
+
+    def due_between(self, start_epoch, end_epoch):
+        """Indices of reminders firing in [start, end), with their fire times.
+
+        ``start_epoch`` and ``end_epoch`` are Unix times less than a week
+        apart. Reminders already recorded in ``last_notified`` are left out.
+        """
+        span = end_epoch - start_epoch
+        into_week = start_epoch - week_start_epoch(start_epoch)
+        delta = (self.fire_seconds - into_week) % SECONDS_PER_WEEK
+        indices = np.nonzero(delta < span)[0]
+        fire = start_epoch + delta[indices].astype(np.int64)
+        fresh = self.last_notified[indices] != fire
+        return indices[fresh], fire[fresh]
+
+    def lesson_at(self, index):
+        """``(user_id, lesson_id)`` of a table row"""
+        return int(self.user_ids[index]), self.lesson_ids[index]
+
+    def zone_at(self, index):
+        """Timezone of a table row"""
+        return self.zones[self.zone_ids[index]]
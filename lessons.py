@@ -0,0 +1,113 @@
+import enum
+import secrets
+
+from reminders import DAYS_ORDER, MINUTES_PER_WEEK
+
+def new_lesson_id(taken=()):
+    """Generate a short lesson ID that is not in ``taken``"""
+    while True:
+        lesson_id = secrets.token_hex(4)
+        if lesson_id not in taken:
+            return lesson_id
+
+class ReminderOffset(enum.IntEnum):
+    """How many minutes before a lesson its reminder fires"""
+    NONE = 0
+    MIN_5 = 5
+    MIN_15 = 15
+    MIN_30 = 30
+    HOUR_1 = 60
+
+    @property
+    def label(self):
+        return REMINDER_LABELS[self]
+
+REMINDER_LABELS = {
+    ReminderOffset.NONE: "No reminder",
+    ReminderOffset.MIN_5: "5 min",
+    ReminderOffset.MIN_15: "15 min",
+    ReminderOffset.MIN_30: "30 min",
+    ReminderOffset.HOUR_1: "1 hour"
+}
+REMINDER_BY_LABEL = {label: offset for offset, label in REMINDER_LABELS.items()}
+
+DAY_INDEX = {day: i for i, day in enumerate(DAYS_ORDER)}
+
+# Shared int objects for every minute of the day (CPython only caches ints up to 256)
+_MINUTES = tuple(range(24 * 60))
+
+# Subject strings are shared between lessons: users seeded from the template
+# user all have the same subjects
+_subjects = {}
+
+def intern_subject(subject):
+    return _subjects.setdefault(subject, subject)
+
+class Lesson:
+    """Compact in-memory lesson record.
+
+    Holds the same data as a lesson dict in a fraction of the memory: the day
+    and time are small ints, the reminder is a ReminderOffset and subjects are
+    interned. Values that can't be parsed (e.g. a hand-edited time) are kept as
+    the original string so nothing is lost when the lesson is saved again.
+    """
+
+    __slots__ = ("id", "weekday", "minute", "subject", "reminder", "last_notified")
+
+    def __init__(self, id, weekday, minute, subject, reminder, last_notified=None):
+        self.id = id
+        self.weekday = weekday
+        self.minute = minute
+        self.subject = subject
+        self.reminder = reminder
+        self.last_notified = last_notified
+
+    @classmethod
+    def from_dict(cls, data):
+        lesson = cls(data.get("id"), None, None, None, None)
+        lesson.update(data)
+        return lesson
+
+    def update(self, fields):
+        """Set fields given in the lesson dict format"""
+        for key, value in fields.items():
+            if key == "id":
+                self.id = value
+            elif key == "day":
+                self.weekday = DAY_INDEX.get(value.lower(), value)
+            elif key == "time":
+                self.minute = _parse_minute(value)
+            elif key == "subject":
+                self.subject = intern_subject(value)
+            elif key == "notification_time":
+                self.reminder = REMINDER_BY_LABEL.get(value, value)
+            elif key == "last_notified":
+                self.last_notified = value
+
+    def to_dict(self):
+        """The lesson in the lesson dict (JSON) format"""
+        return {
+            "id": self.id,
+            "day": DAYS_ORDER[self.weekday] if isinstance(self.weekday, int) else self.weekday,
+            "time": f"{self.minute // 60:02d}:{self.minute % 60:02d}" if isinstance(self.minute, int) else self.minute,
+            "subject": self.subject,
+            "notification_time": self.reminder.label if isinstance(self.reminder, ReminderOffset) else self.reminder,
+            "last_notified": self.last_notified
+        }
+
+    @property
+    def fire_minute(self):
+        """Minute of the week at which the reminder fires, or None without a reminder"""
+        if (not isinstance(self.reminder, ReminderOffset) or self.reminder == ReminderOffset.NONE
+                or not isinstance(self.weekday, int) or not isinstance(self.minute, int)):
+            return None
+        return (self.weekday * 24 * 60 + self.minute - self.reminder) % MINUTES_PER_WEEK
+
+def _parse_minute(time_str):
+    try:
+        hour, minute = map(int, time_str.split(':'))
+    except (AttributeError, ValueError):
+        return time_str
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return time_str
+    return _MINUTES[hour * 60 + minute]
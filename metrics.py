@@ -0,0 +1,331 @@
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Minimal Prometheus-style metrics: counters, gauges and histograms with
+# labels, rendered in the Prometheus text format and served over HTTP. Each
+# update is a dict lookup plus a few additions under a lock, so it is cheap
+# enough to stay on in production.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self.labels()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """The child metric for one combination of label values"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        # Metrics without labels are used directly
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self, lock):
+        self.value = 0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self._default().set(value)
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets, lock):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = lock
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets, self._lock)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, values, child):
+        with self._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, values, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Bot metrics
+
+HANDLER_SECONDS = Histogram(
+    "remindelion_handler_seconds", "Time spent handling an update, per handler callback", ["handler"]
+)
+HANDLER_STORAGE_SECONDS = Histogram(
+    "remindelion_handler_storage_seconds", "Time a handler call waited for storage calls, per handler callback",
+    ["handler"]
+)
+HANDLER_TELEGRAM_SECONDS = Histogram(
+    "remindelion_handler_telegram_seconds", "Time a handler call spent in Telegram API requests, per handler callback",
+    ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "remindelion_handler_errors_total", "Handler callbacks that raised", ["handler"]
+)
+STORAGE_SECONDS = Histogram(
+    "remindelion_storage_seconds", "Duration of database.py calls", ["call"]
+)
+TELEGRAM_SEND_SECONDS = Histogram(
+    "remindelion_telegram_send_seconds", "Duration of Telegram send_message calls"
+)
+TELEGRAM_API_SECONDS = Histogram(
+    "remindelion_telegram_api_seconds", "Duration of Telegram Bot API requests, per API method", ["method"]
+)
+TELEGRAM_SENDS = Counter(
+    "remindelion_telegram_sends_total", "Telegram send_message calls by result", ["result"]
+)
+REMINDERS_SENT = Counter("remindelion_reminders_sent_total", "Lesson reminders delivered")
+REMINDERS_FAILED = Counter("remindelion_reminders_failed_total", "Lesson reminders that could not be delivered")
+REMINDERS_CAUGHT_UP = Counter(
+    "remindelion_reminders_caught_up_total", "Missed reminders sent late by the startup catch-up"
+)
+REMINDER_LATENESS_SECONDS = Histogram(
+    "remindelion_reminder_lateness_seconds", "Delivery time minus scheduled reminder time",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+)
+REMINDER_JOB_SECONDS = Histogram(
+    "remindelion_reminder_job_seconds", "Duration of a reminder job (lesson lookup, queueing, re-arming)"
+)
+REMINDER_JOBS_SCHEDULED = Gauge(
+    "remindelion_reminder_jobs_scheduled", "Reminder jobs armed by the last full rebuild"
+)
+REMINDER_REBUILD_SECONDS = Gauge(
+    "remindelion_reminder_rebuild_seconds", "Duration of the last full rebuild of reminder jobs"
+)
+REMINDER_REBUILD_LESSONS = Gauge(
+    "remindelion_reminder_rebuild_lessons", "Lessons scanned by the last full rebuild of reminder jobs"
+)
+REMINDER_TICK_LESSONS = Counter(
+    "remindelion_reminder_tick_lessons_total", "Lessons read from the fire-time index by sharded reminder ticks"
+)
+DISPATCH_QUEUE = Gauge(
+    "remindelion_dispatch_queue_messages", "Messages waiting in a send queue, per dispatcher", ["dispatcher"]
+)
+BROADCAST_MESSAGES = Counter(
+    "remindelion_broadcast_messages_total", "Broadcast messages by result (sent or failed)", ["result"]
+)
+DIGEST_MESSAGES = Counter(
+    "remindelion_digest_messages_total", "Morning digests by result (sent or failed)", ["result"]
+)
+
+def timed(histogram):
+    """Decorator recording the duration of a coroutine function in ``histogram``"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time():
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Storage and Telegram time of the handler call being handled in the current
+# task, as {"storage": seconds, "telegram": seconds}
+_call_times = contextvars.ContextVar("call_times", default=None)
+
+def add_call_time(kind, seconds):
+    """Count ``seconds`` of ``kind`` ("storage" or "telegram") time towards the running handler call"""
+    times = _call_times.get()
+    if times is not None:
+        times[kind] += seconds
+
+def track_handler(callback, slow_seconds=None):
+    """Wrap a handler callback so its duration, storage and Telegram time and errors are recorded.
+
+    Calls taking ``slow_seconds`` or longer are logged with that breakdown.
+    """
+    name = getattr(callback, "__name__", repr(callback))
+    histogram = HANDLER_SECONDS.labels(name)
+    storage_histogram = HANDLER_STORAGE_SECONDS.labels(name)
+    telegram_histogram = HANDLER_TELEGRAM_SECONDS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        times = {"storage": 0.0, "telegram": 0.0}
+        token = _call_times.set(times)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _call_times.reset(token)
+            histogram.observe(elapsed)
+            storage_histogram.observe(times["storage"])
+            telegram_histogram.observe(times["telegram"])
+            if slow_seconds is not None and elapsed >= slow_seconds:
+                logger.warning(
+                    "Slow handler %s: %.3fs (storage %.3fs, Telegram %.3fs)",
+                    name, elapsed, times["storage"], times["telegram"]
+                )
+    return wrapper
+
+def instrument_handlers(application, slow_seconds=None):
+    """Record the latency of every registered handler, including those inside conversations"""
+    def instrument(handler):
+        if hasattr(handler, "entry_points"):
+            for inner in handler.entry_points + handler.fallbacks:
+                instrument(inner)
+            for handlers in handler.states.values():
+                for inner in handlers:
+                    instrument(inner)
+        elif not getattr(handler.callback, "__wrapped__", None):
+            handler.callback = track_handler(handler.callback, slow_seconds)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/healthz":
+            body = b"ok\n"
+            content_type = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve /metrics and /healthz from a background thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,118 @@
+import asyncio
+import copy
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import storage
+
+class StorePersistence(BasePersistence):
+    """python-telegram-bot persistence for conversation states and user_data, kept in the lesson store.
+
+    The application hands over changed entries every ``update_interval``
+    seconds (and on shutdown). All entries of one such run are collected and
+    written to storage in a single call; user_data that didn't change since
+    it was last written is skipped, so idle users cost no writes.
+
+    A user's data is read from storage the first time an update or job for
+    them is handled, not at startup. Conversation states are read per
+    ConversationHandler when the application starts; only conversations in
+    progress are stored, so there are few of them.
+
+    Chat data, bot data and callback data are not stored.
+    """
+
+    def __init__(self, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(chat_data=False, bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        # Users whose data was read from storage, and the non-empty user_data
+        # among them as last read or written
+        self._loaded = set()
+        self._stored = {}
+        self._pending_user_data = {}
+        self._pending_conversations = {}
+        self._write_task = None
+
+    async def get_user_data(self):
+        # Loaded per user in refresh_user_data()
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await storage.get_conversations(name)
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        stored = await storage.get_user_data(user_id)
+        # A concurrent update for the same user may have loaded it meanwhile
+        if user_id not in self._loaded:
+            self._loaded.add(user_id)
+            if stored:
+                self._stored[user_id] = stored
+                user_data.update(copy.deepcopy(stored))
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_user_data(self, user_id, data):
+        if self._stored.get(user_id, {}) == data:
+            return
+        if data:
+            self._stored[user_id] = data
+        else:
+            self._stored.pop(user_id, None)
+        self._pending_user_data[user_id] = data
+        await self._write_soon()
+
+    async def drop_user_data(self, user_id):
+        self._stored.pop(user_id, None)
+        self._pending_user_data[user_id] = {}
+        await self._write_soon()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = new_state
+        await self._write_soon()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+
+    async def _write_soon(self):
+        """Wait for the pending changes to be written, together with the rest of this run's"""
+        if self._write_task is None:
+            self._write_task = asyncio.ensure_future(self._write_pending())
+        await self._write_task
+
+    async def _write_pending(self):
+        # The application updates all entries at once with asyncio.gather, so
+        # by the time this runs the other updates have queued their changes
+        await asyncio.sleep(0)
+        self._write_task = None
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        await storage.save_bot_state(user_data, conversations)
@@ -0,0 +1,118 @@
+import asyncio
+import io
+import threading
+import time
+
+# On-demand profiling, switched on for a limited time (/profile). A CPU
+# capture runs cProfile on the event loop thread, where handlers, jobs and
+# message rendering run, and around every storage call made meanwhile in the
+# storage threads, where the stores parse and write their files. A memory
+# capture traces allocations with tracemalloc. Both return a text report of
+# the top hotspots.
+
+# The CPU capture running, if any; storage threads check it on every call
+cpu_capture = None
+_capturing = False
+_lock = threading.Lock()
+
+class _CpuCapture:
+    def __init__(self):
+        # Profiles of storage calls that finished during the capture
+        self.storage_profiles = []
+        self.storage_calls = 0
+
+def run_profiled(func, *args):
+    """Call ``func`` under its own profile, kept if a CPU capture is still running when it returns"""
+    import cProfile
+
+    capture = cpu_capture
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args)
+    finally:
+        profile.disable()
+        with _lock:
+            if cpu_capture is capture:
+                capture.storage_profiles.append(profile)
+                capture.storage_calls += 1
+
+def _start():
+    global _capturing
+    if _capturing:
+        raise RuntimeError("A profile capture is already running")
+    _capturing = True
+
+async def capture_cpu(seconds, top=30):
+    """Profile the bot for ``seconds``; returns the report"""
+    # Imported here so the profilers don't add to startup time
+    import cProfile
+    import pstats
+
+    global cpu_capture, _capturing
+    _start()
+    capture = _CpuCapture()
+    profile = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        cpu_capture = capture
+        profile.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+        with _lock:
+            cpu_capture = None
+        _capturing = False
+    elapsed = time.perf_counter() - started
+
+    out = io.StringIO()
+    out.write(f"CPU profile over {elapsed:.1f}s\n\n")
+    sections = [("Event loop thread", [profile])]
+    if capture.storage_profiles:
+        sections.append((f"Storage threads ({capture.storage_calls} calls)", capture.storage_profiles))
+    for title, profiles in sections:
+        stats = pstats.Stats(profiles[0], stream=out)
+        for other in profiles[1:]:
+            stats.add(other)
+        for sort, label in (("tottime", "own time"), ("cumulative", "cumulative time")):
+            out.write(f"===== {title}, top {top} by {label} =====\n")
+            stats.sort_stats(sort).print_stats(top)
+    return out.getvalue()
+
+async def capture_memory(seconds, top=30):
+    """Trace allocations for ``seconds``; returns the report"""
+    import tracemalloc
+
+    global _capturing
+    _start()
+    # Tracing may have been turned on at startup (PYTHONTRACEMALLOC)
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+        _capturing = False
+
+    ignore = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+    ]
+    before = before.filter_traces(ignore)
+    after = after.filter_traces(ignore)
+    lines = [
+        f"Memory trace over {seconds}s",
+        f"Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB",
+        "",
+        f"===== Top {top} lines by memory in use, allocated while tracing =====",
+    ]
+    lines.extend(str(stat) for stat in after.statistics("lineno")[:top])
+    lines.extend(["", f"===== Top {top} lines by growth during the capture ====="])
+    lines.extend(str(stat) for stat in after.compare_to(before, "lineno")[:top])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from timezones import DEFAULT_TIMEZONE, get_zone, utc_offset
+
+# A reminder is only sent inside this window after its fire time
+REMINDER_WINDOW = timedelta(seconds=60)
+WINDOW_SECONDS = int(REMINDER_WINDOW.total_seconds())
+
+DAYS_ORDER = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MINUTES_PER_WEEK = 7 * 24 * 60
+SECONDS_PER_WEEK = MINUTES_PER_WEEK * 60
+# Fire times are Unix times, counted in weeks from Monday 1970-01-05 00:00 UTC
+MONDAY_EPOCH = 4 * 24 * 3600
+
+def parse_notification_minutes(notification_time):
+    """Convert notification time string to minutes"""
+    mapping = {
+        "5 min": 5,
+        "15 min": 15,
+        "30 min": 30,
+        "1 hour": 60
+    }
+    return mapping.get(notification_time)
+
+def get_reminder_minute_of_week(lesson):
+    """Minute of the week (Monday 00:00 = 0) at which a lesson's reminder fires.
+
+    Returns None for lessons without a valid reminder.
+    """
+    minutes_before = parse_notification_minutes(lesson.get("notification_time"))
+    if minutes_before is None:
+        return None
+    day = lesson.get("day", "").lower()
+    if day not in DAYS_ORDER:
+        return None
+    try:
+        hour, minute = map(int, lesson.get("time", "").split(':'))
+    except ValueError:
+        return None
+    lesson_minute = DAYS_ORDER.index(day) * 24 * 60 + hour * 60 + minute
+    return (lesson_minute - minutes_before) % MINUTES_PER_WEEK
+
+def stamp_epoch(value):
+    """Unix time of a ``last_notified`` stamp, or None.
+
+    Stamps without an offset were written in the default timezone.
+    """
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=get_zone(DEFAULT_TIMEZONE))
+    return dt.timestamp()
+
+def week_start_epoch(epoch):
+    """Unix time of Monday 00:00 UTC of the week containing ``epoch``"""
+    return epoch - (epoch - MONDAY_EPOCH) % SECONDS_PER_WEEK
+
+def next_reminder_epoch(lesson, now_epoch, offset):
+    """Unix time of a lesson's next reminder, or None if it has no reminder.
+
+    The lesson's day and time are read at UTC offset ``offset`` (in seconds). A reminder whose window is still open counts as due now; one
+    already sent (recorded in ``last_notified``) moves to the following week.
+    """
+    minute = get_reminder_minute_of_week(lesson)
+    if minute is None:
+        return None
+    fire_second = (minute * 60 - offset) % SECONDS_PER_WEEK
+    into_week = now_epoch - week_start_epoch(now_epoch)
+    # Seconds from now until the fire time, in (-window, week - window]
+    fire = now_epoch + (fire_second - (into_week - WINDOW_SECONDS) - 1) % SECONDS_PER_WEEK - WINDOW_SECONDS + 1
+    if stamp_epoch(lesson.get("last_notified")) == fire:
+        fire += SECONDS_PER_WEEK
+    return fire
+
+# Pending reminder jobs by name, so a lesson's job is found without scanning
+# every job in the queue
+_reminder_jobs = {}
+
+# Job kind of template lessons' reminders, whose "user ID" is the template number
+TEMPLATE_REMINDER = "template_reminder"
+
+def reminder_job_name(user_id, lesson_id, kind="reminder"):
+    """Name of the JobQueue job that sends a lesson's reminder"""
+    return f"{kind}:{user_id}:{lesson_id}"
+
+def schedule_reminder_job(job_queue, callback, user_id, lesson_id, fire_epoch, zone=DEFAULT_TIMEZONE, kind="reminder"):
+    """Register the one-shot job that sends a lesson's reminder at Unix time ``fire_epoch``.
+
+    ``zone`` is the timezone the lesson's time is in. Replaces any job
+    already pending for the lesson.
+    """
+    cancel_lesson_reminder(user_id, lesson_id, kind)
+    name = reminder_job_name(user_id, lesson_id, kind)
+    reminder_dt = datetime.fromtimestamp(fire_epoch, timezone.utc)
+    job = job_queue.run_once(
+        callback,
+        when=reminder_dt,
+        data={
+            "lesson_id": lesson_id,
+            "reminder_dt": reminder_dt.isoformat(),
+            "timezone": zone
+        },
+        name=name,
+        chat_id=int(user_id),
+        user_id=int(user_id),
+        job_kwargs={"misfire_grace_time": WINDOW_SECONDS}
+    )
+    _reminder_jobs[name] = job
+    return job
+
+def schedule_lesson_reminder(job_queue, callback, user_id, lesson, now_epoch, zone=DEFAULT_TIMEZONE, kind="reminder"):
+    """Register a one-shot job at the lesson's next reminder time, read in timezone ``zone``.
+
+    Replaces any job already pending for the lesson. Returns the job, or None
+    when the lesson has no reminder.
+    """
+    fire_epoch = next_reminder_epoch(lesson, now_epoch, utc_offset(zone, now_epoch))
+    if fire_epoch is None:
+        cancel_lesson_reminder(user_id, lesson["id"], kind)
+        return None
+    return schedule_reminder_job(job_queue, callback, user_id, lesson["id"], fire_epoch, zone, kind)
+
+def forget_reminder_job(job):
+    """Drop a job that has fired from the pending jobs index"""
+    if _reminder_jobs.get(job.name) is job:
+        del _reminder_jobs[job.name]
+
+def cancel_lesson_reminder(user_id, lesson_id, kind="reminder"):
+    """Remove the pending reminder job of a lesson, if any"""
+    job = _reminder_jobs.pop(reminder_job_name(user_id, lesson_id, kind), None)
+    if job is None:
+        return
+    # Imported here so the scheduling helpers stay usable without the job queue installed
+    from apscheduler.jobstores.base import JobLookupError
+    try:
+        job.schedule_removal()
+    except JobLookupError:
+        # The job already ran
+        pass
+
+async def schedule_all_reminders(job_queue, callback, table, now_epoch, skip_user=None, batch_size=1000, kind="reminder"):
+    """Register reminder jobs for every lesson in a LessonTable.
+
+    Next fire times for all lessons are computed in one vectorized pass. Jobs
+    are registered in batches of ``batch_size``, yielding to the event loop in
+    between so updates are still handled while a large table is armed; lessons
+    of users for which ``skip_user(user_id)`` is true are left alone. Returns
+    the number of jobs registered.
+    """
+    fire_epochs = table.next_fire_epochs(now_epoch)
+    count = 0
+    for index, fire_epoch in enumerate(fire_epochs.tolist()):
+        if index % batch_size == batch_size - 1:
+            await asyncio.sleep(0)
+        user_id, lesson_id = table.lesson_at(index)
+        if skip_user is not None and skip_user(user_id):
+            continue
+        schedule_reminder_job(job_queue, callback, user_id, lesson_id, fire_epoch, table.zone_at(index), kind)
+        count += 1
+    return count
+
+def find_missed_reminders(table, now_epoch, lookback, limit):
+    """Reminders of a LessonTable that fired in the last ``lookback`` and were never sent.
+
+    Covers reminder times from ``now - lookback`` up to the start of the
+    current window (reminders inside it are still due and get their job as
+    usual), leaving out lessons that have already started. Returns at most
+    ``limit`` ``(user_id, lesson_id, reminder_dt)`` tuples, soonest lesson
+    first, with ``reminder_dt`` in UTC.
+    """
+    # Up to and including now - window, the last fire time no longer armed
+    indices, fire_epochs = table.due_between(
+        now_epoch - int(lookback.total_seconds()), now_epoch - WINDOW_SECONDS + 1
+    )
+    lesson_starts = fire_epochs + table.offsets[indices].astype(fire_epochs.dtype) * 60
+    upcoming = lesson_starts > now_epoch
+    indices, fire_epochs, lesson_starts = indices[upcoming], fire_epochs[upcoming], lesson_starts[upcoming]
+    order = lesson_starts.argsort(kind="stable")[:limit]
+    return [
+        (*table.lesson_at(indices[i]), datetime.fromtimestamp(int(fire_epochs[i]), timezone.utc))
+        for i in order.tolist()
+    ]
@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+
+class RenderCache:
+    """LRU cache of rendered schedule messages, tagged with a schedule version.
+
+    Entries are keyed by anything hashable (e.g. ``(user_id, view)``) and only
+    returned while the stored version equals the caller's current one, so a
+    mutated schedule is rendered again on its next view. At most ``maxsize``
+    entries are kept; the least recently used is evicted first.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """Return the cached text for ``key`` rendered at ``version``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, text):
+        with self._lock:
+            self._entries[key] = (version, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
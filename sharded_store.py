@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import re
+import zlib
+
+from json_store import JsonLessonStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+# Metadata is spread over this many files, so a change rewrites only a slice of it
+META_BUCKETS = 64
+
+_USER_ID_RE = re.compile(r"^-?\d+$")
+
+def fsync_directory(path):
+    """Make the creation, rename or removal of entries in a directory durable"""
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path, payload, sync=False):
+    """Replace ``path`` with ``payload`` through a temp file and a rename.
+
+    With ``sync`` the new contents and the rename are on disk when this returns.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if sync:
+        fsync_directory(os.path.dirname(path))
+
+class ShardedLessonStore(JsonLessonStore):
+    """Lessons stored as one JSON file per user under a data directory.
+
+    Layout::
+
+        <directory>/manifest.json             list of user IDs
+        <directory>/users/<bucket>/<id>.json  one user's lessons
+        <directory>/meta/<nn>.json            metadata keys hashing to bucket nn
+
+    where ``bucket`` is the last two digits of the user ID, so no directory
+    grows past a few thousand files. A mutation rewrites only the file of the
+    user it touches; the manifest is only rewritten when a user is added or
+    removed, and is what the store enumerates on startup.
+
+    Every file is written atomically (temp file plus rename). A user is added
+    to the manifest before their file is first written, so a crash in between
+    leaves an entry without a file, which reads as a user without lessons.
+
+    Lessons are kept in memory as in JsonLessonStore, but files changed by
+    other processes are not picked up. An existing single lessons file and
+    its metadata file are migrated the first time the directory is opened.
+    """
+
+    def __init__(self, directory, json_path=None):
+        super().__init__(os.path.join(directory, MANIFEST_FILE))
+        self.directory = directory
+        self._manifest_users = set()
+        self._manifest_version = 0
+        self._user_versions = {}
+        self._meta_bucket_versions = {}
+        os.makedirs(os.path.join(directory, "users"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "meta"), exist_ok=True)
+        if json_path and not os.path.exists(self.path):
+            self._migrate_from_json(json_path)
+
+    def user_path(self, user_id_str):
+        if not _USER_ID_RE.match(user_id_str):
+            raise ValueError(f"Invalid user ID: {user_id_str!r}")
+        return os.path.join(self.directory, "users", user_id_str[-2:], f"{user_id_str}.json")
+
+    def _migrate_from_json(self, json_path):
+        """Split an existing single lessons file into per-user files, and its metadata into buckets"""
+        if not os.path.exists(json_path):
+            return
+        with open(json_path, 'r') as f:
+            raw = json.load(f)
+        meta = {}
+        meta_path = f"{os.path.splitext(json_path)[0]}.meta.json"
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        with self._lock:
+            self._data, _ = self._index_lessons(raw)
+            self._loaded = True
+            version, users, manifest = self._snapshot()
+            self._meta = meta
+            self._meta_bucket_keys = {bucket: set() for bucket in range(META_BUCKETS)}
+            meta_snapshot = self._meta_snapshot(list(meta))
+        # The manifest goes last: until it exists the migration is redone on the next start
+        self._write_meta(meta_snapshot)
+        self._write((version, users, None))
+        self._write((version, {}, manifest))
+        logger.info("Migrated %d users from %s to %s", len(raw), json_path, self.directory)
+
+    def reload_count(self):
+        # Changes made by other processes aren't picked up
+        return 0
+
+    def data_stamp(self):
+        # User files change without the manifest, and statting all of them
+        # costs as much as reading them
+        return None
+
+    def meta_bucket_path(self, bucket):
+        return os.path.join(self.directory, "meta", f"{bucket:02x}.json")
+
+    def meta(self):
+        """Return the live metadata dict, reading every bucket file on first use.
+
+        Callers must hold the store lock while using the result.
+        """
+        with self._lock:
+            if self._meta is None:
+                meta = {}
+                # Keys of each bucket, so writing a bucket doesn't scan all metadata
+                self._meta_bucket_keys = {bucket: set() for bucket in range(META_BUCKETS)}
+                for bucket in range(META_BUCKETS):
+                    try:
+                        with open(self.meta_bucket_path(bucket), 'r') as f:
+                            content = json.load(f)
+                    except FileNotFoundError:
+                        continue
+                    meta.update(content)
+                    self._meta_bucket_keys[bucket].update(content)
+                self._meta = meta
+            return self._meta
+
+    def _meta_snapshot(self, keys):
+        """Serialize the metadata buckets holding ``keys``"""
+        self._meta_version += 1
+        buckets = set()
+        for key in keys:
+            bucket = _meta_bucket(key)
+            buckets.add(bucket)
+            if key in self._meta:
+                self._meta_bucket_keys[bucket].add(key)
+            else:
+                self._meta_bucket_keys[bucket].discard(key)
+        return self._meta_version, {
+            bucket: json.dumps({key: self._meta[key] for key in sorted(self._meta_bucket_keys[bucket])}, indent=4)
+            for bucket in buckets
+        }
+
+    def _write_meta(self, snapshot):
+        version, buckets = snapshot
+        with self._write_lock:
+            for bucket, payload in buckets.items():
+                if version <= self._meta_bucket_versions.get(bucket, 0):
+                    continue
+                atomic_write(self.meta_bucket_path(bucket), payload)
+                self._meta_bucket_versions[bucket] = version
+
+    def _read_file(self):
+        """Read the manifest and every user file it lists"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            user_ids = json.load(f)
+        raw = {}
+        for user_id_str in user_ids:
+            try:
+                with open(self.user_path(user_id_str), 'r') as f:
+                    raw[user_id_str] = json.load(f)
+            except FileNotFoundError:
+                raw[user_id_str] = []
+        self._manifest_users = set(user_ids)
+        return raw
+
+    def data(self):
+        """Return the live {user_id: {lesson_id: lesson}} index, loading it on first use.
+
+        Callers must hold the store lock through _locked() while using the result.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._data, assigned = self._index_lessons(self._read_file())
+                self._loaded = True
+                if assigned:
+                    # Written by _locked() once the lock is released
+                    self._ids_snapshot = self._snapshot()
+            return self._data
+
+    def _snapshot(self, user_ids=None):
+        """Serialize the changed users, and the manifest if the set of users changed"""
+        self._version += 1
+        manifest = None
+        if user_ids is None:
+            user_ids = list(self._data)
+            if set(self._data) != self._manifest_users:
+                manifest = (sorted(self._data), self._manifest_users - set(self._data))
+        elif any(user_id_str not in self._manifest_users for user_id_str in user_ids):
+            manifest = (sorted(self._manifest_users.union(user_ids)), set())
+        if manifest is not None:
+            self._manifest_users = set(manifest[0])
+        users = {
+            user_id_str: json.dumps(
+                [lesson.to_dict() for lesson in self._data[user_id_str].values()], indent=4
+            )
+            for user_id_str in user_ids
+            if user_id_str in self._data
+        }
+        return self._version, users, manifest
+
+    def _write(self, snapshot):
+        """Write a snapshot's files, skipping any a newer snapshot already wrote"""
+        version, users, manifest = snapshot
+        with self._write_lock:
+            if manifest is not None and version > self._manifest_version:
+                user_ids, removed = manifest
+                # Add users to the manifest before writing their files
+                atomic_write(self.path, json.dumps(user_ids, indent=4))
+                self._manifest_version = version
+                for user_id_str in removed:
+                    try:
+                        os.remove(self.user_path(user_id_str))
+                    except FileNotFoundError:
+                        pass
+            for user_id_str, payload in users.items():
+                if version <= self._user_versions.get(user_id_str, 0):
+                    continue
+                path = self.user_path(user_id_str)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                atomic_write(path, payload)
+                self._user_versions[user_id_str] = version
+
+def _meta_bucket(key):
+    return zlib.crc32(key.encode()) % META_BUCKETS
@@ -0,0 +1,359 @@
+import json
+import os
+import sqlite3
+import threading
+
+from lessons import new_lesson_id
+from reminders import get_reminder_minute_of_week
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lessons (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    lesson_id TEXT,
+    day TEXT NOT NULL,
+    time TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    notification_time TEXT,
+    last_notified TEXT,
+    fire_minute INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_lessons_user ON lessons (user_id);
+CREATE INDEX IF NOT EXISTS idx_lessons_user_day_time ON lessons (user_id, day, time);
+CREATE INDEX IF NOT EXISTS idx_lessons_fire_minute ON lessons (fire_minute);
+DROP INDEX IF EXISTS idx_lessons_day_time;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+CREATE TRIGGER IF NOT EXISTS lessons_generation_insert AFTER INSERT ON lessons BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS lessons_generation_update AFTER UPDATE ON lessons BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS lessons_generation_delete AFTER DELETE ON lessons BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS kv_generation_insert AFTER INSERT ON kv BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS kv_generation_update AFTER UPDATE ON kv BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+CREATE TRIGGER IF NOT EXISTS kv_generation_delete AFTER DELETE ON kv BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'generation';
+END;
+"""
+
+LESSON_COLUMNS = "id, user_id, lesson_id, day, time, subject, notification_time, last_notified"
+
+# Values bound per IN (...) list, well below SQLite's limit on query parameters
+IN_BATCH_SIZE = 500
+
+def _batches(values):
+    values = sorted(values)
+    for start in range(0, len(values), IN_BATCH_SIZE):
+        yield values[start:start + IN_BATCH_SIZE]
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+def _row_to_lesson(row):
+    return {
+        "id": row[2],
+        "day": row[3],
+        "time": row[4],
+        "subject": row[5],
+        "notification_time": row[6],
+        "last_notified": row[7]
+    }
+
+class SqliteLessonStore:
+    """Lessons stored one row per lesson in an SQLite database (WAL mode).
+
+    Every mutation touches only the row it changes, found through the unique
+    (user_id, lesson_id) index. ``fire_minute`` holds the precomputed minute of
+    the week at which the lesson's reminder fires, so reminder lookups are an
+    indexed range query.
+
+    Writes and reads use separate connections, so thanks to WAL a read never
+    waits for a write transaction to finish. Metadata (template references,
+    user settings, ...) lives in the ``kv`` table as JSON values. Triggers
+    count every change to lessons and metadata in the ``generation`` meta
+    row, which ``data_stamp()`` reports.
+    """
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        if json_path:
+            self._migrate_from_json(json_path)
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(path, check_same_thread=False)
+
+    def _upgrade_schema(self):
+        """Give lessons from databases created before lesson IDs an ID"""
+        with self._lock, self._conn:
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(lessons)")]
+            if "lesson_id" not in columns:
+                self._conn.execute("ALTER TABLE lessons ADD COLUMN lesson_id TEXT")
+            rows = self._conn.execute(
+                "SELECT id, user_id FROM lessons WHERE lesson_id IS NULL"
+            ).fetchall()
+            taken = {}
+            for row_id, user_id_str in rows:
+                if user_id_str not in taken:
+                    taken[user_id_str] = self._user_lesson_ids(user_id_str)
+                lesson_id = new_lesson_id(taken[user_id_str])
+                taken[user_id_str].add(lesson_id)
+                self._conn.execute(
+                    "UPDATE lessons SET lesson_id = ? WHERE id = ?", (lesson_id, row_id)
+                )
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_lessons_user_lesson ON lessons (user_id, lesson_id)"
+            )
+
+    def _migrate_from_json(self, json_path):
+        """One-shot import of an existing lessons_data.json and its metadata file"""
+        with self._lock, self._conn:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_from_json'"
+            ).fetchone()
+            if done or not os.path.exists(json_path):
+                return
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            for user_id_str, lessons in data.items():
+                self._insert_lessons(user_id_str, lessons)
+            meta_path = f"{os.path.splitext(json_path)[0]}.meta.json"
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value, separators=(",", ":"))) for key, value in meta.items()]
+                )
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (json_path,)
+            )
+
+    def _user_lesson_ids(self, user_id_str):
+        return {
+            row[0] for row in self._conn.execute(
+                "SELECT lesson_id FROM lessons WHERE user_id = ?", (user_id_str,)
+            )
+        }
+
+    def _insert_lessons(self, user_id_str, lessons):
+        """Insert lessons, keeping their IDs where possible; returns the stored lessons"""
+        taken = self._user_lesson_ids(user_id_str)
+        stored = []
+        for lesson in lessons:
+            lesson = dict(lesson)
+            if not lesson.get("id") or lesson["id"] in taken:
+                lesson["id"] = new_lesson_id(taken)
+            taken.add(lesson["id"])
+            lesson["day"] = lesson["day"].lower()
+            stored.append(lesson)
+        self._conn.executemany(
+            "INSERT INTO lessons (user_id, lesson_id, day, time, subject, notification_time, last_notified, fire_minute) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    user_id_str,
+                    lesson["id"],
+                    lesson["day"],
+                    lesson["time"],
+                    lesson["subject"],
+                    lesson.get("notification_time"),
+                    lesson.get("last_notified"),
+                    get_reminder_minute_of_week(lesson)
+                )
+                for lesson in stored
+            ]
+        )
+        return stored
+
+    def data_stamp(self):
+        """Changes whenever the stored lessons do, whichever process changed them"""
+        with self._read_lock:
+            generation = self._read_conn.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()[0]
+        return (os.stat(self.path).st_ino, int(generation))
+
+    def reload_count(self):
+        # Reads always see the database; only the process answering updates
+        # changes what schedules look like
+        return 0
+
+    def all_lessons(self):
+        with self._read_lock:
+            rows = self._read_conn.execute(f"SELECT {LESSON_COLUMNS} FROM lessons ORDER BY id").fetchall()
+        data = {}
+        for row in rows:
+            data.setdefault(row[1], []).append(_row_to_lesson(row))
+        return data
+
+    def user_lessons(self, user_id_str):
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"SELECT {LESSON_COLUMNS} FROM lessons WHERE user_id = ? ORDER BY id",
+                (user_id_str,)
+            ).fetchall()
+        return [_row_to_lesson(row) for row in rows]
+
+    def user_ids_after(self, after, limit):
+        """The first ``limit`` user IDs greater than ``after``, in string order"""
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT DISTINCT user_id FROM lessons WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_lesson(self, user_id_str, lesson_id):
+        with self._read_lock:
+            row = self._read_conn.execute(
+                f"SELECT {LESSON_COLUMNS} FROM lessons WHERE user_id = ? AND lesson_id = ?",
+                (user_id_str, lesson_id)
+            ).fetchone()
+        return _row_to_lesson(row) if row else None
+
+    def add_lesson(self, user_id_str, lesson):
+        with self._lock, self._conn:
+            return self._insert_lessons(user_id_str, [dict(lesson, id=None)])[0]
+
+    def remove_lesson(self, user_id_str, lesson_id):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM lessons WHERE user_id = ? AND lesson_id = ?",
+                (user_id_str, lesson_id)
+            )
+        return cursor.rowcount > 0
+
+    def update_lessons(self, updates):
+        """Apply several ``(user_id, lesson_id, fields)`` updates in a single transaction"""
+        updated = 0
+        with self._lock, self._conn:
+            for user_id_str, lesson_id, fields in updates:
+                row = self._conn.execute(
+                    f"SELECT {LESSON_COLUMNS} FROM lessons WHERE user_id = ? AND lesson_id = ?",
+                    (user_id_str, lesson_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                lesson = _row_to_lesson(row)
+                lesson.update(fields)
+                self._conn.execute(
+                    "UPDATE lessons SET notification_time = ?, last_notified = ?, fire_minute = ? WHERE id = ?",
+                    (
+                        lesson["notification_time"],
+                        lesson["last_notified"],
+                        get_reminder_minute_of_week(lesson),
+                        row[0]
+                    )
+                )
+                updated += 1
+        return updated
+
+    def set_user_lessons(self, user_id_str, lessons):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM lessons WHERE user_id = ?", (user_id_str,))
+            self._insert_lessons(user_id_str, lessons)
+
+    def replace_all(self, data):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM lessons")
+            for user_id_str, lessons in data.items():
+                self._insert_lessons(user_id_str, lessons)
+
+    def lessons_firing_between(self, start_minute, end_minute):
+        if start_minute <= end_minute:
+            where, params = "fire_minute >= ? AND fire_minute < ?", (start_minute, end_minute)
+        else:
+            where, params = "fire_minute >= ? OR fire_minute < ?", (start_minute, end_minute)
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"SELECT {LESSON_COLUMNS} FROM lessons WHERE fire_minute IS NOT NULL AND ({where}) "
+                "ORDER BY fire_minute, id",
+                params
+            ).fetchall()
+        data = {}
+        for row in rows:
+            data.setdefault(row[1], []).append(_row_to_lesson(row))
+        return data
+
+    def lessons_on_day(self, day, user_ids):
+        """Lessons on ``day`` of the users in ``user_ids``, as {user_id: [lesson, ...]}"""
+        # Each user's lessons of the day are one range of the (user_id, day, time) index
+        rows = []
+        with self._read_lock:
+            for batch in _batches(user_ids):
+                rows.extend(self._read_conn.execute(
+                    f"SELECT {LESSON_COLUMNS} FROM lessons WHERE day = ? AND user_id IN ({_placeholders(batch)}) "
+                    "ORDER BY user_id, time, id",
+                    (day, *batch)
+                ).fetchall())
+        data = {}
+        for row in rows:
+            data.setdefault(row[1], []).append(_row_to_lesson(row))
+        return data
+
+    def get_meta(self, key):
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_meta_many(self, keys):
+        """Values of those of ``keys`` that are set, as {key: value}"""
+        rows = []
+        with self._read_lock:
+            for batch in _batches(keys):
+                rows.extend(self._read_conn.execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({_placeholders(batch)})", batch
+                ).fetchall())
+        return {key: json.loads(value) for key, value in rows}
+
+    def meta_items(self, prefix):
+        # A range over the primary key, so the scan uses its index
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT key, value FROM kv WHERE key >= ? AND key < ?", (prefix, upper)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def meta_keys_after(self, prefix, after, limit):
+        """The first ``limit`` metadata keys starting with ``prefix`` and greater than ``after``"""
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT key FROM kv WHERE key > ? AND key >= ? AND key < ? ORDER BY key LIMIT ?",
+                (after, prefix, upper, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def update_meta(self, changes):
+        """Set several metadata keys in one transaction; a value of None deletes the key"""
+        with self._lock, self._conn:
+            for key, value in changes.items():
+                if value is None:
+                    self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                        (key, json.dumps(value, separators=(",", ":")))
+                    )
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+import profiling
+
+# Async versions of the database.py functions for use from the bot's event loop.
+# Storage calls run in dedicated threads so a slow file rewrite doesn't stall
+# other updates. Mutations go through a single writer thread and keep their
+# order; reads use a separate small pool so they don't queue behind a write.
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-write")
+_read_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="storage-read")
+
+async def _run(executor, func, *args):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
+    finally:
+        # Including the time queued, which the handler waited as well
+        metrics.add_call_time("storage", time.perf_counter() - start)
+
+def _timed(func):
+    """Record the duration of each call (in the storage thread, so queueing isn't counted)"""
+    histogram = metrics.STORAGE_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with histogram.time():
+            if profiling.cpu_capture is None:
+                return func(*args)
+            return profiling.run_profiled(func, *args)
+    return wrapper
+
+def _reader(func):
+    func = _timed(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args):
+        return await _run(_read_executor, func, *args)
+    return wrapper
+
+def _writer(func):
+    func = _timed(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args):
+        return await _run(_write_executor, func, *args)
+    return wrapper
+
+get_user_lessons = _reader(database.get_user_lessons)
+get_own_lessons = _reader(database.get_own_lessons)
+get_lesson = _reader(database.get_lesson)
+get_day_lessons = _reader(database.get_day_lessons)
+get_week_schedule = _reader(database.get_week_schedule)
+get_reminder_lessons = _reader(database.get_reminder_lessons)
+get_lessons_firing_between = _reader(database.get_lessons_firing_between)
+data_stamp = _reader(database.data_stamp)
+get_followed_template = _reader(database.get_followed_template)
+get_template_followers = _reader(database.get_template_followers)
+get_template_reminder_lessons = _reader(database.get_template_reminder_lessons)
+get_template_lessons_firing_between = _reader(database.get_template_lessons_firing_between)
+get_user_timezone = _reader(database.get_user_timezone)
+get_user_timezones = _reader(database.get_user_timezones)
+get_zone_reminder_lessons = _reader(database.get_zone_reminder_lessons)
+get_user_data = _reader(database.get_user_data)
+get_conversations = _reader(database.get_conversations)
+get_user_ids_after = _reader(database.get_user_ids_after)
+get_broadcast = _reader(database.get_broadcast)
+get_digest_time = _reader(database.get_digest_time)
+get_digest_subscribers = _reader(database.get_digest_subscribers)
+get_day_lessons_of_users = _reader(database.get_day_lessons_of_users)
+# Checks whether the files were edited elsewhere, which may mean loading the store or reloading them
+schedule_version = _reader(database.schedule_version)
+
+add_lesson = _writer(database.add_lesson)
+remove_lesson = _writer(database.remove_lesson)
+update_lesson_reminder = _writer(database.update_lesson_reminder)
+update_lessons_last_notified = _writer(database.update_lessons_last_notified)
+seed_user_lessons_from_existing = _writer(database.seed_user_lessons_from_existing)
+update_template_notified = _writer(database.update_template_notified)
+set_user_timezone = _writer(database.set_user_timezone)
+save_bot_state = _writer(database.save_bot_state)
+save_broadcast = _writer(database.save_broadcast)
+set_digest_time = _writer(database.set_digest_time)
+
+# Dict lookups without storage access, cheap enough to call directly from the event loop
+user_schedule_version = database.user_schedule_version
+version_mark = database.version_mark
+
+def shutdown():
+    """Wait for queued writes to finish and stop the storage threads"""
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
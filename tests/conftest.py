@@ -0,0 +1,50 @@
+import importlib.util
+import sys
+import types
+
+import pytest
+
+import database
+from json_store import JsonLessonStore
+
+# bot.py reads its token from config.py, which is kept out of the repository
+if importlib.util.find_spec("config") is None:
+    sys.modules["config"] = types.SimpleNamespace(BOT_TOKEN="0:test")
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A JSON lesson store in a temp directory, used by database.py"""
+    store = JsonLessonStore(str(tmp_path / "lessons_data.json"))
+    monkeypatch.setattr(database, "_store", store)
+    monkeypatch.setattr(database, "_templates", {})
+    return store
+
+class FakeJob:
+    def __init__(self, name, when, data):
+        self.name = name
+        self.when = when
+        self.data = data
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+class FakeJobQueue:
+    """Records run_once calls instead of scheduling anything"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None, **kwargs):
+        job = FakeJob(name, when, data)
+        self.jobs.append(job)
+        return job
+
+    def pending(self):
+        return {job.name for job in self.jobs if not job.removed}
+
+@pytest.fixture
+def job_queue(monkeypatch):
+    import reminders
+    monkeypatch.setattr(reminders, "_reminder_jobs", {})
+    return FakeJobQueue()
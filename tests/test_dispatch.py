@@ -0,0 +1,119 @@
+import asyncio
+import types
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+import dispatch
+from dispatch import MessageDispatcher, TokenBucket
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dispatch, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+@pytest.fixture
+def sleeps(clock, monkeypatch):
+    """Delays the dispatcher sleeps for, passed on the fake clock instead of waited"""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        clock.now += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return delays
+
+def test_token_bucket_allows_a_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert bucket.try_acquire() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.try_acquire() == 0
+    # Refills up to the capacity, not beyond
+    clock.now += 60
+    assert bucket.is_full()
+    assert [bucket.try_acquire() for _ in range(4)][-1] == pytest.approx(0.5)
+
+def _run(dispatcher, messages):
+    async def run():
+        dispatcher.start()
+        for chat_id, text in messages:
+            dispatcher.submit(chat_id, text)
+        await dispatcher.join()
+        await dispatcher.stop()
+    asyncio.run(run())
+
+def test_dispatcher_paces_each_chat(sleeps):
+    sent = []
+
+    async def send(chat_id, text):
+        sent.append((chat_id, text))
+
+    dispatcher = MessageDispatcher(send, workers=4, rate=1000, per_chat_rate=1, per_chat_burst=2)
+    _run(dispatcher, [(1, "a"), (1, "b"), (1, "c"), (2, "d")])
+    assert sorted(sent) == [(1, "a"), (1, "b"), (1, "c"), (2, "d")]
+    assert dispatcher.sent == 4
+    # Chat 1's third message waited for a token; chat 2 didn't
+    assert sleeps == [pytest.approx(1)]
+
+def _failing(errors):
+    """A send raising ``errors`` in turn, then succeeding"""
+    calls = []
+
+    async def send(chat_id, text):
+        calls.append(text)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+    return send, calls
+
+def _dispatcher(send):
+    return MessageDispatcher(
+        send, workers=1, transient_errors=(NetworkError,), final_errors=(BadRequest, TimedOut)
+    )
+
+def test_dispatcher_retries_flood_control_and_network_errors(sleeps):
+    send, calls = _failing([RetryAfter(7), NetworkError("connection refused")])
+    dispatcher = _dispatcher(send)
+    _run(dispatcher, [(1, "a")])
+    assert calls == ["a", "a", "a"]
+    assert (dispatcher.sent, dispatcher.failed) == (1, 0)
+    assert sleeps == [7, 4]
+
+def test_dispatcher_gives_up_after_max_retries(sleeps):
+    send, calls = _failing([NetworkError("connection refused")] * 5)
+    dispatcher = _dispatcher(send)
+    _run(dispatcher, [(1, "a")])
+    assert len(calls) == dispatcher.max_retries + 1
+    assert (dispatcher.sent, dispatcher.failed) == (0, 1)
+
+@pytest.mark.parametrize("error", [TimedOut(), BadRequest("Chat not found"), ValueError("bug")])
+def test_dispatcher_drops_messages_it_must_not_resend(sleeps, error):
+    send, calls = _failing([error])
+    dispatcher = _dispatcher(send)
+    failed = []
+
+    async def run():
+        dispatcher.start()
+        dispatcher.submit(1, "a", on_failed=lambda: failed.append("a"))
+        dispatcher.submit(2, "b")
+        await dispatcher.join()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    # Sent once only; the next message goes out as usual
+    assert calls == ["a", "b"]
+    assert failed == ["a"]
+    assert (dispatcher.sent, dispatcher.failed) == (1, 1)
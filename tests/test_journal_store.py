@@ -0,0 +1,102 @@
+import os
+import threading
+
+from journal_store import JournalLessonStore
+
+LESSON = {"day": "monday", "time": "11:00", "subject": "Calculus 2", "notification_time": "15 min"}
+
+def _subjects(store, user_id_str):
+    return [lesson["subject"] for lesson in store.user_lessons(user_id_str)]
+
+def _wait_for_compaction():
+    for thread in threading.enumerate():
+        if thread.name == "journal-compaction":
+            thread.join(5)
+
+def test_journal_replays_on_top_of_the_snapshot(tmp_path):
+    path = str(tmp_path / "lessons_data.json")
+    store = JournalLessonStore(path)
+    store.add_lesson("1", LESSON)
+    store.add_lesson("1", dict(LESSON, subject="Physics 2"))
+    store.add_lesson("2", dict(LESSON, subject="Sociology"))
+    store.update_meta({"timezone:1": "Europe/Berlin", "timezone:2": "Asia/Tashkent"})
+    store.update_meta({"timezone:2": None})
+    assert not os.path.exists(path)
+
+    store = JournalLessonStore(path)
+    assert _subjects(store, "1") == ["Calculus 2", "Physics 2"]
+    assert _subjects(store, "2") == ["Sociology"]
+    assert store.meta_items("timezone:") == {"timezone:1": "Europe/Berlin"}
+
+def test_journal_drops_a_torn_trailing_record(tmp_path):
+    path = str(tmp_path / "lessons_data.json")
+    store = JournalLessonStore(path)
+    store.add_lesson("1", LESSON)
+    store.add_lesson("1", dict(LESSON, subject="Physics 2"))
+    # A crash in the middle of the last append
+    size = os.path.getsize(store.journal_path)
+    os.truncate(store.journal_path, size - 10)
+
+    store = JournalLessonStore(path)
+    assert _subjects(store, "1") == ["Calculus 2"]
+    # Cut back to the last good record, so new records aren't appended to garbage
+    store.add_lesson("1", dict(LESSON, subject="Sociology"))
+    assert _subjects(JournalLessonStore(path), "1") == ["Calculus 2", "Sociology"]
+
+def test_journal_stops_at_a_checksum_mismatch(tmp_path):
+    path = str(tmp_path / "lessons_data.json")
+    store = JournalLessonStore(path)
+    store.add_lesson("1", LESSON)
+    store.add_lesson("2", dict(LESSON, subject="Physics 2"))
+    store.add_lesson("3", dict(LESSON, subject="Sociology"))
+    with open(store.journal_path, 'rb') as f:
+        lines = f.readlines()
+    lines[1] = lines[1].replace(b"Physics", b"Phyzics")
+    with open(store.journal_path, 'wb') as f:
+        f.writelines(lines)
+
+    store = JournalLessonStore(path)
+    assert _subjects(store, "1") == ["Calculus 2"]
+    # Records after the damaged one are dropped with it
+    assert store.user_lessons("2") == []
+    assert store.user_lessons("3") == []
+    assert os.path.getsize(store.journal_path) == len(lines[0])
+
+def test_journal_compaction_writes_a_snapshot(tmp_path):
+    path = str(tmp_path / "lessons_data.json")
+    store = JournalLessonStore(path, max_journal_bytes=512)
+    for n in range(10):
+        store.add_lesson(str(n), dict(LESSON, subject=f"Subject {n}"))
+    store.update_meta({"timezone:1": "Europe/Berlin"})
+    _wait_for_compaction()
+
+    assert os.path.exists(path)
+    assert not os.path.exists(store.old_journal_path)
+    assert os.path.getsize(store.journal_path) < 512
+    store = JournalLessonStore(path)
+    assert [_subjects(store, str(n)) for n in range(10)] == [[f"Subject {n}"] for n in range(10)]
+    assert store.get_meta("timezone:1") == "Europe/Berlin"
+
+def test_journal_reads_dont_wait_for_fsync(tmp_path, monkeypatch):
+    store = JournalLessonStore(str(tmp_path / "lessons_data.json"))
+    store.add_lesson("1", LESSON)
+    release = threading.Event()
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        release.wait(5)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    writer = threading.Thread(target=store.add_lesson, args=("1", dict(LESSON, subject="Physics 2")))
+    writer.start()
+    try:
+        writer.join(0.2)
+        # The writer is stuck in fsync, after its change was made and appended
+        assert writer.is_alive()
+        assert store._lock.acquire(timeout=1), "the writer holds the store lock during fsync"
+        store._lock.release()
+        assert _subjects(store, "1") == ["Calculus 2", "Physics 2"]
+    finally:
+        release.set()
+        writer.join(5)
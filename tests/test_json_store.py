@@ -0,0 +1,30 @@
+import json
+import threading
+
+from json_store import JsonLessonStore
+
+LESSON = {"day": "monday", "time": "11:00", "subject": "Calculus 2", "notification_time": "15 min"}
+
+def test_reload_assigning_ids_writes_them_after_releasing_the_lock(tmp_path):
+    path = tmp_path / "lessons_data.json"
+    store = JsonLessonStore(str(path))
+    store.set_user_lessons("1", [LESSON])
+    # Edited by hand: a lesson without an ID, which the reload has to give one
+    path.write_text(json.dumps({"1": [LESSON, dict(LESSON, day="tuesday")]}))
+
+    # A writer in _write holds the write lock and takes the store lock next
+    store._write_lock.acquire()
+    reader = threading.Thread(target=store.all_lessons)
+    reader.start()
+    reader.join(0.5)
+    try:
+        assert store._lock.acquire(timeout=2), "the reload kept the store lock while waiting to write"
+        store._lock.release()
+    finally:
+        store._write_lock.release()
+    reader.join(5)
+    assert not reader.is_alive()
+
+    saved = json.loads(path.read_text())["1"]
+    assert len(saved) == 2 and all(lesson["id"] for lesson in saved)
+    assert [lesson["id"] for lesson in store.user_lessons("1")] == [lesson["id"] for lesson in saved]
@@ -0,0 +1,116 @@
+import types
+
+import pytest
+
+import leases
+from leases import SAFETY_MARGIN, LeaseManager, shard_of
+
+SHARDS = 4
+TTL = 30.0
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(leases, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+@pytest.fixture
+def worker(tmp_path, clock):
+    def worker(worker_id):
+        return LeaseManager(str(tmp_path / "leases.db"), worker_id, SHARDS, ttl=TTL)
+    return worker
+
+def _owners(*managers):
+    """Which workers may send for a user of each shard right now"""
+    users = {}
+    for user_id in range(1000):
+        users.setdefault(shard_of(user_id, SHARDS), user_id)
+    return {
+        shard: [manager.worker_id for manager in managers if manager.owns(user_id)]
+        for shard, user_id in sorted(users.items())
+    }
+
+def test_shard_of_is_stable_and_in_range():
+    assert shard_of(42, SHARDS) == shard_of("42", SHARDS)
+    assert {shard_of(user_id, SHARDS) for user_id in range(1000)} == set(range(SHARDS))
+
+def test_single_worker_acquires_and_renews_every_shard(worker, clock):
+    a = worker("a")
+    assert a.heartbeat() == ({shard: None for shard in range(SHARDS)}, set())
+    assert _owners(a) == {shard: ["a"] for shard in range(SHARDS)}
+
+    clock.now += TTL / 2
+    assert a.heartbeat() == ({}, set())
+    # Past the first lease's expiry, but it was renewed
+    clock.now += TTL / 2 + 1
+    assert _owners(a) == {shard: ["a"] for shard in range(SHARDS)}
+
+def test_ownership_stops_before_the_lease_expires(worker, clock):
+    a = worker("a")
+    a.heartbeat()
+    clock.now += TTL - SAFETY_MARGIN
+    assert _owners(a) == {shard: [] for shard in range(SHARDS)}
+
+def test_joining_worker_takes_over_handed_back_shards(worker, clock):
+    a = worker("a")
+    b = worker("b")
+    a.heartbeat()
+    # Every shard is still leased to a
+    assert b.heartbeat() == ({}, set())
+
+    clock.now += 1
+    acquired, handed_back = a.heartbeat()
+    assert acquired == {} and len(handed_back) == SHARDS // 2
+    acquired, lost = b.heartbeat()
+    # b is responsible from the moment a stopped sending
+    assert acquired == {shard: clock.now for shard in handed_back} and lost == set()
+    assert all(len(owners) == 1 for owners in _owners(a, b).values())
+    assert sorted(a.owned) + sorted(b.owned) == list(range(SHARDS))
+
+def test_expired_leases_of_a_dead_worker_are_taken_over(worker, clock):
+    a = worker("a")
+    b = worker("b")
+    a.heartbeat()
+    b.heartbeat()
+    a.heartbeat()
+    b.heartbeat()
+    assert b.owned
+
+    # b stops sending heartbeats; a keeps going until b's leases run out
+    for _ in range(3):
+        clock.now += TTL / 2
+        a.heartbeat()
+    assert set(a.owned) == set(range(SHARDS))
+    assert _owners(a, b) == {shard: ["a"] for shard in range(SHARDS)}
+
+def test_taken_over_shard_reports_when_the_old_owner_stopped(worker, clock):
+    a = worker("a")
+    b = worker("b")
+    a.heartbeat()
+    b.heartbeat()
+    a.heartbeat()
+    b.heartbeat()
+    b_expires = dict(b.owned)
+
+    clock.now += TTL / 2
+    assert a.heartbeat() == ({}, set())
+    clock.now += TTL / 2 + 1
+    acquired, lost = a.heartbeat()
+    assert lost == set()
+    assert acquired == {shard: expires - SAFETY_MARGIN for shard, expires in b_expires.items()}
+
+def test_release_all_hands_shards_to_the_others(worker, clock):
+    a = worker("a")
+    b = worker("b")
+    a.heartbeat()
+    a.release_all()
+    assert _owners(a) == {shard: [] for shard in range(SHARDS)}
+    acquired, _ = b.heartbeat()
+    assert acquired == {shard: clock.now for shard in range(SHARDS)}
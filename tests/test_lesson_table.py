@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from lesson_table import LessonTable
+from reminders import SECONDS_PER_WEEK, WINDOW_SECONDS, next_reminder_epoch
+from timezones import utc_offset
+
+def _epoch(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+# Monday 2026-10-12 00:00 UTC and a week in summer, when Berlin is on CEST
+MONDAY = _epoch(2026, 10, 12)
+SUMMER_MONDAY = _epoch(2026, 7, 13)
+
+# Its reminder fires at 23:50 on Sunday, the last minute block of the week
+EARLY_MONDAY = {"id": "a1", "day": "monday", "time": "00:05", "subject": "Calculus 2", "notification_time": "15 min"}
+
+def test_reminder_wraps_around_the_end_of_the_week():
+    table = LessonTable.from_lessons({"1": [EARLY_MONDAY]}, {"1": "UTC"}, MONDAY)
+    sunday_night = MONDAY + 6 * 86400 + 23 * 3600
+    assert table.next_fire_epochs(sunday_night).tolist() == [sunday_night + 50 * 60]
+    # Once past it, the next one is a week later
+    assert table.next_fire_epochs(MONDAY + 3600).tolist() == [MONDAY - 10 * 60 + SECONDS_PER_WEEK]
+
+    indices, fire = table.due_between(sunday_night, sunday_night + 2 * 3600)
+    assert indices.tolist() == [0] and fire.tolist() == [sunday_night + 50 * 60]
+    indices, _ = table.due_between(MONDAY + 60, MONDAY + 6 * 86400)
+    assert indices.tolist() == []
+
+def test_next_fire_matches_next_reminder_epoch():
+    lessons = [
+        dict(EARLY_MONDAY, id=f"l{n}", day=day, time=f"{hour:02d}:{minute:02d}", notification_time=notice)
+        for n, (day, hour, minute, notice) in enumerate([
+            ("monday", 0, 5, "15 min"), ("monday", 0, 30, "1 hour"), ("wednesday", 12, 0, "5 min"),
+            ("sunday", 23, 55, "30 min"), ("friday", 9, 0, "15 min")
+        ])
+    ]
+    for zone in ("UTC", "Asia/Bishkek", "America/New_York"):
+        for now in range(MONDAY - 3600, MONDAY + SECONDS_PER_WEEK, 7 * 3600 + 60 * 17):
+            table = LessonTable.from_lessons({"1": lessons}, {"1": zone}, now)
+            offset = utc_offset(zone, now)
+            assert table.next_fire_epochs(now).tolist() == [
+                next_reminder_epoch(lesson, now, offset) for lesson in lessons
+            ]
+
+def test_fire_times_use_each_zones_offset():
+    lesson = dict(EARLY_MONDAY, day="wednesday", time="12:00")
+    lessons = {"1": [lesson], "2": [lesson], "3": [lesson]}
+    zones = {"1": "UTC", "2": "Asia/Bishkek", "3": "Europe/Berlin"}
+    local_fire = MONDAY + 2 * 86400 + 12 * 3600 - 15 * 60
+
+    table = LessonTable.from_lessons(lessons, zones, MONDAY)
+    # Lessons of users without a timezone are in the default one
+    assert LessonTable.from_lessons({"4": [lesson]}, now_epoch=MONDAY).zone_at(0) == "Asia/Bishkek"
+    assert table.next_fire_epochs(MONDAY).tolist() == [local_fire, local_fire - 6 * 3600, local_fire - 2 * 3600]
+
+    table = LessonTable.from_lessons(lessons, zones, SUMMER_MONDAY)
+    local_fire += SUMMER_MONDAY - MONDAY
+    assert table.next_fire_epochs(SUMMER_MONDAY).tolist() == [local_fire, local_fire - 6 * 3600, local_fire - 2 * 3600]
+    indices, fire = table.due_between(local_fire - 6 * 3600, local_fire - 2 * 3600 + 1)
+    assert [table.zone_at(index) for index in indices] == ["Asia/Bishkek", "Europe/Berlin"]
+    assert fire.tolist() == [local_fire - 6 * 3600, local_fire - 2 * 3600]
+
+def test_notified_reminders_move_to_the_next_week():
+    fire = MONDAY - 10 * 60
+    notified = datetime.fromtimestamp(fire, timezone.utc).isoformat()
+    table = LessonTable.from_lessons({"1": [dict(EARLY_MONDAY, last_notified=notified)]}, {"1": "UTC"}, fire)
+    # Still inside its window, but already sent
+    assert table.next_fire_epochs(fire + WINDOW_SECONDS // 2).tolist() == [fire + SECONDS_PER_WEEK]
+    indices, _ = table.due_between(fire - 60, fire + 60)
+    assert indices.tolist() == []
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "reminder_index.bin")
+    lessons = {
+        "1": [EARLY_MONDAY, dict(EARLY_MONDAY, id="a2", day="friday", notification_time="1 hour")],
+        "2": [dict(EARLY_MONDAY, id="b1", last_notified="2026-10-11T23:50:00+00:00")],
+        # Skipped: no reminder, and a user ID that isn't a number
+        "3": [dict(EARLY_MONDAY, id="c1", notification_time=None)],
+        "template": [EARLY_MONDAY],
+    }
+    table = LessonTable.from_lessons(lessons, {"2": "Europe/Berlin"}, MONDAY)
+    assert len(table) == 3
+    table.save(path, stamp=("lessons", 1))
+
+    assert LessonTable.load(path, ("lessons", 2), MONDAY) is None
+    assert LessonTable.load(str(tmp_path / "missing.bin"), ("lessons", 1), MONDAY) is None
+    loaded = LessonTable.load(path, ("lessons", 1), MONDAY)
+    for name in ("user_ids", "weekdays", "lesson_minutes", "offsets", "zone_ids", "fire_seconds"):
+        assert getattr(loaded, name).dtype == getattr(table, name).dtype
+        assert np.array_equal(getattr(loaded, name), getattr(table, name))
+    assert np.array_equal(loaded.last_notified, table.last_notified, equal_nan=True)
+    assert loaded.lesson_ids.tolist() == ["a1", "a2", "b1"]
+    assert loaded.zones == table.zones
+    assert loaded.next_fire_epochs(MONDAY).tolist() == table.next_fire_epochs(MONDAY).tolist()
+
+def test_load_rejects_a_damaged_snapshot(tmp_path):
+    path = tmp_path / "reminder_index.bin"
+    LessonTable.from_lessons({"1": [EARLY_MONDAY]}, now_epoch=MONDAY).save(str(path), stamp=1)
+    path.write_bytes(path.read_bytes()[:20])
+    assert LessonTable.load(str(path), 1, MONDAY) is None
@@ -0,0 +1,50 @@
+import pytest
+
+import database
+from sharded_store import ShardedLessonStore
+from sqlite_store import SqliteLessonStore
+
+FOLLOWER_ID = "42"
+
+TEMPLATE_LESSONS = [
+    {"day": "monday", "time": "11:00", "subject": "Calculus 2", "notification_time": "15 min"},
+    {"day": "wednesday", "time": "09:00", "subject": "Physics 2", "notification_time": "15 min"},
+]
+
+@pytest.fixture
+def seeded_json(store):
+    """A lessons file and metadata file holding the template user and one follower seeded from it"""
+    store.set_user_lessons(database.TEMPLATE_USER_ID, TEMPLATE_LESSONS)
+    assert database.seed_user_lessons_from_existing(FOLLOWER_ID)
+    schedule = database.get_user_lessons(FOLLOWER_ID)
+    assert store.user_lessons(FOLLOWER_ID) == []
+    return store.path, store.meta_items(""), schedule
+
+def _check_migrated(store, meta, schedule, monkeypatch):
+    for key, value in meta.items():
+        assert store.get_meta(key) == value
+    monkeypatch.setattr(database, "_store", store)
+    monkeypatch.setattr(database, "_templates", {})
+    assert database.get_followed_template(FOLLOWER_ID) is not None
+    assert database.get_user_lessons(FOLLOWER_ID) == schedule
+
+def test_sqlite_migrates_seeded_follower(seeded_json, tmp_path, monkeypatch):
+    json_path, meta, schedule = seeded_json
+    store = SqliteLessonStore(str(tmp_path / "lessons.db"), json_path=json_path)
+    _check_migrated(store, meta, schedule, monkeypatch)
+
+def test_sqlite_migration_runs_once(seeded_json, tmp_path):
+    json_path, meta, _ = seeded_json
+    db_path = str(tmp_path / "lessons.db")
+    store = SqliteLessonStore(db_path, json_path=json_path)
+    store.update_meta({key: None for key in meta})
+    store = SqliteLessonStore(db_path, json_path=json_path)
+    assert all(store.get_meta(key) is None for key in meta)
+
+def test_sharded_migrates_seeded_follower(seeded_json, tmp_path, monkeypatch):
+    json_path, meta, schedule = seeded_json
+    directory = str(tmp_path / "lessons_data")
+    ShardedLessonStore(directory, json_path=json_path)
+    # Read back from the files, not from what the migrating store holds in memory
+    store = ShardedLessonStore(directory, json_path=json_path)
+    _check_migrated(store, meta, schedule, monkeypatch)
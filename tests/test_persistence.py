@@ -0,0 +1,81 @@
+import asyncio
+import copy
+
+import database
+import storage
+from persistence import StorePersistence
+
+USER_ID = 7
+CONVERSATION = "add_lesson"
+
+async def _restart():
+    """What a freshly started bot reads back: the user's data and the open conversations"""
+    persistence = StorePersistence()
+    user_data = {}
+    await persistence.refresh_user_data(USER_ID, user_data)
+    return user_data, await persistence.get_conversations(CONVERSATION)
+
+def test_user_data_and_conversations_survive_a_restart(store):
+    async def session():
+        persistence = StorePersistence()
+        user_data = {}
+        await persistence.refresh_user_data(USER_ID, user_data)
+        assert user_data == {}
+        user_data.update(day="Monday", subject="Physics 2")
+        # As the application does it: copies of every changed entry, in one gather
+        await asyncio.gather(
+            persistence.update_user_data(USER_ID, copy.deepcopy(user_data)),
+            persistence.update_conversation(CONVERSATION, (USER_ID, USER_ID), 2),
+            persistence.update_conversation(CONVERSATION, (USER_ID, 8), 1)
+        )
+        await persistence.flush()
+
+    asyncio.run(session())
+    assert asyncio.run(_restart()) == (
+        {"day": "Monday", "subject": "Physics 2"},
+        {(USER_ID, USER_ID): 2, (USER_ID, 8): 1}
+    )
+
+def test_later_changes_and_ends_are_stored(store):
+    async def session():
+        persistence = StorePersistence()
+        user_data = {}
+        await persistence.refresh_user_data(USER_ID, user_data)
+        user_data["day"] = "Monday"
+        await persistence.update_user_data(USER_ID, copy.deepcopy(user_data))
+        await persistence.update_conversation(CONVERSATION, (USER_ID, USER_ID), 2)
+        # The same dict, changed again later in the dialog
+        user_data["subject"] = "Physics 2"
+        await persistence.update_user_data(USER_ID, copy.deepcopy(user_data))
+        assert await _restart() == ({"day": "Monday", "subject": "Physics 2"}, {(USER_ID, USER_ID): 2})
+
+        user_data.clear()
+        await asyncio.gather(
+            persistence.update_user_data(USER_ID, copy.deepcopy(user_data)),
+            persistence.update_conversation(CONVERSATION, (USER_ID, USER_ID), None)
+        )
+
+    asyncio.run(session())
+    assert asyncio.run(_restart()) == ({}, {})
+    # Nothing left behind in storage
+    assert database.get_user_data(USER_ID) is None
+    assert store.meta_items("conversation:") == {}
+
+def test_unchanged_user_data_is_not_written_again(store, monkeypatch):
+    database.save_bot_state({USER_ID: {"day": "Monday"}}, {})
+    calls = []
+
+    async def save_bot_state(*args):
+        calls.append(args)
+
+    monkeypatch.setattr(storage, "save_bot_state", save_bot_state)
+
+    async def session():
+        persistence = StorePersistence()
+        user_data = {}
+        await persistence.refresh_user_data(USER_ID, user_data)
+        assert user_data == {"day": "Monday"}
+        await persistence.update_user_data(USER_ID, copy.deepcopy(user_data))
+
+    asyncio.run(session())
+    assert calls == []
@@ -0,0 +1,38 @@
+import asyncio
+
+import bot
+import database
+from timezones import DEFAULT_TIMEZONE
+
+TEMPLATE_LESSONS = [
+    {"day": "monday", "time": "11:00", "subject": "Calculus 2", "notification_time": "15 min"},
+    {"day": "wednesday", "time": "09:00", "subject": "Physics 2", "notification_time": "15 min"},
+]
+
+NOW = 1_760_000_000
+
+def _seed_follower(store, user_id):
+    store.set_user_lessons(database.TEMPLATE_USER_ID, TEMPLATE_LESSONS)
+    assert database.seed_user_lessons_from_existing(user_id)
+
+def test_follower_in_default_zone_only_gets_own_lessons_armed(store, job_queue):
+    _seed_follower(store, "42")
+    own = database.add_lesson(42, "friday", "10:00", "Art", "5 min")
+    database.set_user_timezone(42, DEFAULT_TIMEZONE)
+
+    asyncio.run(bot.arm_user_reminders(job_queue, 42, DEFAULT_TIMEZONE, NOW))
+
+    # The template lessons are sent by the template's own job
+    assert job_queue.pending() == {f"reminder:42:{own['id']}"}
+
+def test_follower_moving_zone_gets_every_lesson_armed(store, job_queue):
+    _seed_follower(store, "42")
+    database.set_user_timezone(42, "Europe/Berlin")
+
+    asyncio.run(bot.arm_user_reminders(job_queue, 42, "Europe/Berlin", NOW))
+
+    assert database.get_followed_template(42) is None
+    lesson_ids = {lesson["id"] for lesson in database.get_user_lessons(42)}
+    assert len(lesson_ids) == len(TEMPLATE_LESSONS)
+    assert job_queue.pending() == {f"reminder:42:{lesson_id}" for lesson_id in lesson_ids}
+    assert {job.data["timezone"] for job in job_queue.jobs} == {"Europe/Berlin"}
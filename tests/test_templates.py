@@ -0,0 +1,58 @@
+import database
+
+TEMPLATE_LESSONS = [
+    {"day": "monday", "time": "11:00", "subject": "Calculus 2", "notification_time": "15 min"},
+    {"day": "wednesday", "time": "09:00", "subject": "Physics 2", "notification_time": "15 min"},
+    {"day": "friday", "time": "09:00", "subject": "Sociology", "notification_time": "15 min"},
+]
+
+def _fields(lessons):
+    return sorted((l["day"], l["time"], l["subject"], l["notification_time"]) for l in lessons)
+
+def _seed_template(store):
+    store.set_user_lessons(database.TEMPLATE_USER_ID, TEMPLATE_LESSONS)
+    return [lesson["id"] for lesson in store.user_lessons(database.TEMPLATE_USER_ID)]
+
+def test_share_template_copies_converts_copies_with_their_own_ids(store):
+    template_ids = _seed_template(store)
+    # As seeding made them before templates: the same lessons under new IDs
+    store.set_user_lessons("42", [dict(lesson, last_notified=None) for lesson in TEMPLATE_LESSONS])
+    assert not set(template_ids) & {lesson["id"] for lesson in store.user_lessons("42")}
+    schedule = _fields(database.get_user_lessons("42"))
+
+    assert database.share_template_copies() == 1
+
+    assert store.user_lessons("42") == []
+    assert database.get_followed_template("42") is not None
+    assert _fields(database.get_user_lessons("42")) == schedule
+    assert sorted(database.get_template_followers(database.get_followed_template("42"), template_ids[0])) == ["42"]
+    # Already a follower, so a second run leaves the user alone
+    assert database.share_template_copies() == 0
+
+def test_share_template_copies_keeps_changed_and_extra_lessons(store):
+    template_ids = _seed_template(store)
+    lessons = [
+        dict(TEMPLATE_LESSONS[0]),
+        dict(TEMPLATE_LESSONS[1], notification_time="1 hour"),
+        # Its ID is a template lesson's, which must not hide that lesson
+        {"id": template_ids[0], "day": "tuesday", "time": "14:00", "subject": "Art", "notification_time": None},
+    ]
+    store.set_user_lessons("43", lessons)
+    schedule = _fields(database.get_user_lessons("43"))
+
+    assert database.share_template_copies() == 1
+
+    own = store.user_lessons("43")
+    assert _fields(own) == _fields(lessons[1:])
+    assert template_ids[0] not in {lesson["id"] for lesson in own}
+    number = database.get_followed_template("43")
+    assert database.get_template_followers(number, template_ids[0]) == ["43"]
+    assert database.get_template_followers(number, template_ids[1]) == []
+    assert database.get_template_followers(number, template_ids[2]) == []
+    assert _fields(database.get_user_lessons("43")) == schedule
+
+def test_share_template_copies_skips_users_without_copies(store):
+    _seed_template(store)
+    store.set_user_lessons("44", [{"day": "monday", "time": "08:00", "subject": "Art", "notification_time": None}])
+    assert database.share_template_copies() == 0
+    assert database.get_followed_template("44") is None
@@ -0,0 +1,64 @@
+import functools
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Timezone of users who haven't chosen one, and of template schedules
+DEFAULT_TIMEZONE = "Asia/Bishkek"
+
+# Offset changes are searched for this far ahead, in steps of TRANSITION_STEP;
+# zones change their offset at most a few times a year, never twice in a step
+TRANSITION_HORIZON = 8 * 24 * 3600
+TRANSITION_STEP = 3600
+
+# zone name -> (UTC offset in seconds, start, end): the offset holds for Unix
+# times in [start, end), end being the zone's next transition (or the search
+# horizon). Lookups inside that range don't touch zoneinfo.
+_offsets = {}
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    """The ZoneInfo of an IANA timezone name; raises ZoneInfoNotFoundError for unknown names"""
+    return ZoneInfo(name)
+
+def is_valid_timezone(name):
+    try:
+        get_zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+def _zone_offset(zone, epoch):
+    return int(datetime.fromtimestamp(epoch, zone).utcoffset().total_seconds())
+
+def _next_transition(zone, epoch, offset):
+    """First Unix time after ``epoch`` with another offset, or the end of the search horizon"""
+    low = epoch
+    for high in range(epoch + TRANSITION_STEP, epoch + TRANSITION_HORIZON + 1, TRANSITION_STEP):
+        if _zone_offset(zone, high) != offset:
+            break
+        low = high
+    else:
+        return epoch + TRANSITION_HORIZON
+    # The change lies in (low, high]
+    while high - low > 1:
+        middle = (low + high) // 2
+        if _zone_offset(zone, middle) == offset:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def utc_offset(name, epoch):
+    """UTC offset of a timezone at a Unix time, in seconds east of UTC"""
+    cached = _offsets.get(name)
+    if cached is not None and cached[1] <= epoch < cached[2]:
+        return cached[0]
+    zone = get_zone(name)
+    offset = _zone_offset(zone, epoch)
+    _offsets[name] = (offset, epoch, _next_transition(zone, epoch, offset))
+    return offset
+
+def offset_valid_until(name, epoch):
+    """Unix time at which a timezone's offset at ``epoch`` next changes (or is checked again)"""
+    utc_offset(name, epoch)
+    return _offsets[name][2]
@@ -0,0 +1,43 @@
+def build_schedule_text(lessons):
+    """Return formatted schedule text grouped by day (lessons sorted by day and time)"""
+    parts = ["📅 <b>Your Weekly Schedule:</b>\n\n"]
+    current_day = None
+    for lesson in lessons:
+        day = lesson['day'].lower()
+        if day != current_day:
+            if current_day is not None:
+                parts.append("\n")
+            parts.append(f"<b>📌 {day.capitalize()}:</b>\n")
+            current_day = day
+        parts.append(f"   • {lesson['time']} - {lesson['subject']} <i>(⏰ {lesson['notification_time']})</i>\n")
+    if current_day is not None:
+        parts.append("\n")
+    return "".join(parts)
+
+def build_day_lessons_text(lessons, day, date_display, when):
+    """Return the lessons of one day (``when`` is "today" or "tomorrow") from a sorted schedule"""
+    day_lessons = [l for l in lessons if l['day'].lower() == day]
+
+    if not day_lessons:
+        return (
+            f"📅 <b>{date_display}</b>\n\n"
+            f"😴 No lessons scheduled for {when}!\n\n"
+            "Use /schedule to view your full weekly schedule."
+        )
+
+    parts = [f"📅 <b>{when.capitalize()}'s Lessons ({date_display})</b>\n\n"]
+    for i, lesson in enumerate(day_lessons, 1):
+        reminder_info = lesson.get('notification_time', 'No reminder')
+        if reminder_info == "No reminder":
+            reminder_text = "🔕 No reminder"
+        else:
+            reminder_text = f"🔔 Reminder: {reminder_info} before"
+
+        parts.append(
+            f"<b>{i}. {lesson['subject']}</b>\n"
+            f"   🕐 Time: {lesson['time']}\n"
+            f"   {reminder_text}\n\n"
+        )
+
+    parts.append(f"📚 Total: {len(day_lessons)} lesson(s) {when}")
+    return "".join(parts)